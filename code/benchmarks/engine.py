@@ -0,0 +1,163 @@
+# This benchmark measures the game engine without drawing anything. Maps of
+# any size are made up from the rules in Intro.json, with a given share of
+# the land covered in units, and then the operations that automated matches
+# do all the time are timed on them: loading the grid, working out movement
+# ranges, resolving attacks, listing legal moves, ending turns, purging a
+# team and taking snapshots. Every result is printed as one line of JSON, so
+# the output of two commits can be compared line by line.
+#
+# Run it from the code folder with "python -m benchmarks.engine". Options:
+#   --sizes=50,128,256,512   the widths (and heights) of the maps
+#   --density=0.05           the share of land tiles that have a unit
+#   --repeat=5               how many times each operation is timed
+#   --seed=1                 the seed for making the maps
+#   --out=FILE               append the results to FILE instead of printing
+
+from core import grid, rules, storage
+
+import sys
+import json
+import copy
+import random
+import timeit
+import platform
+import subprocess
+
+clock = timeit.default_timer
+
+
+# Make the data of a w by h map (the same dictionary a JSON map gives) with
+# the rules of Intro.json. Most of the map is grass, with some mountains,
+# ocean and cities. Each team gets an HQ and a factory in opposite corners,
+# and about density of the land tiles get a unit of a random team.
+def make_map(w, h, density=0.05, seed=1):
+    intro = json.loads(storage.read_data("maps","Intro.json"))
+    rng = random.Random(seed)
+    tiles = []
+    bases = {(1,1): ("HQ",0), (2,1): ("Factory",0),
+             (w-2,h-2): ("HQ",1), (w-3,h-2): ("Factory",1)}
+    for y in range(h):
+        for x in range(w):
+            tile = {"x": x, "y": y, "variables": {}}
+            if (x,y) in bases:
+                tile["terrain"],tile["team"] = bases[(x,y)]
+            else:
+                r = rng.random()
+                if r < 0.08: tile["terrain"] = "Ocean"
+                elif r < 0.18: tile["terrain"] = "Mountains"
+                elif r < 0.22:
+                    tile["terrain"] = "City"
+                    if rng.random() < 0.5: tile["team"] = rng.randrange(2)
+                else: tile["terrain"] = "Grass"
+                if tile["terrain"] != "Ocean" and rng.random() < density:
+                    name = "Infantry" if rng.random() < 0.8 else "APC"
+                    tile["unit"] = {"name": name, "team": rng.randrange(2)}
+            tiles.append(tile)
+    g = {"name": "Bench%dx%d"%(w,h), "w": w, "h": h, "variables": {},
+         "allies": [], "teams": intro["grid"]["teams"], "tiles": tiles}
+    return {"rules": intro["rules"], "players": intro["players"], "grid": g,
+            "history": []}
+
+# Make a grid from map data and start the first turn.
+def load(data):
+    g = grid.Grid(data["grid"], data["rules"])
+    g.end_turn()
+    g.forget()
+    return g
+
+# Time fn once for each of the args. Anything the grid's journal recorded is
+# rewound afterwards, outside of the timing, so every call starts from the
+# same grid.
+def measure(g, fn, args):
+    times = []
+    for a in args:
+        mark = g.checkpoint()
+        t = clock()
+        fn(a)
+        times.append(clock()-t)
+        g.rewind(mark)
+        g.forget()
+    return times
+
+# Time each operation on one map and return a list of results.
+def bench(size, density=0.05, repeat=5, seed=1):
+    data = make_map(size, size, density, seed)
+    times = {}
+    times["load"] = []
+    for i in range(repeat):
+        t = clock()
+        g = grid.Grid(data["grid"], data["rules"])
+        times["load"].append(clock()-t)
+    g = load(data)
+    team = g.current_team()
+    rng = random.Random(seed)
+    mine = [u for u in g.units_of(team) if u.x is not None]
+    sample = rng.sample(mine, min(len(mine), max(repeat,20)))
+    times["move"] = measure(g, lambda u: rules.Move(u.x,u.y,g), sample)
+
+    # Attacks are the first few that the current team can make.
+    attacks = []
+    for move in rules.legal_actions(g):
+        if move[0] == rules.MOVE_ATTACK:
+            attacks.append(rules.inputs_for(g, move))
+            if len(attacks) >= max(repeat,20):
+                break
+    times["attack"] = measure(g, lambda inputs: rules.play(g, inputs),
+                              attacks)
+    times["legal_actions"] = measure(g, lambda a: sum(1 for m in
+                                     rules.legal_actions(g)), range(repeat))
+    times["end_turn"] = measure(g, lambda a: g.end_turn(), range(repeat))
+    times["purge"] = measure(g, lambda a: g.purge(team, True), range(repeat))
+    snaps = []
+    times["snapshot"] = measure(g, lambda a: snaps.append(g.snapshot()),
+                                range(repeat))
+    times["restore"] = measure(g, lambda a: g.restore(snaps[0]),
+                               range(repeat))
+    times["deepcopy"] = measure(g, lambda a: copy.deepcopy(g), range(repeat))
+
+    report = []
+    for op in ("load","move","attack","legal_actions","end_turn","purge",
+               "snapshot","restore","deepcopy"):
+        t = times[op]
+        if not t:
+            continue
+        report.append({"op": op, "size": size, "density": density,
+                       "units": len(g.units), "n": len(t),
+                       "best_ms": 1000.0*min(t),
+                       "mean_ms": 1000.0*sum(t)/len(t)})
+    return report
+
+# Where the results came from, so they can be compared across commits.
+def environment():
+    rev = None
+    try:
+        rev = subprocess.check_output(["git","rev-parse","--short","HEAD"],
+                  stderr=subprocess.STDOUT).decode("utf-8").strip()
+    except Exception:
+        pass
+    return {"commit": rev, "python": platform.python_version(),
+            "implementation": platform.python_implementation()}
+
+# Run the benchmarks with the options from the command line.
+def main(*args):
+    opts = {"sizes": "50,128,256,512", "density": "0.05", "repeat": "5",
+            "seed": "1", "out": None}
+    for a in args:
+        if a.startswith("--") and "=" in a:
+            k,v = a[2:].split("=",1)
+            opts[k] = v
+    env = environment()
+    out = sys.stdout
+    if opts["out"]:
+        out = open(opts["out"],"a")
+    for size in [int(s) for s in opts["sizes"].split(",")]:
+        for r in bench(size, float(opts["density"]), int(opts["repeat"]),
+                       int(opts["seed"])):
+            r.update(env)
+            out.write(json.dumps(r,sort_keys=True)+"\n")
+            out.flush()
+    if out is not sys.stdout:
+        out.close()
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,196 @@
+# This benchmark measures how much it costs to draw the game. A session is
+# loaded from a map and driven through the gfx_testing mode with scripted
+# input, rendering once per input, just like the shell does. For every
+# script, it reports how long the frames took (for all of Session.render and
+# for just the sprite tree), how many cells were drawn and how much memory
+# was allocated while rendering.
+#
+# Run it from the code folder with "python -m benchmarks.render [map ...]".
+
+from graphics import gfx, gfx_testing
+from core import session, storage, rules
+
+import sys
+import json
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+clock = timeit.default_timer
+
+
+# The keys that move the cursor from one x,y to another.
+def walk(frm, to):
+    (x1,y1),(x2,y2) = frm,to
+    keys = []
+    keys += ["right"]*max(0,x2-x1) + ["left"]*max(0,x1-x2)
+    keys += ["down"]*max(0,y2-y1) + ["up"]*max(0,y1-y2)
+    return keys
+
+# Scroll the open menu to the item and select it.
+def choose(s, item):
+    for i in range(len(s.menu.items)):
+        if s.menu.info() == item:
+            break
+        yield "down"
+    yield "enter"
+
+# The first unit of the current team that is ready, and somewhere for it to
+# go.
+def mover(s):
+    for u in s.grid.units_of(s.grid.current_team()):
+        if u.ready and u.x is not None:
+            m = rules.Move(u.x,u.y,s.grid)
+            dest = max(m.choices, key=lambda d: s.grid.dist(d,(u.x,u.y)))
+            return (u.x,u.y),dest
+    return None,None
+
+# SCRIPTS. Each one is a generator that gives the keys to press one at a
+# time, so it can look at the session to decide what to press next.
+
+# Sweep the cursor back and forth across every row of the screen.
+def sweep(s):
+    w = min(s.w,s.grid.w)
+    h = min(s.h,s.grid.h)
+    for key in walk(s.cursor,(0,0)):
+        yield key
+    for y in range(h):
+        for x in range(w-1):
+            yield "right" if y%2 == 0 else "left"
+        yield "down"
+
+# Select a unit, move it as far as it can go and have it wait.
+def move(s):
+    src,dest = mover(s)
+    if src is None:
+        return
+    for key in walk(s.cursor,src)+["enter"]+walk(src,dest)+["enter"]:
+        yield key
+    for key in choose(s,"Wait"):
+        yield key
+
+# Open the main menu, scroll up and down through it and close it again.
+def menu(s):
+    for key in walk(s.cursor,(0,0))+["enter"]:
+        yield key
+    for i in range(6):
+        yield "down"
+    for i in range(6):
+        yield "up"
+    for key in choose(s,"Close"):
+        yield key
+
+# Move a unit and then cancel the move, so it's put back.
+def undo(s):
+    src,dest = mover(s)
+    if src is None:
+        return
+    for key in walk(s.cursor,src)+["enter"]+walk(src,dest)+["enter"]:
+        yield key
+    for key in choose(s,"Cancel"):
+        yield key
+
+SCRIPTS = [("sweep",sweep), ("move",move), ("menu",menu), ("undo",undo)]
+
+
+# Run a script against a fresh session of the map. Every key goes through
+# the testing input buffer, then the session handles it and renders. If
+# trace is True, the memory allocated by each frame is measured instead of
+# the time it takes, since tracing slows everything down.
+def run_script(data, script, trace=False):
+    s = session.Session(json.loads(json.dumps(data)))
+    s.render(0,0)
+    gfx_testing.reset_draws()
+
+    # Time the sprite tree on its own by wrapping the top canvas.
+    sprite_times = []
+    canvas_render = s.canvas.render
+    def timed_render(*args):
+        t = clock()
+        canvas_render(*args)
+        sprite_times.append(clock()-t)
+    s.canvas.render = timed_render
+
+    frames = []
+    draws = []
+    allocs = []
+    for key in script(s):
+        gfx_testing.add_to_buffer(key)
+        s.handle_input(gfx.get_input())
+        if trace:
+            tracemalloc.start()
+            s.render(0,0)
+            allocs.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        else:
+            t = clock()
+            s.render(0,0)
+            frames.append(clock()-t)
+        draws.append(gfx_testing.reset_draws())
+    return frames, sprite_times, draws, allocs
+
+# Run every script on a map and return a dictionary of results for each.
+# Times are in milliseconds and allocations are in bytes.
+def run(mapname, repeat=3):
+    data = json.loads(storage.read_data("maps",mapname))
+    report = []
+    for name,script in SCRIPTS:
+        best = None
+        for i in range(repeat):
+            frames, sprites, draws, allocs = run_script(data, script)
+            if best is None or sum(frames) < sum(best[0]):
+                best = frames, sprites, draws
+        frames, sprites, draws = best
+        n = max(1,len(frames))
+        result = {"map": mapname, "script": name, "frames": len(frames),
+                  "frame_ms": 1000.0*sum(frames)/n,
+                  "max_frame_ms": 1000.0*max(frames or [0]),
+                  "sprite_ms": 1000.0*sum(sprites)/n,
+                  "draws": sum(draws),
+                  "draws_per_frame": float(sum(draws))/n,
+                  "alloc_per_frame": None}
+        if tracemalloc:
+            allocs = run_script(data, script, True)[3]
+            result["alloc_per_frame"] = float(sum(allocs))/max(1,len(allocs))
+        report.append(result)
+    return report
+
+# Print the results as a table.
+def show(report):
+    print("%-12s %-6s %6s %9s %9s %9s %9s %10s"%("map","script","frames",
+          "frame ms","max ms","sprite ms","draws/f","alloc/f"))
+    for r in report:
+        alloc = "-"
+        if r["alloc_per_frame"] is not None:
+            alloc = "%.1fK"%(r["alloc_per_frame"]/1024.0)
+        print("%-12s %-6s %6d %9.3f %9.3f %9.3f %9.1f %10s"%(r["map"],
+              r["script"],r["frames"],r["frame_ms"],r["max_frame_ms"],
+              r["sprite_ms"],r["draws_per_frame"],alloc))
+
+# Benchmark the maps given on the command line (Intro.json and Empty.json by
+# default). Maps that can't be loaded are skipped. With --json, the results
+# are printed as JSON instead of a table.
+def main(*args):
+    maps = [a for a in args if not a.startswith("--")]
+    if not maps:
+        maps = ["Intro.json","Empty.json"]
+    gfx.start("testing")
+    gfx_testing.clear_buffer()
+    report = []
+    for m in maps:
+        try:
+            report += run(m)
+        except Exception as e:
+            sys.stderr.write("Skipping %s: %s\n"%(m,repr(e)))
+    gfx.stop()
+    if "--json" in args:
+        print(json.dumps(report,indent=1,sort_keys=True))
+    else:
+        show(report)
+    return report
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
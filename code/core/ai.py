@@ -0,0 +1,244 @@
+# The AI plays a team by Monte Carlo tree search over the moves that
+# rules.legal_actions gives. Each iteration walks down the tree by playing
+# moves straight onto the grid, plays a few turns of random (but aggressive)
+# moves from there, scores the result for every team and then rewinds the
+# grid's journal back to where it started. Nothing is ever copied, so an
+# iteration only costs the moves it plays.
+#
+# The search can run in more than one process. Each worker loads its own
+# grid from the saved game (the same way a session does), searches with its
+# own seed for the same amount of time, and the visits of each move at the
+# root are added up across all of them.
+
+from . import rules, replay, mapfile
+
+import io
+import math
+import time
+import random
+try:
+    from concurrent import futures
+except ImportError:
+    futures = None
+
+# The kinds of moves that get somewhere, which are tried first.
+GOOD = (rules.MOVE_ATTACK, rules.MOVE_CAPTURE, rules.MOVE_BUILD)
+
+# A node in the search tree. The move is the one that led here from the
+# parent, made by the team with the index team. The value is the total score
+# that team got from every rollout through this node.
+class Node(object):
+    __slots__ = ["move", "parent", "team", "children", "untried", "visits",
+                 "value"]
+
+    def __init__(self, move, parent, team):
+        self.move = move
+        self.parent = parent
+        self.team = team
+        self.children = []
+        self.untried = None
+        self.visits = 0
+        self.value = 0.0
+
+    # Pick the child with the best upper confidence bound.
+    def select(self, c):
+        log = math.log(self.visits)
+        best,score = None,None
+        for child in self.children:
+            s = child.value/child.visits+c*math.sqrt(log/child.visits)
+            if score is None or s > score:
+                best,score = child,s
+        return best
+
+# An AI chooses one move at a time for whichever team's turn it is. It
+# spends up to budget seconds on each turn, shared out between the moves it
+# makes. If iterations is given, each move gets exactly that many iterations
+# instead (in every worker), so that the same seed always picks the same
+# moves. Depth is the number of turns each rollout plays, and width is the
+# most moves that are tried from any node.
+class AI(object):
+    def __init__(self, budget=2.0, seed=0, workers=1, iterations=None,
+                 depth=2, width=12, explore=1.4):
+        self.budget = budget
+        self.seed = seed
+        self.workers = workers
+        self.iterations = iterations
+        self.depth = depth
+        self.width = width
+        self.explore = explore
+        self.pool = None
+        self.turn = None
+        self.spent = 0.0
+        self.moves = 0
+
+    # Choose the next move for the current team. The data and turn (the
+    # session's data and the actions committed so far this turn) are needed
+    # to search in other processes; without them, only this process is used.
+    def choose(self, grid, data=None, turn=None):
+        start = time.time()
+        key = grid.day, grid.turn
+        if key != self.turn:
+            self.turn = key
+            self.spent = 0.0
+            self.moves = 0
+        team = grid.current_team()
+        left = len([u for u in grid.units_of(team) if u.ready])+1
+        budget = max(0.05, (self.budget-self.spent)/left)
+        seed = "%s-%d-%d-%d"%(self.seed, grid.day, grid.turn, self.moves)
+        rng = random.Random(seed)
+
+        # Every process tries the same moves from the root, so that their
+        # visits can be added up.
+        moves = candidates(grid, rng, self.width)
+        args = (self.iterations, self.depth, self.width, self.explore, moves)
+
+        jobs = []
+        if self.workers > 1 and data is not None and futures:
+            if self.pool is None:
+                self.pool = futures.ProcessPoolExecutor(self.workers-1)
+            blob = mapfile.encode(data)
+            for i in range(1, self.workers):
+                jobs.append(self.pool.submit(_worker, blob, turn or [],
+                                             "%s-%d"%(seed,i), budget, args))
+        stats = search(grid, rng, budget, *args)[0]
+        for job in jobs:
+            for move,(visits,value) in job.result()[0].items():
+                v,t = stats.get(move,(0,0.0))
+                stats[move] = v+visits, t+value
+
+        self.moves += 1
+        self.spent += time.time()-start
+        if not stats:
+            return (rules.MOVE_END,)
+        return max(stats, key=lambda m: (stats[m][0], stats[m][1]))
+
+    # Shut down the worker processes.
+    def close(self):
+        if self.pool:
+            self.pool.shutdown()
+            self.pool = None
+
+# Search from the grid for budget seconds (or for exactly iterations
+# iterations) and return the visits and total value of each move from the
+# root, along with the number of iterations. The moves to try from the root
+# can be given, otherwise they're picked like any other node's. The grid is
+# left the way it was found, and its views aren't told about anything that
+# happens during the search. The threat and influence layers still are, since
+# evaluate uses them, so they're made before the search starts if they
+# haven't been yet.
+def search(grid, rng, budget, iterations=None, depth=2, width=12,
+           explore=1.4, moves=None):
+    deadline = time.time()+budget
+    root = Node(None, None, None)
+    if moves is not None:
+        root.untried = list(moves)
+    layers = grid.layers()
+    observers = grid.observers
+    grid.observers = [o for o in observers
+                      if getattr(o, "__self__", None) is layers]
+    mark = grid.checkpoint()
+    n = 0
+    try:
+        while ((iterations is None and (n == 0 or time.time() < deadline)) or
+               (iterations is not None and n < iterations)):
+            node = root
+            while node.untried == [] and node.children:
+                node = node.select(explore)
+                apply(grid, node.move)
+            if node.untried is None:
+                node.untried = [] if grid.winners else candidates(grid, rng,
+                                                                  width)
+            if node.untried:
+                move = node.untried.pop()
+                team = grid.teams.index(grid.current_team())
+                apply(grid, move)
+                child = Node(move, node, team)
+                node.children.append(child)
+                node = child
+            scores = rollout(grid, rng, depth)
+            while node is not None:
+                node.visits += 1
+                if node.team is not None:
+                    node.value += scores[node.team]
+                node = node.parent
+            grid.rewind(mark)
+            n += 1
+    finally:
+        grid.rewind(mark)
+        grid.observers = observers
+    return dict((c.move,(c.visits,c.value)) for c in root.children), n
+
+# The moves to try from a node: up to width of the legal moves, picked at
+# random (but attacks, captures and builds first), always including ending
+# the turn.
+def candidates(grid, rng, width):
+    moves = [m for m in rules.legal_actions(grid) if m[0] != rules.MOVE_END]
+    rng.shuffle(moves)
+    moves.sort(key=lambda m: m[0] not in GOOD)
+    return [(rules.MOVE_END,)]+moves[:width-1]
+
+# Play a move from legal_actions onto the grid.
+def apply(grid, move):
+    if move[0] == rules.MOVE_END:
+        grid.end_turn()
+    else:
+        rules.play(grid, rules.inputs_for(grid, move))
+
+# Play depth turns of random moves and return the score of each team. Moves
+# that attack, capture or build are picked more often than the rest, since
+# purely random play almost never gets anywhere.
+def rollout(grid, rng, depth, most=10):
+    for d in range(depth):
+        if grid.winners:
+            break
+        for i in range(most):
+            moves = [m for m in rules.legal_actions(grid)
+                     if m[0] != rules.MOVE_END]
+            if not moves:
+                break
+            good = [m for m in moves if m[0] in GOOD]
+            if good and rng.random() < 0.7:
+                moves = good
+            apply(grid, rng.choice(moves))
+        grid.end_turn()
+    return evaluate(grid)
+
+# Score the grid for each team from 0 to 1. The winners get 1. Otherwise,
+# each team gets its share of everything on the grid: its units (by what
+# they cost, times their health), its cash and its income. A unit that
+# enemies could attack on their next turn counts for less, the more of them
+# there are, unless its own team is the one about to move.
+def evaluate(grid, risk=0.25):
+    if grid.winners:
+        return [1.0 if t in grid.winners else 0.0 for t in grid.teams]
+    layers = grid.layers()
+    current = grid.current_team()
+    prices = {}
+    for t in grid.terrains[1:]:
+        for name,price in t.build.items():
+            prices[name] = max(price, prices.get(name,0))
+    worth = []
+    for t in grid.teams:
+        if not t.active:
+            worth.append(0.0)
+            continue
+        w = t.cash+1.0
+        for u in grid.units_of(t):
+            value = prices.get(u.unit,1000)*u.hp/100.0
+            if t is not current and u.x is not None:
+                value /= 1+risk*layers.danger(t, u.x, u.y)
+            w += value
+        for tile in grid.tiles_of(t):
+            w += 2*tile.income
+        worth.append(w)
+    total = sum(worth)
+    return [w/total for w in worth]
+
+# Search in a worker process. The grid is loaded from the saved game in the
+# blob and the actions committed so far this turn are played onto it.
+def _worker(blob, turn, seed, budget, args):
+    data = mapfile.read(io.BytesIO(blob))
+    grid = replay.load(data)
+    for inputs in turn:
+        rules.play(grid, replay.decode(inputs))
+    return search(grid, random.Random(seed), budget, *args)
@@ -1,6 +1,5 @@
-# Entities are TILES, OBJECTS, and TEAMS.
-
-from graphics import sprites, draw
+# Entities are TILES, OBJECTS, and TEAMS. Entities are pure game state. They
+# don't have sprites; the views draw them.
 
 # A Team is one "side" of a session in a game of RoW. Teams control Tiles and
 # Units, and may be allied with other teams. When a team is set to be inactive,
@@ -9,7 +8,7 @@ class Team(object):
     def __init__(self, data):
         self.name = data["name"]
         self.color = data["color"]
-        self.cash = 0
+        self.cash = data.get("cash",0)
         self.active = True
         self.allies = []
         self.control = "human"
@@ -20,17 +19,15 @@ class Team(object):
             return True
         return False
 
-# A Tile is a location on the grid that can hold up to one unit.
-class Tile(object):
-    def __init__(self, terrain, data):
-        self.terrain = terrain
+# A Terrain holds the rules for one kind of tile. There is only one Terrain
+# for each terrain name on a grid, and every tile of that kind shares it.
+class Terrain(object):
+    def __init__(self, name, data):
+        self.name = name
         self.icon = data["icon"]
         self.color = data["color"]
         self.cover = data["cover"]
         self.income = data.get("income",0)
-        self.hp = 100
-        self.team = None
-        self.unit = None
 
         # Set the flag properties for the terrain. A terrain with
         # "capture" can be captured by opponents. Terrain that are
@@ -44,6 +41,64 @@ class Tile(object):
         self.build = data.get("build",{})
         self.repair = data.get("repair",{})
 
+# A Tile is a location on the grid that can hold up to one unit. The grid
+# keeps its tiles in flat arrays, so a Tile is only a view of one index in
+# those arrays. Reading or writing its attributes reads or writes the grid.
+# Tiles are cheap to make and should not be held on to.
+class Tile(object):
+    __slots__ = ["grid", "i"]
+
+    def __init__(self, grid, i):
+        self.grid = grid
+        self.i = i
+
+    # The static terrain rules.
+    def _get_type(self): return self.grid.terrains[self.grid.terrain[self.i]]
+    type = property(_get_type)
+    terrain = property(lambda self: self.type.name)
+    icon = property(lambda self: self.type.icon)
+    color = property(lambda self: self.type.color)
+    cover = property(lambda self: self.type.cover)
+    income = property(lambda self: self.type.income)
+    can_capture = property(lambda self: self.type.can_capture)
+    build = property(lambda self: self.type.build)
+    repair = property(lambda self: self.type.repair)
+
+    # The state of this tile in the match.
+    def _get_team(self):
+        o = self.grid.owner[self.i]
+        if o < 0: return None
+        return self.grid.teams[o]
+    def _set_team(self, team):
+        if team is None: self.grid._set_owner(self.i, -1)
+        else: self.grid._set_owner(self.i, self.grid.teams.index(team))
+    team = property(_get_team, _set_team)
+
+    def _get_hp(self): return self.grid.tile_hp[self.i]
+    def _set_hp(self, hp): self.grid.tile_hp[self.i] = hp
+    hp = property(_get_hp, _set_hp)
+
+    def _get_is_hq(self): return bool(self.grid.hq[self.i])
+    def _set_is_hq(self, flag): self.grid.hq[self.i] = 1 if flag else 0
+    is_hq = property(_get_is_hq, _set_is_hq)
+
+    def _get_unit(self): return self.grid.occupant[self.i]
+    def _set_unit(self, unit): self.grid.occupant[self.i] = unit
+    unit = property(_get_unit, _set_unit)
+
+    # Two views of the same tile are equal.
+    def __eq__(self, other):
+        return (isinstance(other, Tile) and self.grid is other.grid
+                and self.i == other.i)
+    def __ne__(self, other):
+        return not self == other
+    def __hash__(self):
+        return hash((id(self.grid), self.i))
+
+    # The coordinates of this tile.
+    def xy(self):
+        return self.i%self.grid.w, self.i//self.grid.w
+
     # Returns True if this unit is allied with the other team, tile, or unit.
     def is_allied(self, other):
         if not self.team:
@@ -55,11 +110,11 @@ class Tile(object):
 
 # Units are the entities on a grid that can be moved about by the player.
 # Units have the most programming about them, since they do battle and such.
-# UNits are also the only objects to be associated with sprites since they have
-# animation.
+# Units are also the only objects with animation.
 class Unit(object):
     def __init__(self, unit, data):
         self.unit = unit
+        self.uid = None
         self.icon = data["icon"]
         self.move = data["move"]
         self.rang = data["range"]
@@ -79,7 +134,6 @@ class Unit(object):
         # Set the animation variables.
         self.anim = self.icon
         self.frame = 0
-        self.sprite = sprites.Sprite(0,0,1,1)
 
         # Read the flag variables. Indirect units may not counter
         # and units with "nocover" do not receive terrain bonuses.
@@ -96,7 +150,8 @@ class Unit(object):
     def get_carrying(self):
         report = []
         for c in self.carrying:
-            report.append( c.get_carrying() )
+            report.append(c)
+            report += c.get_carrying()
         return report
 
     # Simulate the damage of this unit attacking the target. Note that 0 damage
@@ -117,7 +172,8 @@ class Unit(object):
     def in_range(self, dist):
         return (dist >= self.rang[0] and dist <= self.rang[1])
 
-    # This function adds one frame to the animation cycle for the unit.
+    # This function adds one frame to the animation cycle for the unit and
+    # returns the character that should be shown.
     def cycle_anim(self):
         self.frame += 1
         frames = [self.icon]
@@ -127,11 +183,7 @@ class Unit(object):
         
         self.frame %= len(frames)
         self.anim = frames[self.frame]
-        
-        # This isn't ideal, but it seems to be the only way to mix a char
-        # without recoloring.
-        self.sprite.mixc(self.anim,0,0,None,None,None,None)
-        #self.sprite.blit(draw.char(0,0,self.anim,None,None,None,None),0,0,True)
+        return self.anim
 
     # Returns True if this unit is allied with the other team, tile, or unit.
     def is_allied(self, other):
@@ -141,9 +193,4 @@ class Unit(object):
             return True
         return False
 
-    # Mark the unit as done (not ready and grayed out).
-    def done(self):
-        self.ready = False
-        self.sprite.colorize(fg="x")
-
 
@@ -1,15 +1,58 @@
 # The Grid is the "map" of the field. We use "grid" instead of "map" in order
 # to avoid using the reserved keyword function "map". A grid is made up of
 # TILES and UNITS. A tile has a terrain and may contain zero or one UNITS.
-# The grid also manages all of the sprites for the units.
+# The grid knows nothing about sprites. Instead, it emits events whenever
+# something visible changes, and a view (such as widgets.GridView) can
+# subscribe to them. A grid with no subscribers runs headless, which is what
+# the AI and other simulations want.
 
 # The grid needs to be a very stable data structure, as undoing moves relies on
-# deep copies of the grid. Whenever a move is undo, a previous deepcopy is
-# popped from the action stack. Sprites must follow the same rules.
+# its journal. Every mutator records the operation that reverses it, so the
+# session can rewind the grid to an earlier mark instead of keeping deep
+# copies around. Anything that changes the grid must go through the mutator
+# methods (or Grid.set) or it can not be undone.
 
-from . import entities, widgets, log
+# The grid can also keep a Zobrist hash of the state of the match, a 64 bit
+# number that is the XOR of a key for each part of the state: every tile
+# (terrain and owner), every unit (kind, team, position, health, ready and
+# what it carries), every team (cash and whether it's still in the game) and
+# whose turn it is. The mutators keep it up to date by taking the old key of
+# whatever they change out and putting the new one in, so it costs a few
+# operations per change. Two grids of the same map in the same state always
+# have the same hash, even in different processes, so it can be used to find
+# transpositions in a search, to compare states in tests and to check that
+# two copies of a match haven't drifted apart.
 
-from graphics import sprites
+from . import entities, mapfile, log, influence
+
+from array import array
+
+_MASK = (1<<64)-1
+
+# Scramble a number into a 64 bit key (the splitmix64 finalizer). Unlike
+# Python's hash, this is the same on every platform and in every process.
+def _mix(n):
+    n = (n+0x9E3779B97F4A7C15) & _MASK
+    n = ((n ^ (n >> 30))*0xBF58476D1CE4E5B9) & _MASK
+    n = ((n ^ (n >> 27))*0x94D049BB133111EB) & _MASK
+    return n ^ (n >> 31)
+
+# The offsets of every tile between start and end tiles away (in manhattan
+# distance) from a point, in rings. These are the same for every grid, so we
+# only work each one out once.
+_rings = {}
+def ring(start, end):
+    key = start,end
+    if key not in _rings:
+        report = []
+        for r in range(start,end+1):
+            for i in range(r):
+                report.append((r-i,i  ))
+                report.append((-i ,r-i))
+                report.append((i-r,-i ))
+                report.append((i  ,i-r))
+        _rings[key] = tuple(report)
+    return _rings[key]
 
 # The grid is made up tiles that can hold units. It's essentially a data
 # storage class that also has mutator methods for interacting with units.
@@ -21,28 +64,74 @@ class Grid(object):
         self.h = data["h"]
         self.rules = dict(rules)
 
-        # Create the main sprite. This sprite will be added to the sprite
-        # manager in the session object. When a deepcopy is made, this sprite
-        # will be duplicated and the old one will be killed.
-        self.sprite = sprites.Sprite(0,0,self.w,self.h)
-
-        # Create the grid from data
-        self.tiles = []
-        for y in range(self.h):
-            row = []
-            for x in range(self.w):
-                row.append(None)
-            self.tiles.append(row)
+        # The callbacks that are subscribed to the grid's events, and the
+        # threat and influence layers (once something has asked for them).
+        self.observers = []
+        self.influence = None
+
+        # The Zobrist hash (once something has asked for it), and the key
+        # that each unit, team and the grid itself is part of it with.
+        self.zhash = None
+        self.zparts = {}
+
+        # Create the grid from data. The tiles are stored in flat arrays with
+        # one entry per x,y (at index y*w+x). The terrain array holds ids into
+        # the terrains list, where 0 means that there is no tile at all. The
+        # owner array holds indexes into the teams list, or -1. The rules for
+        # each kind of terrain are shared by all of the tiles of that kind.
+        self.terrains = [None]
+        self.terrain_ids = {}
+        for name in sorted(rules["terrain"]):
+            self.terrain_ids[name] = len(self.terrains)
+            self.terrains.append(entities.Terrain(name,rules["terrain"][name]))
+        if len(self.terrains) > 256:
+            raise Exception("Too many kinds of terrain.")
+
+        # Compile the unit rules. Every kind of unit gets an id, and the rules
+        # that are looked up all the time are turned into tables indexed by
+        # those ids (and the terrain ids), so that they don't need to hash
+        # strings. The tables are:
+        #   costs[uid][tid]: the cost to move onto the terrain, or None
+        #   primary[uid][uid]: base damage of the primary weapon, or None
+        #   secondary[uid][uid]: base damage of the secondary weapon, or None
+        self.unit_names = sorted(rules["units"])
+        self.unit_ids = {}
+        for i,name in enumerate(self.unit_names):
+            self.unit_ids[name] = i
+        self.costs = []
+        self.primary = []
+        self.secondary = []
+        for name in self.unit_names:
+            udata = rules["units"][name]
+            terrain = udata["terrain"]
+            primary = udata.get("primary",{})
+            secondary = udata.get("secondary",{})
+            self.costs.append([t and terrain.get(t.name) for t in self.terrains])
+            self.primary.append([primary.get(n) for n in self.unit_names])
+            self.secondary.append([secondary.get(n) for n in self.unit_names])
+        size = self.w*self.h
+        self.terrain = array("B", [0])*size
+        self.owner = array("b", [-1])*size
+        self.tile_hp = array("B", [100])*size
+        self.hq = array("B", [0])*size
+        self.occupant = [None]*size
         self.units = []
         self.teams = []
         self.winners = []
+        self.journal = []
         
         # Load the teams first, since cells and units reference them.
-        # Then set up the alliances.
+        # Then set up the alliances. Each team also gets an index of the
+        # units it has on the grid and the tiles (by array index) it owns,
+        # which are kept up to date by the mutators.
         self.name = data["name"]
+        self.team_units = {}
+        self.team_tiles = {}
         for t in data["teams"]:
             this = entities.Team(t)
             self.teams.append(this)
+            self.team_units[this] = []
+            self.team_tiles[this] = set()
         for alist in data.get("allies",[]):
             for a in alist:
                 for b in alist:
@@ -56,57 +145,180 @@ class Grid(object):
         #   name: (string) the name of the terrain
         #   unit: the unit on this terrain, if one
         #   team: (int) the team that owns the terrain, if any
-        # We also make the sprite information for the units here. Note that
-        # this code is duplicated from the load_unit and add_unit methods.
+        #   hp: (int) what's left of the tile before it's captured, if not 100
+        # A unit may also have its hp, ammo and fuel, if they aren't full.
+        # Note that this code is duplicated from the load_unit and add_unit
+        # methods.
+        # A map from a mapfile has its terrain packed into a layer of runs
+        # instead, and only lists the tiles with teams and units.
+        if "layer" in data:
+            i = 0
+            for (n,k) in mapfile.runs(data["layer"]):
+                if k:
+                    tid = self.terrain_ids[data["terrains"][k-1]]
+                    self.terrain[i:i+n] = array("B", [tid])*n
+                    if self.terrains[tid].is_hq:
+                        self.hq[i:i+n] = array("B", [1])*n
+                i += n
         for c in data["tiles"]:
             x,y = c["x"], c["y"]
-            terrain = c["terrain"]
-            this = entities.Tile(terrain,rules["terrain"][terrain])
+            if x < 0 or x >= self.w or y < 0 or y >= self.h:
+                continue
+            i = y*self.w+x
+            if "terrain" in c:
+                tid = self.terrain_ids[c["terrain"]]
+                self.terrain[i] = tid
+                self.hq[i] = 1 if self.terrains[tid].is_hq else 0
             if "team" in c:
-                this.team = self.teams[c["team"]]
-            self.change_tile(this, x, y)
+                self._set_owner(i, c["team"])
+            if "hp" in c:
+                self.tile_hp[i] = c["hp"]
             if "unit" in c:
                 def _process_units(udata):
                     name = udata["name"]
                     u = entities.Unit(name, rules["units"][name])
+                    u.uid = self.unit_ids[name]
                     u.team = self.teams[udata["team"]]
                     u.x = x
                     u.y = y
-                    u.sprite.putc(u.icon,0,0,u.team.color,"X",True,False)
-                    u.sprite.move_to(x,y)
-                    self.sprite.add_sprite(u.sprite)
+                    for k in ("hp","ammo","fuel"):
+                        if k in udata: setattr(u, k, udata[k])
                     self.units.append(u)
+                    self.team_units[u.team].append(u)
                     for uc in udata.get("carrying",[]):
                         carriee = _process_units(uc)
                         u.carrying.append(carriee)
                         carriee.x = None
                         carriee.y = None
-                        carriee.sprite.hide()
                     return u
-                this.unit = _process_units(c["unit"])
+                self.occupant[i] = _process_units(c["unit"])
         
         # To start the game, end the turn. It will proceed to player 0.
+        # Loading the map is not something that can be undone.
         self.day = 1
         self.turn = None
-        self.alerts = []
+        self.journal = []
+
+    # Subscribe to the grid's events. The callback is called with the name of
+    # the event followed by its arguments:
+    #   tile, x, y: the tile at x,y changed
+    #   unit, unit: the unit's state changed (ready, team, hp, etc)
+    #   place, unit: the unit moved, or was put in or taken out of a carrier
+    #   add, unit: the unit was put on the grid
+    #   remove, unit: the unit was taken off the grid
+    #   reset: everything may have changed
+    #   alert, loc, kind, args: a popup should be shown near loc
+    def subscribe(self, callback):
+        self.observers.append(callback)
+
+    # Stop sending events to the callback.
+    def unsubscribe(self, callback):
+        if callback in self.observers:
+            self.observers.remove(callback)
+
+    # Send an event to all of the subscribers.
+    def emit(self, event, *args):
+        for callback in self.observers:
+            callback(event, *args)
+
+    # Raise an alert for the views. The kind is "notify" (a message that pops
+    # up) or "counter" (an hp counter), and args are passed to that widget.
+    # The loc tells the view where to put it, relative to the cursor.
+    def alert(self, loc, kind, *args):
+        if self.observers:
+            self.emit("alert", loc, kind, args)
+
+    # The threat and influence layers of every team. They follow the grid's
+    # events from the first time they're asked for.
+    def layers(self):
+        if self.influence is None:
+            self.influence = influence.Influence(self)
+        return self.influence
+
+    # The Zobrist hash of the state of the match. It's worked out the first
+    # time it's asked for, and kept up to date from then on.
+    def hash(self):
+        if self.zhash is None:
+            h = 0
+            terrain,owner = self.terrain,self.owner
+            for i in range(self.w*self.h):
+                if terrain[i] or owner[i] >= 0:
+                    h ^= self._tile_key(i)
+            self.zparts = {}
+            for obj in self.units+self.teams+[self]:
+                k = self._key(obj)
+                self.zparts[obj] = k
+                h ^= k
+            self.zhash = h
+        return self.zhash
 
-    # Pump the alerts from the grid.
-    def info(self):
-        oldalerts = self.alerts
-        self.alerts = []
-        return oldalerts
+    # The key of the tile at index i. Tiles that aren't there and aren't
+    # owned by anyone don't count, so sparse maps are quick to hash.
+    def _tile_key(self, i):
+        if not self.terrain[i] and self.owner[i] < 0:
+            return 0
+        n = (((i*512+self.terrain[i]*2+self.hq[i])*256+self.owner[i]+1)*256+
+             self.tile_hp[i])
+        return _mix(n*8+1)
+
+    # The key of a unit, team or the grid. A unit's health only counts as
+    # far as the number shown on it (so units a few hp apart hash the same),
+    # and a carried unit has no position of its own; instead, the kinds of
+    # the units it carries are part of the carrier's key.
+    def _key(self, obj):
+        if obj is self:
+            turn = -1 if self.turn is None else self.turn
+            return _mix(_mix((turn+1)*8+4)^self.day)
+        if isinstance(obj, entities.Team):
+            n = self.teams.index(obj)*2+(1 if obj.active else 0)
+            return _mix(_mix(n*8+3)^(obj.cash & _MASK))
+        x,y = (-1,-1) if obj.x is None else (obj.x,obj.y)
+        n = ((((obj.uid*256+self.teams.index(obj.team))*65536+x+1)*65536+y+1)
+             *16+min(10,obj.hp//10+1))*2+(1 if obj.ready else 0)
+        k = _mix(n*8+2)
+        for c in obj.carrying:
+            k = _mix(k^(c.uid+1))
+        return k
+
+    # Work out the key of a unit, team or the grid again, if it's part of
+    # the hash.
+    def _rehash(self, obj):
+        if self.zhash is not None and obj in self.zparts:
+            k = self._key(obj)
+            self.zhash ^= self.zparts[obj]^k
+            self.zparts[obj] = k
+
+    # Put a unit into the hash, or take it out, when it's put on or taken off
+    # the list of units.
+    def _hash_in(self, unit):
+        if self.zhash is not None:
+            k = self._key(unit)
+            self.zparts[unit] = k
+            self.zhash ^= k
+    def _hash_out(self, unit):
+        if self.zhash is not None:
+            self.zhash ^= self.zparts.pop(unit)
+
+    # Get the index of X,Y in the tile arrays, or None if there isn't a tile.
+    def index(self, x, y):
+        if x >= 0 and x < self.w and y >= 0 and y < self.h:
+            i = y*self.w+x
+            if self.terrain[i]: return i
+        return None
 
     # Get the tile and unit at X,Y
     def get_at(self, x, y):
         if x >= 0 and x < self.w and y >= 0 and y < self.h:
-            t = self.tiles[y][x]
-            if t: return t, t.unit
+            i = y*self.w+x
+            if self.terrain[i]: return entities.Tile(self,i), self.occupant[i]
         return None, None
     
     # Get the tile at X,Y
     def tile_at(self, x, y):
-        tile, unit = self.get_at(x, y)
-        return tile
+        if x >= 0 and x < self.w and y >= 0 and y < self.h:
+            i = y*self.w+x
+            if self.terrain[i]: return entities.Tile(self,i)
+        return None
         
     # Get the tile of a unit
     def utile(self, unit):
@@ -119,16 +331,24 @@ class Grid(object):
         
     # Get the unit at X,Y
     def unit_at(self, x, y):
-        tile, unit = self.get_at(x, y)
-        return unit
+        if x >= 0 and x < self.w and y >= 0 and y < self.h:
+            return self.occupant[y*self.w+x]
+        return None
+
+    # Get the name of the terrain at X,Y, or None if there is no tile.
+    def terrain_at(self, x, y):
+        if x >= 0 and x < self.w and y >= 0 and y < self.h:
+            t = self.terrains[self.terrain[y*self.w+x]]
+            if t: return t.name
+        return None
 
     # Get all tile objects.
     def all_tiles(self):
         report = []
         for x in range(self.w):
             for y in range(self.h):
-                t,u = self.get_at(x,y)
-                if t: report.append(t)
+                i = y*self.w+x
+                if self.terrain[i]: report.append(entities.Tile(self,i))
         return report
 
     # Get an iterable range of all legal tile coordinates.
@@ -136,23 +356,81 @@ class Grid(object):
         report = []
         for x in range(self.w):
             for y in range(self.h):
-                t,u = self.get_at(x,y)
-                if t: report.append((x,y))
+                if self.terrain[y*self.w+x]: report.append((x,y))
         return report
 
+    # Get the tiles owned by the team, in index order.
+    def tiles_of(self, team):
+        return [entities.Tile(self,i) for i in sorted(self.team_tiles[team])]
+
+    # Get the units on the grid that belong to the team (including the ones
+    # being carried).
+    def units_of(self, team):
+        return list(self.team_units[team])
+
+    # Count the units on the grid that belong to the team.
+    def count_units(self, team):
+        return len(self.team_units[team])
+
+    # Get the movement cost of each kind of terrain for the unit, as a list
+    # indexed by terrain id. Terrain the unit can't enter costs None.
+    def move_costs(self, unit):
+        return self.costs[unit.uid]
+
+    # Returns True if the unit could fire on the target if it were in range.
+    def can_target(self, unit, targ):
+        if unit.is_allied(targ):
+            return False
+        if self.secondary[unit.uid][targ.uid] is not None:
+            return True
+        return unit.ammo > 0 and self.primary[unit.uid][targ.uid] is not None
+
+    # Work out the damage the unit would do to the target standing on terrain
+    # with the given cover. This is Unit.simulate using the compiled tables.
+    # Note that 0 damage means that the unit simply can't scratch the target,
+    # while None means it can't attack it period. Returns True if the
+    # primary weapon was used.
+    def damage(self, unit, target, cover, hp=None):
+        if target.no_cover: cover = 0
+        if hp is None: hp = unit.hp
+        base = self.primary[unit.uid][target.uid]
+        if base is not None and unit.ammo > 0:
+            return int(base*.01*hp*(1.0-(.01*cover))),True
+        base = self.secondary[unit.uid][target.uid]
+        if base is not None:
+            return int(base*.01*hp*(1.0-(.01*cover))),False
+        return None,None
+
     # Get a range of coordinates, usually for an attack range. Coordinates
     # may not actually be cells.
     def get_range(self, x, y, start, end=None):
         if end is None:
             end = start
+        return [(x+dx,y+dy) for (dx,dy) in ring(start,end)]
 
+    # Get the units that are between lo and hi tiles away from x,y and that
+    # pass the predicate (if given). If there are fewer units on the grid
+    # than tiles in the range, we check the units instead of the tiles.
+    def units_in_range(self, x, y, lo, hi, predicate=None):
         report = []
-        for r in range(start,end+1):
-            for i in range(r):
-                report.append((x+(r-i),y+i    ))
-                report.append((x-i    ,y+(r-i)))
-                report.append((x-(r-i),y-i    ))
-                report.append((x+i    ,y-(r-i)))
+        offsets = ring(lo,hi)
+        if len(self.units) < len(offsets):
+            for u in self.units:
+                if u.x is None:
+                    continue
+                d = abs(u.x-x)+abs(u.y-y)
+                if (d > 0 and d >= lo and d <= hi and
+                        (predicate is None or predicate(u))):
+                    report.append(u)
+            return report
+        w,h = self.w,self.h
+        occupant = self.occupant
+        for (dx,dy) in offsets:
+            a,b = x+dx,y+dy
+            if a >= 0 and a < w and b >= 0 and b < h:
+                u = occupant[b*w+a]
+                if u and (predicate is None or predicate(u)):
+                    report.append(u)
         return report
 
     # Return distance (zero norm) between two points.
@@ -174,42 +452,44 @@ class Grid(object):
     # to acive. If a player has won the game at this point, set the winner
     # variable.
     def end_turn(self):
-        if self.turn is None:
-            self.turn = -1
+        turn = self.turn
+        day = self.day
+        if turn is None:
+            turn = -1
         
         # Select the next active player in the roster.
         if len([t for t in self.teams if t.active]) == 0:
-            self.day += 1
+            day += 1
         else:
             flag = True
-            while flag or not self.teams[self.turn].active:
+            while flag or not self.teams[turn].active:
                 flag = False
-                self.turn += 1
-                if self.turn >= len(self.teams):
-                    self.turn = 0
-                    self.day += 1
+                turn += 1
+                if turn >= len(self.teams):
+                    turn = 0
+                    day += 1
+        self.set(self, "turn", turn)
+        self.set(self, "day", day)
         for u in self.units:
-            u.ready = True
-            u.sprite.colorize(u.team.color,"X",True,False)
+            self.set(u, "ready", True)
 
         # Repair units and draw income.
         cur = self.current_team()
         msg = "Day %d - %s\n%s, move out!"%(self.day, self.name, cur.name)
-        self.alerts.append((widgets.Notification(msg,100,cur.color),"center"))
+        self.alert("center", "notify", msg, 100, cur.color)
         if cur:
-            for tile in self.all_tiles():
-                if tile.team is cur:
-                    u = tile.unit
-                    if (u and u.team is cur and u.unit in tile.repair):
-                        u.fuel = u.max_fuel
-                        u.ammo = u.max_ammo
-                    
-                    # Repairing a unit forfeits that tile's income.
-                    if (u and u.team is cur and u.hp < 100
-                          and u.unit in tile.repair):
-                        u.hp = min(100,u.hp+tile.repair[u.unit])
-                    else:
-                        cur.cash += tile.income
+            for tile in self.tiles_of(cur):
+                u = tile.unit
+                if (u and u.team is cur and u.unit in tile.repair):
+                    self.set(u, "fuel", u.max_fuel)
+                    self.set(u, "ammo", u.max_ammo)
+                
+                # Repairing a unit forfeits that tile's income.
+                if (u and u.team is cur and u.hp < 100
+                      and u.unit in tile.repair):
+                    self.set(u, "hp", min(100,u.hp+tile.repair[u.unit]))
+                else:
+                    self.set(cur, "cash", cur.cash+tile.income)
 
         # Determine the winning team (if one exists).
         winner = True
@@ -218,123 +498,319 @@ class Grid(object):
                 if not at.is_allied(ot):
                     winner = False
         if winner:
-            self.winners = [t for t in self.teams if t.active]
+            self.set(self, "winners", [t for t in self.teams if t.active])
+
+    # Returns a mark for the current position of the journal. Passing the mark
+    # to rewind will undo everything that happened since.
+    def checkpoint(self):
+        return len(self.journal)
+
+    # Undo every change made since the mark (by default, everything in the
+    # journal). The inverse operations are not journaled themselves. The
+    # views are told about changed tiles and units once everything has been
+    # restored.
+    def rewind(self, mark=0):
+        journal = self.journal
+        self.journal = []
+        tiles = set()
+        units = set()
+        while len(journal) > mark:
+            entry = journal.pop()
+            op = entry[0]
+            if op == "set":
+                obj, attr, old = entry[1:]
+                self._assign(obj, attr, old)
+                if isinstance(obj, entities.Unit):
+                    units.add(obj)
+                elif isinstance(obj, entities.Tile):
+                    tiles.add(obj.xy())
+            elif op == "place":
+                unit, x, y = entry[1:]
+                self._place(unit, x, y)
+            elif op == "list":
+                unit, i, j = entry[1:]
+                self.units.insert(i, unit)
+                self.team_units[unit.team].insert(j, unit)
+                self._hash_in(unit)
+                if self.observers:
+                    self.emit("add", unit)
+            elif op == "unlist":
+                unit = entry[1]
+                self.units.remove(unit)
+                self.team_units[unit.team].remove(unit)
+                self._hash_out(unit)
+                if self.observers:
+                    self.emit("remove", unit)
+            elif op == "carry":
+                carrier, i, unit = entry[1:]
+                carrier.carrying.insert(i, unit)
+                self._rehash(carrier)
+            elif op == "uncarry":
+                carrier = entry[1]
+                carrier.carrying.pop()
+                self._rehash(carrier)
+            elif op == "tile":
+                x, y, state = entry[1:]
+                self._set_tile(y*self.w+x, state)
+                tiles.add((x,y))
+        self.journal = journal
+
+        if self.observers:
+            for (x,y) in tiles:
+                self.emit("tile", x, y)
+            for u in units:
+                self.emit("unit", u)
+
+    # Forget the journal. Nothing before this point can be undone. This is
+    # done when a turn is ended.
+    def forget(self):
+        self.journal = []
+
+    # Take a snapshot of the state of the match. Unlike a deepcopy, this only
+    # copies the tile arrays and the handful of variables that can change on
+    # each unit and team, so it is cheap enough to take often. The snapshot
+    # refers to the grid's own Unit and Team objects, so it can only be
+    # restored on this grid.
+    def snapshot(self):
+        units = [(u, u.x, u.y, u.hp, u.ammo, u.fuel, u.ready, u.team,
+                  list(u.carrying)) for u in self.units]
+        teams = [(t, t.cash, t.active) for t in self.teams]
+        return (self.terrain[:], self.owner[:], self.tile_hp[:], self.hq[:],
+                units, teams, self.turn, self.day, list(self.winners))
+
+    # Put the grid back the way it was when the snapshot was taken. This can
+    # not be undone, so the journal is forgotten. The views are told to
+    # redraw everything.
+    def restore(self, snap):
+        terrain, owner, tile_hp, hq, units, teams, turn, day, winners = snap
+        self.terrain[:] = terrain
+        self.owner[:] = owner
+        self.tile_hp[:] = tile_hp
+        self.hq[:] = hq
+        self.occupant = [None]*(self.w*self.h)
+        self.units = []
+        self.team_units = {}
+        self.team_tiles = {}
+        for t,cash,active in teams:
+            t.cash = cash
+            t.active = active
+            self.team_units[t] = []
+            self.team_tiles[t] = set()
+        for i,o in enumerate(self.owner):
+            if o >= 0:
+                self.team_tiles[self.teams[o]].add(i)
+        for (u, x, y, hp, ammo, fuel, ready, team, carrying) in units:
+            u.x, u.y, u.hp, u.ammo, u.fuel = x, y, hp, ammo, fuel
+            u.ready, u.team, u.carrying = ready, team, list(carrying)
+            if x is not None:
+                self.occupant[y*self.w+x] = u
+            self.units.append(u)
+            self.team_units[team].append(u)
+        self.turn = turn
+        self.day = day
+        self.winners = list(winners)
+        self.journal = []
+        if self.zhash is not None:
+            self.zhash = None
+            self.hash()
+        if self.observers:
+            self.emit("reset")
+
+    # Set an attribute on a unit, tile, team, or the grid itself in a way that
+    # can be undone. The rules should use this for all of their writes.
+    def set(self, obj, attr, value):
+        self.journal.append(("set", obj, attr, getattr(obj, attr)))
+        self._assign(obj, attr, value)
+        if self.observers:
+            if isinstance(obj, entities.Unit):
+                self.emit("unit", obj)
+            elif isinstance(obj, entities.Tile):
+                x,y = obj.xy()
+                self.emit("tile", x, y)
+
+    # Set an attribute and keep the hash up to date. A tile's team is kept up
+    # to date by _set_owner, but the rest of a tile is written straight into
+    # the arrays.
+    def _assign(self, obj, attr, value):
+        if self.zhash is not None and isinstance(obj, entities.Tile):
+            if attr != "team":
+                self.zhash ^= self._tile_key(obj.i)
+                setattr(obj, attr, value)
+                self.zhash ^= self._tile_key(obj.i)
+                return
+        setattr(obj, attr, value)
+        self._rehash(obj)
+
+    # Mark the unit as done (it can't act again this turn).
+    def done(self, unit):
+        self.set(unit, "ready", False)
+
+    # Put the unit on the tile at x,y, taking it off of its old tile. If x and
+    # y are None, the unit is taken off the grid (hidden). Throws an exception
+    # if the new tile is occupied.
+    def _place(self, unit, x, y):
+        if x is not None:
+            i = self.index(x, y)
+            if i is None:
+                raise Exception("Tried to add unit to missing tile %d,%d"%(x,y))
+            if self.occupant[i] and self.occupant[i] is not unit:
+                raise Exception("Tried to add unit to occupied tile %d,%d"%(x,y))
+        if unit.x is not None:
+            self.occupant[unit.y*self.w+unit.x] = None
+        self.journal.append(("place", unit, unit.x, unit.y))
+        unit.x = x
+        unit.y = y
+        if x is not None:
+            self.occupant[i] = unit
+        self._rehash(unit)
+        if self.observers:
+            self.emit("place", unit)
 
     # Moves a unit from the old tile to the new tile. Will
     # throw exception if move is illegal. CHECK FIRST.
     def move_unit(self, unit, x, y):
-        tile = self.utile(unit)
-        tile.unit = None
-        tile = self.tile_at(x, y)
-        if tile.unit:
-            raise Exception("Tried to add unit to occupied tile %d,%d"%(x,y))
-        tile.unit = unit
-         
-        unit.x = x
-        unit.y = y
-        unit.sprite.move_to(x,y)
+        self.utile(unit)
+        self._place(unit, x, y)
        
     # This loads a unit into the other. 
     def load_unit(self, unit, carrier):
-        tile = self.utile(unit)
-        tile.unit = None
+        self.utile(unit)
+        self._place(unit, None, None)
         carrier.carrying.append(unit)
-        
-        unit.x = None
-        unit.y = None
-        unit.sprite.hide()
+        self.journal.append(("uncarry", carrier))
+        self._rehash(carrier)
         
     # This unloads a unit onto a tile
     def unload_unit(self, carrier, i, x, y):
-        unit = carrier.carrying.pop(i)
-        tile = self.tile_at(x, y)
-        if tile.unit:
-            raise Exception("Tried to add unit to occupied tile %d,%d"%(x,y))
-        tile.unit = unit
-        
-        unit.x = x
-        unit.y = y
-        unit.sprite.show()
-        unit.sprite.move_to(x,y)
+        unit = carrier.carrying[i]
+        self._place(unit, x, y)
+        carrier.carrying.pop(i)
+        self.journal.append(("carry", carrier, i, unit))
+        self._rehash(carrier)
 
     # Add a unit to the game. Throws an exception if the tile
     # does not exist or if the tile is occupied.
     # This should be the ONLY WAY units are added to the game.
     def add_unit(self, unit, team, x, y):
-        tile = self.tile_at(x,y)
-        if tile.unit:
-            raise Exception("Tried to add unit to occupied tile %d,%d"%(x,y))
-        tile.unit = unit
-        unit.team = team
-        unit.x = x
-        unit.y = y
+        unit.uid = self.unit_ids[unit.unit]
+        self.set(unit, "team", team)
+        self._place(unit, x, y)
         
         self.units.append(unit)
-        unit.sprite.putc(unit.icon,0,0,team.color,"X",True,False)
-        unit.sprite.move_to(x,y)
-        self.sprite.add_sprite(unit.sprite)
+        self.team_units[team].append(unit)
+        self.journal.append(("unlist", unit))
+        self._hash_in(unit)
+        if self.observers:
+            self.emit("add", unit)
 
     # Remove a unit from the game. This will not only remove the
     # unit, but all units that it is carrying.
     def remove_unit(self, unit):
-        tile = self.utile(unit)
-        if tile:
-            tile.unit = None
+        self.utile(unit)
+        if unit.x is not None:
+            self._place(unit, None, None)
         
-        if unit in self.units:
-            self.units.remove(unit)
-        for u in unit.get_carrying():
+        for u in [unit]+unit.get_carrying():
             if u in self.units:
-                self.units.remove(u)
-                u.sprite.kill()
-        unit.sprite.kill()
+                i = self.units.index(u)
+                j = self.team_units[u.team].index(u)
+                self.units.pop(i)
+                self.team_units[u.team].pop(j)
+                self.journal.append(("list", u, i, j))
+                self._hash_out(u)
+                if self.observers:
+                    self.emit("remove", u)
 
     # This removes all entities from a team (done when the team is defeated).
     def purge(self, team, structures=False):
-        for u in [u for u in self.units if u.team is team]:
+        for u in list(self.team_units[team]):
             self.remove_unit(u)
         if structures:
-            for (x,y) in self.all_tiles_xy():
-                t = self.tile_at(x,y)
-                if t.team is team:
-                    t.team = None
-                    self.change_tile(t,x,y)
+            for t in self.tiles_of(team):
+                x,y = t.xy()
+                self.set(t, "team", None)
+                self.change_tile(t,x,y)
 
-    # Change a tile on the map.
+    # Change a tile on the map. The tile at x,y takes on the terrain and state
+    # of the given tile (which may be the same one). The unit stays put.
     def change_tile(self, tile, x, y):
         if x >= 0 and x < self.w and y >= 0 and y < self.h:
-            oldtile, unit = self.get_at(x,y)
-            self.tiles[y][x] = tile
-            tile.unit = unit
-            if tile.team:
-                self.sprite.putc(tile.icon,x,y,tile.team.color,"X",True,False)
-            else:
-                self.sprite.putc(tile.icon,x,y,tile.color,"X",False,False)
-
-    # TODO MAY NEED TO BE FIXED ITS POSSIBLE SO POSSIBLE
+            i = y*self.w+x
+            self.journal.append(("tile", x, y, self._get_tile(i)))
+            self._set_tile(i, tile.grid._get_tile(tile.i))
+            if self.observers:
+                self.emit("tile", x, y)
+
+    # Get and set the state of the tile at index i as a tuple.
+    def _get_tile(self, i):
+        return self.terrain[i], self.owner[i], self.tile_hp[i], self.hq[i]
+    def _set_tile(self, i, state):
+        if self.zhash is not None:
+            self.zhash ^= self._tile_key(i)
+        self.terrain[i], o, self.tile_hp[i], self.hq[i] = state
+        if self.zhash is not None:
+            self.zhash ^= self._tile_key(i)
+        self._set_owner(i, o)
+
+    # Set the owner of the tile at index i to the team with index o (or -1)
+    # and keep the team tile index up to date.
+    def _set_owner(self, i, o):
+        old = self.owner[i]
+        if old >= 0:
+            self.team_tiles[self.teams[old]].discard(i)
+        if o >= 0:
+            self.team_tiles[self.teams[o]].add(i)
+        if self.zhash is not None:
+            self.zhash ^= self._tile_key(i)
+            self.owner[i] = o
+            self.zhash ^= self._tile_key(i)
+        else:
+            self.owner[i] = o
+
+    # Export the grid as it is now, in the same format that it's loaded from
+    # (with a tile for every x,y that has terrain), so that it can be used as
+    # a new map. The teams keep their cash, and the units and tiles keep
+    # their hp, but whose turn it is isn't kept; the new map starts fresh.
     def export(self):
         report = {}
         report["name"] = self.name
-        report["allies"] = []
-        report["cells"] = []
+        report["w"] = self.w
+        report["h"] = self.h
         report["teams"] = []
+        report["allies"] = []
+        report["tiles"] = []
         for t in self.teams:
-            team = {}
-            team["name"] = t.name
-            team["color"] = t.color
+            team = {"name": t.name, "color": t.color}
+            if t.cash:
+                team["cash"] = t.cash
             report["teams"].append(team)
-        for c in self.grid:
-            cell = {}
-            cell["x"],cell["y"] = c
-            cd = self.grid[c]
-            cell["name"] = cd.name
-            if cd.team:
-                cell["team"] = self.teams.index(cd.team)
-            if cd.unit:
-                cell["unit"] = {}
-                cell["unit"]["name"] = cd.unit.name
-                cell["unit"]["team"] = self.teams.index(cd.unit.team)
-                # TODO fix carrying!
-            report["cells"].append(cell)
+            group = sorted(set([self.teams.index(a) for a in t.allies]+
+                               [self.teams.index(t)]))
+            if len(group) > 1 and group not in report["allies"]:
+                report["allies"].append(group)
+        for i,tid in enumerate(self.terrain):
+            if not tid:
+                continue
+            cell = {"x": i%self.w, "y": i//self.w}
+            cell["terrain"] = self.terrains[tid].name
+            if self.owner[i] >= 0:
+                cell["team"] = int(self.owner[i])
+            if self.tile_hp[i] != 100:
+                cell["hp"] = self.tile_hp[i]
+            if self.occupant[i]:
+                cell["unit"] = self._export_unit(self.occupant[i])
+            report["tiles"].append(cell)
         return report
 
+    # Export a unit and the units it's carrying.
+    def _export_unit(self, u):
+        report = {"name": u.unit, "team": self.teams.index(u.team)}
+        if u.hp != 100:
+            report["hp"] = u.hp
+        if u.ammo != u.max_ammo:
+            report["ammo"] = u.ammo
+        if u.fuel != u.max_fuel:
+            report["fuel"] = u.fuel
+        if u.carrying:
+            report["carrying"] = [self._export_unit(c) for c in u.carrying]
+        return report
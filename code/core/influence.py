@@ -0,0 +1,167 @@
+# The influence module keeps track of which tiles each team could reach and
+# attack on its next turn. For every team there are two layers, flat arrays
+# with one entry per x,y (at index y*w+x, like the grid's own arrays):
+#   threat: the number of the team's units that could attack the tile
+#   influence: the total hp of the team's units that could move to the tile
+# The AI's evaluate uses the threat layers to count units that could be
+# attacked on the next turn for less.
+# The layers are kept up to date from the grid's events. When something
+# changes, only the units that could be affected are worked out again: the
+# unit itself, and any unit close enough that a unit appearing, leaving or a
+# tile changing could open up or block its path.
+
+from . import rules
+
+from array import array
+
+
+# An Influence subscribes to a grid's events and keeps the layers for it.
+# Changes are only noted as they happen; the work is done the next time the
+# layers are asked for.
+class Influence(object):
+    def __init__(self, grid):
+        self.grid = grid
+        n = grid.w*grid.h
+        self.threat = dict((t, array('H',[0])*n) for t in grid.teams)
+        self.influence = dict((t, array('L',[0])*n) for t in grid.teams)
+
+        # Each unit's contribution: (key, team, hp, reach, targets), where
+        # the key is everything about the unit that the contribution depends
+        # on, and reach and targets are lists of tile indexes.
+        self.cover = {}
+        self.dirty = set(grid.units)
+        self.changed = set()
+
+        # How far a unit of each kind can possibly get, in tiles. A change
+        # any further away than this (plus one, for blocking) can't matter.
+        self.radius = []
+        for uid,name in enumerate(grid.unit_names):
+            steps = [c for c in grid.costs[uid] if c is not None]
+            move = grid.rules["units"][name]["move"]
+            if not steps or min(steps) <= 0:
+                self.radius.append(grid.w+grid.h)
+            else:
+                self.radius.append(move//min(steps)+1)
+        grid.subscribe(self.notify)
+
+    # Stop following the grid.
+    def close(self):
+        self.grid.unsubscribe(self.notify)
+
+    # Handle an event from the grid.
+    def notify(self, event, *args):
+        if event == "tile":
+            x,y = args
+            self.changed.add(y*self.grid.w+x)
+        elif event in ("place", "add", "remove", "unit"):
+            u = args[0]
+            self.dirty.add(u)
+
+            # Other units only care if this one moved or changed sides,
+            # since that's what opens up or blocks their paths.
+            old = self.cover.get(u)
+            if event == "unit" and (not old or old[1] is u.team):
+                return
+            if old:
+                self.changed.add(old[0][0])
+            if u.x is not None:
+                self.changed.add(u.y*self.grid.w+u.x)
+        elif event == "reset":
+            for t in self.threat:
+                self.threat[t] = array('H',[0])*len(self.threat[t])
+                self.influence[t] = array('L',[0])*len(self.influence[t])
+            self.cover = {}
+            self.dirty = set(self.grid.units)
+            self.changed = set()
+
+    # Work out again the units that are close to a tile that changed, and the
+    # units that changed in a way that matters (not just being made ready).
+    def update(self):
+        if not self.changed and not self.dirty:
+            return
+        w = self.grid.w
+        forced = set()
+        if self.changed:
+            for u,c in self.cover.items():
+                i = c[0][0]
+                x,y = i%w,i//w
+                r = self.radius[u.uid]
+                for j in self.changed:
+                    if abs(j%w-x)+abs(j//w-y) <= r:
+                        forced.add(u)
+                        break
+            self.changed = set()
+        dirty = self.dirty | forced
+        self.dirty = set()
+        units = set(self.grid.units)
+        for u in dirty:
+            old = self.cover.get(u)
+            here = u in units and u.x is not None
+            if (old and here and u not in forced and old[1] is u.team and
+                    old[0] == (u.y*w+u.x, u.hp, u.ammo)):
+                continue
+            if old:
+                del self.cover[u]
+                self._add(old, -1)
+            if here:
+                c = self._cover(u)
+                self.cover[u] = c
+                self._add(c, 1)
+
+    # The threat layer of the team.
+    def threats(self, team):
+        self.update()
+        return self.threat[team]
+
+    # The influence layer of the team.
+    def influences(self, team):
+        self.update()
+        return self.influence[team]
+
+    # The number of units not allied with the team that could attack x,y on
+    # their next turn.
+    def danger(self, team, x, y):
+        self.update()
+        i = y*self.grid.w+x
+        return sum(self.threat[t][i] for t in self.threat
+                   if not t.is_allied(team))
+
+    # Work out a unit's contribution from where it stands.
+    def _cover(self, u):
+        g = self.grid
+        w,h = g.w,g.h
+        key = (u.y*w+u.x, u.hp, u.ammo)
+        costs,prev = rules.reach(g, u, u.x, u.y)
+        reach = [y*w+x for (x,y) in costs]
+        targets = set()
+        lo,hi = u.rang
+        if lo > 0 and hi > 0 and self._armed(u):
+            starts = [(u.x,u.y)]
+            if not u.is_indirect:
+                starts = [d for d in costs
+                          if g.occupant[d[1]*w+d[0]] in (None,u)]
+            for (x,y) in starts:
+                for (a,b) in g.get_range(x,y,lo,hi):
+                    if a >= 0 and a < w and b >= 0 and b < h:
+                        targets.add(b*w+a)
+        return key, u.team, u.hp, reach, list(targets)
+
+    # True if the unit can attack anything at all.
+    def _armed(self, u):
+        g = self.grid
+        if any(d is not None for d in g.secondary[u.uid]):
+            return True
+        return u.ammo > 0 and any(d is not None for d in g.primary[u.uid])
+
+    # Add (or with sign -1, take away) a contribution to the layers.
+    def _add(self, c, sign):
+        key,team,hp,reach,targets = c
+        if team not in self.threat:
+            return
+        threat = self.threat[team]
+        influence = self.influence[team]
+        for i in targets:
+            threat[i] += sign
+        hp *= sign
+        for i in reach:
+            influence[i] += hp
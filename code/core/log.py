@@ -1,30 +1,142 @@
 # A simple global logging library to help with debugging. The log()
 # function will log any strings automatically to the file as long as the
-# logger has been 'toggled' on. 
+# logger has been 'toggled' on.
+#
+# Logging is meant to be cheap enough to leave on. Messages below the current
+# level, or in a category that isn't being logged, are dropped before doing
+# anything else. The message is only formatted (with the % operator) when it
+# is written, so pass the arguments separately instead of formatting them at
+# the call site. Arguments shouldn't be changed after they're logged, since
+# they're formatted later. Writing happens on a background thread that takes
+# messages off a bounded queue and writes them in batches. If the queue is
+# ever full, messages are dropped (and counted) rather than making the game
+# wait. The log is flushed when graphics stop and when the program exits.
 
 import time
+import atexit
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+_names = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
 
-# The Logfile uses the following two global variables to manage logs.
+# The Logfile uses the following global variables to manage logs.
 logfile = None      # A python file object.
 is_logging = False  # True if we are currently logging.
+level = INFO        # Messages below this level are dropped.
+categories = None   # The categories to log, or None to log all of them.
+dropped = 0         # Messages dropped because the queue was full.
+
+_queue = queue.Queue(10000)
+_thread = None
+_lock = threading.Lock()
+_BATCH = 256
+
+# This returns True if a message of the level and category would be logged.
+# Call sites that need to do real work to build the arguments can check it
+# first.
+def enabled(lvl=INFO, category=None):
+    return (is_logging and lvl >= level and
+            (categories is None or category in categories))
+
+# This logs a message at a level and in a category. The message is formatted
+# with the args when it is written.
+def write(lvl, category, s, *args):
+    global dropped
+    if not is_logging or lvl < level:
+        return
+    if categories is not None and category not in categories:
+        return
+    if _thread is None:
+        _start()
+    try:
+        _queue.put_nowait((time.time(), lvl, category, s, args))
+    except queue.Full:
+        dropped += 1
 
 # This function writes to the logfile if we are currently logging. If a file
 # has not been opened yet, open one with a timestamp of the time it was
 # created in the name.
-def log(s):
-    global logfile
-    global is_logging
-    if is_logging:
-        if not logfile:
-            logfile = open("log_%d"%time.time(),"w")
-        logfile.write(s+"\n")
+def log(s, *args):
+    write(INFO, None, s, *args)
+
+# Shortcuts for each level.
+def debug(category, s, *args):
+    write(DEBUG, category, s, *args)
+def info(category, s, *args):
+    write(INFO, category, s, *args)
+def warning(category, s, *args):
+    write(WARNING, category, s, *args)
+def error(category, s, *args):
+    write(ERROR, category, s, *args)
 
 # This toggles logging on or off, depending on the value of the flag. One
 # trick you can use to prevent logging in production is to use a global DEBUG
 # variable and use it for the value of the toggle command. This will prevent
-# logs when DEBUG is false.
-def toggle(flag):
-    global is_logging
+# logs when DEBUG is false. The level and the categories to log can also be
+# set (a list of categories, or None for all of them).
+def toggle(flag, lvl=None, cats=False):
+    global is_logging, level, categories
     is_logging = True if flag else False
+    if lvl is not None:
+        level = lvl
+    if cats is not False:
+        categories = None if cats is None else set(cats)
+
+# This waits until every message that was logged so far has been written.
+def flush():
+    if _thread is not None:
+        _queue.join()
+
+# Start the writer thread.
+def _start():
+    global _thread
+    with _lock:
+        if _thread is None:
+            t = threading.Thread(target=_run)
+            t.daemon = True
+            t.start()
+            _thread = t
+
+# The writer thread waits for a message and then writes it along with every
+# other message waiting in the queue (up to a batch) at once.
+def _run():
+    global logfile
+    while True:
+        batch = [_queue.get()]
+        while len(batch) < _BATCH:
+            try:
+                batch.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            lines = [_format(m) for m in batch]
+            if not logfile:
+                logfile = open("log_%d"%time.time(),"w")
+            logfile.write("".join(lines))
+            logfile.flush()
+        except Exception:
+            pass
+        for m in batch:
+            _queue.task_done()
+
+# Turn a queued message into a line of the log. Messages that were logged
+# with log() are written as they are, like they always have been.
+def _format(m):
+    t, lvl, category, s, args = m
+    if args:
+        try:
+            s = s%args
+        except Exception:
+            s = "%s %r"%(s,args)
+    if lvl == INFO and category is None:
+        return s+"\n"
+    return "%.3f %s %s: %s\n"%(t, _names.get(lvl,lvl), category, s)
 
+atexit.register(flush)
@@ -0,0 +1,130 @@
+# The manager runs many sessions at once in a single process, without any
+# graphics. Each session has an id, and input for a session is queued under
+# its id until the manager gets around to it. Stepping the manager gives one
+# input to each session that has some waiting, in turn, so one busy match
+# can't hold up the others.
+#
+# The sessions are headless, so nothing is drawn or kept for drawing. Only a
+# limited number of them are kept loaded. When there are too many, the one
+# that was used least recently (and isn't in the middle of an action) is put
+# away as a map file with its history, which is a small fraction of the size
+# of a live grid. It's loaded again the next time it's needed, by replaying
+# its history. The name it saves under and its AI players go with it, so it
+# picks up where it left off.
+
+from . import session, mapfile
+
+import io
+import collections
+
+
+# Inputs are the same keys that the shell passes to a session ("up",
+# "enter", etc). An input can also be an x,y tuple, which puts the cursor on
+# x,y and presses enter.
+class Manager(object):
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self.live = collections.OrderedDict()
+        self.frozen = {}
+        self.queues = {}
+        self.next_id = 0
+
+    # Start a new session from the data of a map and return its id.
+    def open(self, data, sid=None):
+        if sid is None:
+            sid = self.next_id
+            self.next_id += 1
+        self.live[sid] = session.Session(data, True)
+        self.queues[sid] = collections.deque()
+        self.evict()
+        return sid
+
+    # Forget a session.
+    def close(self, sid):
+        s = self.live.pop(sid, None)
+        if s:
+            s.close()
+        self.frozen.pop(sid, None)
+        self.queues.pop(sid, None)
+
+    # All of the session ids, loaded or not.
+    def ids(self):
+        return list(self.live)+list(self.frozen)
+
+    # Get a session by id, loading it if it was put away. Either way, it's
+    # now the most recently used.
+    def get(self, sid):
+        if sid in self.live:
+            s = self.live.pop(sid)
+        else:
+            s = self.thaw(sid)
+        self.live[sid] = s
+        self.evict()
+        return s
+
+    # Queue inputs for a session.
+    def send(self, sid, *inputs):
+        if sid not in self.queues:
+            raise Exception("No session %s."%str(sid))
+        self.queues[sid].extend(inputs)
+
+    # Give the next queued input to every session that has one. Returns the
+    # number of inputs that were handled.
+    def step(self):
+        count = 0
+        for sid in [sid for sid in self.queues if self.queues[sid]]:
+            s = self.get(sid)
+            c = self.queues[sid].popleft()
+            if isinstance(c, tuple):
+                s.cursor = c
+                c = "enter"
+            s.handle_input(c)
+            s.tick()
+            count += 1
+        return count
+
+    # Step until no session has any input left, or until the given number of
+    # steps. Returns the number of inputs that were handled.
+    def run(self, steps=None):
+        total = 0
+        while steps is None or steps > 0:
+            n = self.step()
+            if n == 0:
+                break
+            total += n
+            if steps is not None:
+                steps -= 1
+        return total
+
+    # Put away the least recently used sessions until there are few enough
+    # loaded. Sessions that are in the middle of an action or that still have
+    # input waiting are skipped.
+    def evict(self):
+        if len(self.live) <= self.capacity:
+            return
+        for sid in list(self.live):
+            if len(self.live) <= self.capacity:
+                break
+            s = self.live[sid]
+            if s.idle() and not self.queues[sid]:
+                self.freeze(sid)
+
+    # Put a session away as a map file plus the actions it has committed in
+    # the current turn, the name it saves under and its AI players (by team
+    # index, since the teams are made again).
+    def freeze(self, sid):
+        s = self.live.pop(sid)
+        s.close()
+        ais = dict((s.grid.teams.index(t), a) for t,a in s.ais.items())
+        self.frozen[sid] = mapfile.encode(s.data), s.turn(), s.save_name, ais
+
+    # Load a session that was put away.
+    def thaw(self, sid):
+        blob,turn,name,ais = self.frozen.pop(sid)
+        data = mapfile.read(io.BytesIO(blob))
+        data["turn"] = turn
+        s = session.Session(data, True)
+        s.save_name = name
+        for i,a in ais.items():
+            s.ais[s.grid.teams[i]] = a
+        return s
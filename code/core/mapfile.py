@@ -0,0 +1,163 @@
+# The mapfile module reads and writes maps (and saved games) in a compact
+# binary format instead of JSON. Most of a JSON map is the list of tiles,
+# with an object for every x,y on the grid. Here, the terrain is stored as a
+# run-length encoded layer, and only the tiles that have an owner or a unit
+# are written out. This module is functional and contains NO state.
+#
+# The file starts with the MAGIC bytes and the length of the header,
+# followed by the header as JSON. The header has everything needed to list a
+# map (name, size, teams, players) and the lengths of each section that
+# comes after it, so read_header never has to read past the header. A game
+# saved in the middle of a turn also has the actions committed so far that
+# turn in the header, under "turn".
+#   rules: the rules as JSON
+#   layer: the terrain layer, as runs of (count, terrain) in row order, both
+#          stored as varints. Terrain 0 means no tile, otherwise it's an
+#          index+1 into the header's list of terrain names.
+#   tiles: the tiles that have a team, a unit or less than full hp, as JSON
+#   history: the history as JSON
+
+import json
+import struct
+
+MAGIC = b"ROW1"
+SECTIONS = ["rules", "layer", "tiles", "history"]
+
+
+# This turns the dictionary of a map (as read from JSON) into bytes. A map
+# that was read from a map file (with a packed layer) can be written back out
+# as it is.
+def encode(data):
+    g = data["grid"]
+    w,h = g["w"],g["h"]
+    if "layer" in g:
+        names = g["terrains"]
+        layer = g["layer"]
+        tiles = g["tiles"]
+    else:
+        names = sorted(data["rules"]["terrain"])
+        layer,tiles = _pack(g, names)
+
+    sections = {}
+    sections["rules"] = _json(data["rules"])
+    sections["layer"] = layer
+    sections["tiles"] = _json(tiles)
+    sections["history"] = _json(data.get("history",[]))
+    header = {}
+    for k in ("name","teams","allies","variables"):
+        if k in g: header[k] = g[k]
+    header["w"],header["h"] = w,h
+    header["players"] = data.get("players",{})
+    if data.get("turn"):
+        header["turn"] = data["turn"]
+    header["terrains"] = names
+    header["sections"] = [[k,len(sections[k])] for k in SECTIONS]
+    head = _json(header)
+
+    report = [MAGIC, struct.pack("<I",len(head)), head]
+    for k in SECTIONS:
+        report.append(sections[k])
+    return b"".join(report)
+
+# This reads just the header from a file object opened in binary mode. The
+# rest of the file is left unread.
+def read_header(f):
+    if f.read(len(MAGIC)) != MAGIC:
+        raise Exception("Not a map file.")
+    size, = struct.unpack("<I",f.read(4))
+    return json.loads(f.read(size).decode("utf-8"))
+
+# This reads a whole map from a file object opened in binary mode and returns
+# the same dictionary a JSON map gives, except that the grid has a packed
+# "layer" and "terrains" instead of a tile for every x,y. The grid knows how
+# to load those.
+def read(f):
+    header = read_header(f)
+    sections = {}
+    for k,n in header["sections"]:
+        sections[k] = f.read(n)
+    g = {}
+    for k in ("name","w","h","teams","allies","variables","terrains"):
+        if k in header: g[k] = header[k]
+    g["layer"] = sections["layer"]
+    g["tiles"] = json.loads(sections["tiles"].decode("utf-8"))
+    data = {}
+    data["rules"] = json.loads(sections["rules"].decode("utf-8"))
+    data["players"] = header["players"]
+    data["grid"] = g
+    data["history"] = json.loads(sections["history"].decode("utf-8"))
+    if "turn" in header:
+        data["turn"] = header["turn"]
+    return data
+
+# This decodes a packed layer into (count, terrain) runs.
+def runs(layer):
+    layer = bytearray(layer)
+    report = []
+    i = 0
+    while i < len(layer):
+        count,i = _varint(layer,i)
+        terrain,i = _varint(layer,i)
+        report.append((count,terrain))
+    return report
+
+# This packs a tile for every x,y into the runs of the terrain layer and the
+# list of tiles that have a team, a unit or less than full hp.
+def _pack(g, names):
+    w,h = g["w"],g["h"]
+    ids = {}
+    for i,n in enumerate(names):
+        ids[n] = i+1
+    layer = [0]*(w*h)
+    tiles = []
+    for c in g["tiles"]:
+        x,y = c["x"],c["y"]
+        if x < 0 or x >= w or y < 0 or y >= h:
+            continue
+        layer[y*w+x] = ids[c["terrain"]]
+        if "team" in c or "unit" in c or "hp" in c:
+            sparse = {"x": x, "y": y}
+            for k in ("team","unit","hp"):
+                if k in c: sparse[k] = c[k]
+            tiles.append(sparse)
+    return _runs(layer),tiles
+
+# This converts a JSON map (as text) into the compact format.
+def convert(text):
+    return encode(json.loads(text))
+
+# Compact JSON, as bytes.
+def _json(obj):
+    return json.dumps(obj,separators=(",",":"),sort_keys=True).encode("utf-8")
+
+# Run-length encode a list of terrain ids.
+def _runs(layer):
+    report = bytearray()
+    i = 0
+    while i < len(layer):
+        j = i
+        while j < len(layer) and layer[j] == layer[i]:
+            j += 1
+        _put_varint(report,j-i)
+        _put_varint(report,layer[i])
+        i = j
+    return bytes(report)
+
+# Write an unsigned varint (7 bits per byte, high bit means more follow).
+def _put_varint(buf, n):
+    while n >= 0x80:
+        buf.append((n&0x7f)|0x80)
+        n >>= 7
+    buf.append(n)
+
+# Read an unsigned varint from buf at i. Returns the value and the new i.
+def _varint(buf, i):
+    n = 0
+    shift = 0
+    while True:
+        b = buf[i]
+        i += 1
+        n |= (b&0x7f)<<shift
+        shift += 7
+        if b < 0x80:
+            return n,i
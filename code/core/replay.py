@@ -0,0 +1,80 @@
+# The replay module plays a saved history back onto a grid. The history of a
+# session is a list of turns, and each turn is a list of the inputs of every
+# action that was committed during that turn (the same coordinates and menu
+# strings that the player gave the session). Replaying doesn't go through the
+# session at all, so nothing is drawn and no widgets are made.
+
+from . import rules, grid
+
+
+# A Replay steps a grid through a history one turn at a time. The grid
+# should be in the state it was in when the history started (after the
+# first end_turn). Every few turns, a snapshot of the grid is kept as a
+# keyframe, so seeking back (or forward after seeking back) only has to
+# replay the turns since the closest keyframe.
+class Replay(object):
+    def __init__(self, grid, history, interval=10):
+        self.grid = grid
+        self.history = history
+        self.interval = interval
+        self.turn = 0
+        self.keyframes = {0: grid.snapshot()}
+
+    # The number of turns in the history.
+    def length(self):
+        return len(self.history)
+
+    # Replay the next turn. Every action has to commit, or the history
+    # doesn't match the grid and we raise an exception.
+    def step(self):
+        if self.turn >= len(self.history):
+            return False
+        for inputs in self.history[self.turn]:
+            result = rules.play(self.grid, decode(inputs))
+            if result != rules.ACT_COMMIT:
+                raise Exception("Replay desync on turn %d: %s gave %s"%
+                                (self.turn, str(inputs), str(result)))
+        self.grid.end_turn()
+        self.grid.forget()
+        self.turn += 1
+        if self.turn%self.interval == 0 and self.turn not in self.keyframes:
+            self.keyframes[self.turn] = self.grid.snapshot()
+        return True
+
+    # Put the grid in the state it was in after n turns of the history.
+    def seek(self, n):
+        n = max(0,min(n,len(self.history)))
+        best = max([k for k in self.keyframes if k <= n])
+        if n < self.turn or best > self.turn:
+            self.grid.restore(self.keyframes[best])
+            self.turn = best
+        while self.turn < n:
+            self.step()
+
+# Inputs that were saved as JSON (or sent over the network) come back with
+# their coordinates as lists, but the actions expect tuples. This returns a
+# list of inputs the way the actions expect them.
+def decode(inputs):
+    return [tuple(i) if isinstance(i, list) else i for i in inputs]
+
+# This makes the grid for the data of a map or saved game, without any
+# widgets. The players are put on their teams (teams without a player are
+# destroyed) and the history is replayed straight onto the grid.
+def load(data):
+    g = grid.Grid(data["grid"], data["rules"])
+    for t in g.teams:
+        t.active = False
+    for p in data["players"]:
+        pdata = data["players"][p]
+        pteam = g.teams[pdata["team"]]
+        pteam.active = True
+        pteam.name = p
+        pteam.control = pdata.get("control","human")
+    for t in [t for t in g.teams if not t.active]:
+        t.name = "---"
+        g.purge(t,True)
+    g.end_turn()
+    g.forget()
+    history = data.get("history",[])
+    Replay(g, history).seek(len(history))
+    return g
@@ -1,9 +1,12 @@
 # The Rules contain the Action objects that serve as a sort of state machine
 # for what can be done. Each action should, upon taking input, pass back a
-# new action. Each action can also contain a sprite that should be killed
-# after "perform" and modified during "update".
+# new action. The rules only ever touch the grid, so they can run without
+# any graphics at all. Anything the player should see is raised as an alert
+# on the grid.
 
-from . import entities, widgets
+from . import entities
+
+import heapq
 
 
 FORM_COORD = "coord"
@@ -40,6 +43,44 @@ class Action(object):
         return {}
 
 
+# This finds every tile that the unit at x,y can reach with its movement
+# points. It's Dijkstra's algorithm - the cheapest tiles are expanded first
+# so no tile is looked at more than once. Units may pass through allied units
+# but not enemies, and terrain that isn't in the unit's terrain dict can't be
+# entered at all. Returns two dicts keyed by (x,y): the cheapest cost to get
+# to the tile, and the tile that it was reached from (None for the start).
+def reach(grid, unit, x, y, move=None):
+    if move is None:
+        move = unit.move
+    w,h = grid.w, grid.h
+    terrain = grid.terrain
+    occupant = grid.occupant
+    table = grid.move_costs(unit)
+    costs = {(x,y): 0}
+    prev = {(x,y): None}
+    queue = [(0,x,y)]
+    while queue:
+        cost,a,b = heapq.heappop(queue)
+        if cost > costs[(a,b)]:
+            continue
+        for n in ((a-1,b),(a+1,b),(a,b-1),(a,b+1)):
+            nx,ny = n
+            if nx < 0 or nx >= w or ny < 0 or ny >= h:
+                continue
+            i = ny*w+nx
+            step = table[terrain[i]]
+            if step is None or cost+step > move:
+                continue
+            u = occupant[i]
+            if u and not u.is_allied(unit):
+                continue
+            if n not in costs or cost+step < costs[n]:
+                costs[n] = cost+step
+                prev[n] = (a,b)
+                heapq.heappush(queue, (cost+step,nx,ny))
+    return costs, prev
+
+
 # The BEGIN action is the first action and expects COORD. If the coord is a
 # unit, we display its movement range. If the coord is a terrain that can
 # produce, we begin production. If anything else, we display the GAME MENU.
@@ -76,10 +117,9 @@ class Main_Menu(Action):
         if act == "Surrender":
             cur = grid.current_team()
             grid.purge( cur )
-            cur.active = False
+            grid.set(cur, "active", False)
             msg = "%s has been defeated!"%(cur.name)
-            grid.alerts.append((widgets.Notification(msg,200,cur.color),
-                                "center"))
+            grid.alert("center", "notify", msg, 200, cur.color)
             return ACT_COMMIT
         if act == "End Turn":
             return ACT_END
@@ -108,9 +148,10 @@ class Build(Action):
         name,price = act.rsplit(None,1)
         unit = entities.Unit(name, grid.rules["units"][name])
         x,y = self.start
-        grid.current_team().cash -= int(price[1:])
-        grid.add_unit(unit,grid.current_team(),x,y)
-        unit.done()
+        team = grid.current_team()
+        grid.set(team, "cash", team.cash-int(price[1:]))
+        grid.add_unit(unit,team,x,y)
+        grid.done(unit)
         return ACT_COMMIT
         
 # MOVE follows BEGIN and expects COORD.
@@ -122,21 +163,8 @@ class Move(Action):
         unit = grid.unit_at(x,y)
 
         # Calculate movement range. TODO, calc fuel cost as well.
-        report = []
-        def _floodfill(pos,r,top=False):
-            a,b = pos
-            t,u = grid.get_at(a,b)
-            if t and (not u or u.is_allied(unit)):
-                if not top:
-                    r -= unit.terrain.get(t.terrain,r)
-                if (a,b) not in report and t.terrain in unit.terrain:
-                    report.append((a,b))
-                if r > 0:
-                    _floodfill((a-1,b),r)
-                    _floodfill((a+1,b),r)
-                    _floodfill((a,b-1),r)
-                    _floodfill((a,b+1),r)
-        _floodfill((x,y),unit.move,True)
+        self.costs, self.prev = reach(grid, unit, x, y)
+        report = self.costs.keys()
 
         # Now filter the results. We have to do something more complex
         # than a list comprehension.
@@ -154,6 +182,16 @@ class Move(Action):
                 self.choices.append((a,b))
 
         self.form = FORM_COORD
+
+    # Returns the cheapest path from the start to the destination as a list
+    # of coordinates, including both ends.
+    def path(self, dest):
+        report = []
+        while dest is not None:
+            report.append(dest)
+            dest = self.prev[dest]
+        report.reverse()
+        return report
     
     # This performs the movement. After moving, we have to figure out if the
     # unit can do anything else.
@@ -177,13 +215,12 @@ class Move(Action):
         if (u2 and u2.unit == u1.unit and u1 is not u2):
             grid.remove_unit(u1)
             start = min(u1.hp,u2.hp)
-            u2.hp = min(u1.hp+u2.hp,100)
-            u2.fuel = min(u1.fuel+u2.fuel,u2.max_fuel)
-            u2.ammo = min(u1.ammo+u2.ammo,u2.max_ammo)
-            u2.done()
-            w1 = widgets.Counter(start,u2.hp,0,
-                                 u2.hp-start+100,u2.team.color)
-            grid.alerts.append((w1,"ul"))
+            grid.set(u2, "hp", min(u1.hp+u2.hp,100))
+            grid.set(u2, "fuel", min(u1.fuel+u2.fuel,u2.max_fuel))
+            grid.set(u2, "ammo", min(u1.ammo+u2.ammo,u2.max_ammo))
+            grid.done(u2)
+            grid.alert("ul", "counter", start, u2.hp, 0,
+                       u2.hp-start+100, u2.team.color)
 
             return ACT_COMMIT
         if (u2 and u2.capacity > 0 and u1.unit in u2.carry and
@@ -192,7 +229,7 @@ class Move(Action):
             return ACT_COMMIT
 
         grid.move_unit(u1,x,y)
-        t1.hp = 100
+        grid.set(t1, "hp", 100)
         moved = False
         if (ox,oy) != (x,y):
             moved = True
@@ -213,15 +250,9 @@ class Unit_Act(Action):
         lo,hi = u.rang
         if (lo>0 and hi>0 and (not u.is_indirect or
                 (u.is_indirect and not moved))):
-            can_attack = False
-            for (a,b) in grid.get_range(x,y,lo,hi):
-                targ = grid.unit_at(a,b)
-                if (targ and not u.is_allied(targ) 
-                         and (targ.unit in u.secondary or 
-                         (targ.unit in u.primary and u.ammo > 0))):
-                    can_attack = True
-            if can_attack:
-                    self.choices.append("Attack")
+            if grid.units_in_range(x,y,lo,hi,
+                                   lambda targ: grid.can_target(u,targ)):
+                self.choices.append("Attack")
 
         # If we're carrying anything, try to unload it.
         if u and len(u.carrying) > 0:
@@ -245,27 +276,24 @@ class Unit_Act(Action):
             old_hp = t.hp
             new_hp = max(old_hp-int(u.hp*u.capture*.01),0)
 
-            t.hp = new_hp
+            grid.set(t, "hp", new_hp)
             if t.hp == 0:
                 if t.is_hq and t.team:
                     grid.purge(t.team)
-                    t.team.active = False
+                    grid.set(t.team, "active", False)
                     msg = "%s has been defeated!"%(t.team.name)
-                    grid.alerts.append((widgets.Notification(msg,200,
-                                                            t.team.color),
-                                                            "center"))
-                    t.is_hq = False
-                    for (tx,ty) in grid.all_tiles_xy():
-                        ot = grid.tile_at(tx,ty)
-                        if ot.team is t.team:
-                            ot.team = u.team
-                            ot.is_hq = False
-                            ot.hp = 100
-                            grid.change_tile(ot,tx,ty)
-                t.team = u.team
-                t.hp = 100
+                    grid.alert("center", "notify", msg, 200, t.team.color)
+                    grid.set(t, "is_hq", False)
+                    for ot in grid.tiles_of(t.team):
+                        tx,ty = ot.xy()
+                        grid.set(ot, "team", u.team)
+                        grid.set(ot, "is_hq", False)
+                        grid.set(ot, "hp", 100)
+                        grid.change_tile(ot,tx,ty)
+                grid.set(t, "team", u.team)
+                grid.set(t, "hp", 100)
                 grid.change_tile(t,x,y)
-            u.done()
+            grid.done(u)
             return ACT_COMMIT
 
         if act == "Unload":
@@ -275,7 +303,7 @@ class Unit_Act(Action):
             return Attack(x,y,grid)
 
         if act == "Wait":
-            u.done()
+            grid.done(u)
             return ACT_COMMIT
 
         if act == "Cancel":
@@ -291,12 +319,9 @@ class Attack(Action):
 
         u = grid.unit_at(x,y)
         lo,hi = u.rang
-        for (a,b) in grid.get_range(x,y,lo,hi):
-            targ = grid.unit_at(a,b)
-            if (targ and not u.is_allied(targ) 
-                     and (targ.unit in u.secondary or 
-                     (targ.unit in u.primary and u.ammo > 0))):
-                self.choices.append((a,b))
+        for targ in grid.units_in_range(x,y,lo,hi,
+                                        lambda targ: grid.can_target(u,targ)):
+            self.choices.append((targ.x,targ.y))
 
     # 
     def perform(self, act, grid):
@@ -309,47 +334,41 @@ class Attack(Action):
             start_ahp, start_dhp = atk_u.hp, def_u.hp
 
             # Calculate damage.
-            a_dmg,prim = atk_u.simulate(def_u, def_t.cover)
-            if a_dmg: def_u.hp = max(0,def_u.hp-a_dmg)
-            if prim: atk_u.ammo -= 1
+            a_dmg,prim = grid.damage(atk_u, def_u, def_t.cover)
+            if a_dmg: grid.set(def_u, "hp", max(0,def_u.hp-a_dmg))
+            if prim: grid.set(atk_u, "ammo", atk_u.ammo-1)
 
             # Only counter if hp > 0 and not indirect.
             if def_u.hp > 0 and not def_u.is_indirect and def_u.in_range(d):
-                d_dmg,prim = def_u.simulate(atk_u, atk_t.cover)
-                if d_dmg: atk_u.hp = max(0,atk_u.hp-d_dmg)
-                if prim: def_u.ammo -= 1
+                d_dmg,prim = grid.damage(def_u, atk_u, atk_t.cover)
+                if d_dmg: grid.set(atk_u, "hp", max(0,atk_u.hp-d_dmg))
+                if prim: grid.set(def_u, "ammo", def_u.ammo-1)
 
             # Draw damage animations
             t1 = start_dhp-def_u.hp
             t2 = start_ahp-atk_u.hp
-            w1 = widgets.Counter(start_dhp,def_u.hp,0,
-                                 t1+t2+100,def_u.team.color)
-            grid.alerts.append((w1,"ul"))
-            w2 = widgets.Counter(start_ahp,atk_u.hp,t1,
-                                 t1+t2+100,atk_u.team.color)
-            grid.alerts.append((w2,"br"))
+            grid.alert("ul", "counter", start_dhp, def_u.hp, 0,
+                       t1+t2+100, def_u.team.color)
+            grid.alert("br", "counter", start_ahp, atk_u.hp, t1,
+                       t1+t2+100, atk_u.team.color)
 
             # Remove dead units (and all carriees) from grid.
             if atk_u.hp > 0:
-                atk_u.done()
+                grid.done(atk_u)
             else:
                 grid.remove_unit(atk_u)
-                atk_t.hp = 100
+                grid.set(atk_t, "hp", 100)
             if def_u.hp <= 0:
                 grid.remove_unit(def_u)
-                def_t.hp = 100
+                grid.set(def_t, "hp", 100)
 
-            ateam = 0
-            dteam = 0
-            for u in grid.units:
-                if u.team is atk_u.team: ateam += 1
-                if u.team is def_u.team: dteam += 1
+            ateam = grid.count_units(atk_u.team)
+            dteam = grid.count_units(def_u.team)
             for (score,team) in ((ateam,atk_u.team),(dteam,def_u.team)):
                 if score == 0:
-                    team.active = False
+                    grid.set(team, "active", False)
                     msg = "%s has been defeated!"%(team.name)
-                    grid.alerts.append((widgets.Notification(msg,200,
-                                                team.color),"center"))
+                    grid.alert("center", "notify", msg, 200, team.color)
 
             return ACT_COMMIT
         else:
@@ -383,7 +402,7 @@ class Unload(Action):
         x,y = self.start
         u = grid.unit_at(x,y)
         if act == "Done":
-            u.done()
+            grid.done(u)
             return ACT_COMMIT
         else:
             i = int(act.split(":",1)[0])
@@ -409,7 +428,128 @@ class Unload_Placement(Action):
             u = grid.unit_at(x,y) # there's no reason to keep typing this
             dx,dy = act
             grid.unload_unit(u, self.target, dx, dy)
-            grid.unit_at(dx,dy).done()
+            grid.done(grid.unit_at(dx,dy))
         return Unload(x, y, grid, self.already)
         
         
+
+
+# These are the kinds of complete moves that a team can make in one go. They
+# are what legal_actions generates, as plain tuples:
+#   (MOVE_BUILD, (x,y), name): build a unit at the property at x,y
+#   (MOVE_WAIT, start, dest): move the unit at start to dest and wait
+#   (MOVE_ATTACK, start, dest, target): move to dest, then attack target
+#   (MOVE_CAPTURE, start, dest): move to dest, then capture it
+#   (MOVE_JOIN, start, dest): join the unit with the same kind of unit at dest
+#   (MOVE_LOAD, start, dest): load the unit into the carrier at dest
+#   (MOVE_UNLOAD, start, dest, i, drop): move to dest, then put the i'th unit
+#                                        being carried down at drop
+#   (MOVE_END,): end the turn
+MOVE_BUILD = "build"
+MOVE_WAIT = "wait"
+MOVE_ATTACK = "attack"
+MOVE_CAPTURE = "capture"
+MOVE_JOIN = "join"
+MOVE_LOAD = "load"
+MOVE_UNLOAD = "unload"
+MOVE_END = "end"
+
+# This generates all of the moves that the team (by default, the current
+# team) can make right now, without building any Action objects or menus.
+# It's lazy, so the caller can stop whenever it likes, and the movement range
+# of each unit is only worked out once. Capturing a tile that the unit's team
+# already holds is allowed by the menus but does nothing, so it is skipped.
+def legal_actions(grid, team=None):
+    if team is None:
+        team = grid.current_team()
+    if team is not grid.current_team():
+        return
+
+    # First, the properties that can build.
+    for tile in grid.tiles_of(team):
+        if tile.build and tile.unit is None:
+            for name,price in sorted(tile.build.items(), key=lambda x:x[1]):
+                if price <= team.cash:
+                    yield (MOVE_BUILD, tile.xy(), name)
+
+    # Then the units that are ready.
+    for unit in grid.units_of(team):
+        if not unit.ready or unit.x is None:
+            continue
+        start = unit.x,unit.y
+        costs,prev = reach(grid, unit, unit.x, unit.y)
+        for dest in costs:
+            t,u = grid.get_at(*dest)
+            if u and u is not unit:
+                if u.team is not unit.team:
+                    continue
+                if u.unit == unit.unit:
+                    yield (MOVE_JOIN, start, dest)
+                elif (u.capacity > 0 and unit.unit in u.carry and
+                        len(u.carrying) < u.capacity):
+                    yield (MOVE_LOAD, start, dest)
+                continue
+
+            # The unit ends up on dest, so work out what it can do there.
+            lo,hi = unit.rang
+            if (lo > 0 and hi > 0 and
+                    (not unit.is_indirect or dest == start)):
+                x,y = dest
+                for targ in grid.units_in_range(x,y,lo,hi,
+                                    lambda targ: grid.can_target(unit,targ)):
+                    yield (MOVE_ATTACK, start, dest, (targ.x,targ.y))
+            for i,c in enumerate(unit.carrying):
+                for drop in grid.get_range(dest[0],dest[1],1):
+                    dt,du = grid.get_at(*drop)
+                    if (dt and (du is None or du is unit) and
+                            c.terrain.get(dt.terrain,0) > 0):
+                        yield (MOVE_UNLOAD, start, dest, i, drop)
+            if t.can_capture and unit.capture > 0 and not t.is_allied(unit):
+                yield (MOVE_CAPTURE, start, dest)
+            yield (MOVE_WAIT, start, dest)
+
+    yield (MOVE_END,)
+
+# This turns one of the moves from legal_actions into the inputs that the
+# actions expect, starting from Begin. These are the same coordinates and
+# menu strings that a player would give the session.
+def inputs_for(grid, move):
+    kind = move[0]
+    if kind == MOVE_BUILD:
+        pos,name = move[1:]
+        price = grid.tile_at(*pos).build[name]
+        return [pos, "%s $%d"%(name,price)]
+    if kind == MOVE_WAIT:
+        return [move[1], move[2], "Wait"]
+    if kind == MOVE_ATTACK:
+        return [move[1], move[2], "Attack", move[3]]
+    if kind == MOVE_CAPTURE:
+        return [move[1], move[2], "Capture"]
+    if kind in (MOVE_JOIN, MOVE_LOAD):
+        return [move[1], move[2]]
+    if kind == MOVE_UNLOAD:
+        start,dest,i,drop = move[1:]
+        c = grid.unit_at(*start).carrying[i]
+        return [start, dest, "Unload", "%d: %s (%d%%)"%(i,c.unit,c.hp), drop,
+                "Done"]
+    if kind == MOVE_END:
+        return [(-1,-1), "End Turn"]
+    raise Exception("Unknown move: %s"%str(move))
+
+# This plays a list of inputs through the actions, starting from Begin,
+# until one of them gives an order (such as ACT_COMMIT). Returns the order,
+# or None if the inputs ran out first. The caller is responsible for the
+# order; play doesn't end turns or rewind the grid. Illegal menu inputs
+# raise an exception just like they would for the session. If whole is True,
+# the inputs have to be exactly one action: an order given before the last
+# input is ignored and None is returned instead.
+def play(grid, inputs, whole=False):
+    action = Begin()
+    for n,act in enumerate(inputs):
+        result = action.perform(act, grid)
+        if not isinstance(result, Action):
+            if whole and n != len(inputs)-1:
+                return None
+            return result
+        action = result
+    return None
@@ -0,0 +1,443 @@
+# The server runs matches for players who aren't sitting at the same machine.
+# It owns the sessions (through a manager, so only the busy ones stay loaded)
+# and nobody else changes them. Clients send it whole actions, as the same
+# coordinates and menu strings that a session keeps in its history, and the
+# server plays each one through the rules before anyone else hears about it.
+# Everyone watching the match (its players and any spectators) is then sent
+# the action, which is all they need to play it onto their own copy of the
+# grid, along with the grid's hash so they can tell if their copy drifted.
+#
+# Messages are JSON objects, one per line, both ways. From a client:
+#   {"op": "join", "match": id, "player": name}: watch the match, and play
+#       for the named player if a name is given and nobody else is
+#   {"op": "act", "inputs": [...]}: play an action for your team
+#   {"op": "undo"}: undo the last action of this turn
+#   {"op": "leave"}: stop watching the match
+# From the server:
+#   {"op": "state", "match": id, "map": ..., "turn": [...], "hash": h}: the
+#       whole match, sent on joining. The map is the match's map file (with
+#       its history) in base64, and turn is the actions committed so far
+#       this turn, like the manager puts sessions away.
+#   {"op": "act", "match": id, "team": t, "inputs": [...], "result": r,
+#       "hash": h}: an action was played. The result is "commit" or "end".
+#   {"op": "undo", "match": id, "hash": h}: the last action was undone
+#   {"op": "error", "msg": text}: only sent to the client that caused it
+#
+# The connections are plain asyncio protocols, so an idle connection is just
+# a small object and its socket, with no task waiting on it. A client that
+# stops reading is dropped rather than letting its messages pile up. The
+# Loopback connects clients to a server in the same process without any
+# sockets or event loop, which is how the tests use it.
+
+from . import manager, mapfile, replay, rules, storage
+
+import io
+import json
+import base64
+import collections
+try:
+    import asyncio
+    _Protocol = asyncio.Protocol
+except ImportError:
+    asyncio = None
+    _Protocol = object
+try:
+    _text = basestring
+except NameError:
+    _text = str
+
+# True if a value from a message can be used to look up a match or a player.
+# Lists and dicts from the wire can't be, since they can't be hashed.
+def _key(value):
+    return isinstance(value, (int, _text)) and not isinstance(value, bool)
+
+# The longest message a client may send, and the most that can be waiting to
+# be sent to a client before it's dropped.
+LINE_LIMIT = 1<<16
+WRITE_LIMIT = 1<<20
+
+# Turn a message into a line to send.
+def encode(msg):
+    return (json.dumps(msg, separators=(",",":"))+"\n").encode("utf-8")
+
+# True if the inputs look like the inputs of an action: a list of menu
+# strings and x,y coordinates. Whether they're legal is up to the rules.
+def _valid(inputs):
+    if not isinstance(inputs, list) or not inputs or len(inputs) > 64:
+        return False
+    for i in inputs:
+        if isinstance(i, list):
+            if len(i) != 2 or not all(type(n) is int for n in i):
+                return False
+        elif not isinstance(i, _text):
+            return False
+    return True
+
+
+# The server. Each match is a session in the manager, with the connections
+# that are watching it and the connection sitting in each team's seat.
+class Server(object):
+    def __init__(self, capacity=100):
+        self.manager = manager.Manager(capacity)
+        self.watchers = {}
+        self.seats = {}
+
+    # Start a match from the data of a map and return its id.
+    def open(self, data):
+        sid = self.manager.open(data)
+        self.watchers[sid] = set()
+        self.seats[sid] = {}
+        return sid
+
+    # End a match and disconnect everyone watching it.
+    def close(self, sid):
+        for conn in list(self.watchers.pop(sid, ())):
+            conn.close()
+        self.seats.pop(sid, None)
+        self.manager.close(sid)
+
+    # Make the protocol for a new connection. This is the factory to give
+    # asyncio's create_server.
+    def protocol(self):
+        return Connection(self)
+
+    # Listen on a TCP port or a unix socket. These return what the event
+    # loop's create_server does, which still has to be run on the loop.
+    def listen(self, host, port, loop=None):
+        loop = loop or asyncio.get_event_loop()
+        return loop.create_server(self.protocol, host, port)
+    def listen_unix(self, path, loop=None):
+        loop = loop or asyncio.get_event_loop()
+        return loop.create_unix_server(self.protocol, path)
+
+    # Handle a message from a connection.
+    def handle(self, conn, msg):
+        op = msg.get("op") if isinstance(msg, dict) else None
+        if op == "join":
+            sid,player = msg.get("match"), msg.get("player")
+            if not _key(sid) or not (player is None or _key(player)):
+                return conn.error("Bad message.")
+            self.join(conn, sid, player)
+        elif op == "leave":
+            self.leave(conn)
+        elif op == "act":
+            self.act(conn, msg.get("inputs"))
+        elif op == "undo":
+            self.undo(conn)
+        else:
+            conn.error("Unknown message.")
+
+    # Start watching a match, and take a player's seat if one is given.
+    def join(self, conn, sid, player=None):
+        if sid not in self.watchers:
+            return conn.error("No match %s."%str(sid))
+        s = self.manager.get(sid)
+        team = None
+        if player is not None:
+            pdata = s.data["players"].get(player)
+            if pdata is None or pdata.get("control","human") != "human":
+                return conn.error("Can't play as %s."%str(player))
+            team = pdata["team"]
+            seated = self.seats[sid].get(team)
+            if seated is not None and seated is not conn:
+                return conn.error("%s is already being played."%player)
+        self.leave(conn)
+        conn.match = sid
+        conn.team = team
+        self.watchers[sid].add(conn)
+        if team is not None:
+            self.seats[sid][team] = conn
+        blob = mapfile.encode(s.data)
+        conn.send({"op": "state", "match": sid, "turn": s.turn(),
+                   "map": base64.b64encode(blob).decode("ascii"),
+                   "hash": s.grid.hash()})
+
+    # Stop watching the match (and give up the seat).
+    def leave(self, conn):
+        sid = conn.match
+        if sid is None:
+            return
+        self.watchers.get(sid, set()).discard(conn)
+        seats = self.seats.get(sid, {})
+        if seats.get(conn.team) is conn:
+            del seats[conn.team]
+        conn.match = None
+        conn.team = None
+
+    # The session of the match the connection plays in, if it's that
+    # player's turn. Otherwise, the connection is told why not.
+    def _turn(self, conn):
+        if conn.match is None or conn.team is None:
+            conn.error("Not playing in a match.")
+            return None
+        s = self.manager.get(conn.match)
+        if s.grid.teams.index(s.grid.current_team()) != conn.team:
+            conn.error("Not your turn.")
+            return None
+        return s
+
+    # Play an action for the connection's team and tell everyone about it.
+    def act(self, conn, inputs):
+        s = self._turn(conn)
+        if s is None:
+            return
+        if not _valid(inputs):
+            return conn.error("Bad inputs.")
+        result = s.perform(inputs)
+        if result is None:
+            return conn.error("Illegal action.")
+        self.broadcast(conn.match, {"op": "act", "match": conn.match,
+                                    "team": conn.team, "inputs": inputs,
+                                    "result": result, "hash": s.grid.hash()})
+
+    # Undo the last action of the turn.
+    def undo(self, conn):
+        s = self._turn(conn)
+        if s is None:
+            return
+        if not s.history:
+            return conn.error("Nothing to undo.")
+        s.resolve(rules.ACT_UNDO)
+        self.broadcast(conn.match, {"op": "undo", "match": conn.match,
+                                    "hash": s.grid.hash()})
+
+    # Send a message to everyone watching a match. It's only encoded once.
+    def broadcast(self, sid, msg):
+        data = encode(msg)
+        for conn in list(self.watchers.get(sid, ())):
+            conn.write(data)
+
+
+# The server's end of a connection.
+class Connection(_Protocol):
+    __slots__ = ["server", "transport", "buffer", "match", "team"]
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.buffer = b""
+        self.match = None
+        self.team = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        self.server.leave(self)
+        self.transport = None
+
+    # Handle every whole line that has come in. A line that's too long is
+    # never going to be a message, so the connection is dropped.
+    def data_received(self, data):
+        self.buffer += data
+        while self.transport is not None:
+            i = self.buffer.find(b"\n")
+            if i < 0:
+                break
+            line,self.buffer = self.buffer[:i],self.buffer[i+1:]
+            try:
+                msg = json.loads(line.decode("utf-8"))
+            except ValueError:
+                self.error("Bad message.")
+                continue
+            self.server.handle(self, msg)
+        if len(self.buffer) > LINE_LIMIT:
+            self.error("Message too long.")
+            self.close()
+
+    # Send encoded data, unless too much is already waiting to be sent.
+    def write(self, data):
+        t = self.transport
+        if t is None or t.is_closing():
+            return
+        if t.get_write_buffer_size() > WRITE_LIMIT:
+            self.close()
+            return
+        t.write(data)
+
+    def send(self, msg):
+        self.write(encode(msg))
+
+    def error(self, text):
+        self.send({"op": "error", "msg": text})
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+
+# A client keeps its own copy of the match from what the server sends it,
+# and checks its grid's hash against the server's after every change. Every
+# message it gets is kept in received, and desync is set if its copy ever
+# stops matching the server's.
+class Client(_Protocol):
+    def __init__(self):
+        self.transport = None
+        self.buffer = b""
+        self.grid = None
+        self.marks = []
+        self.received = []
+        self.desync = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        self.transport = None
+
+    def data_received(self, data):
+        self.buffer += data
+        while True:
+            i = self.buffer.find(b"\n")
+            if i < 0:
+                break
+            line,self.buffer = self.buffer[:i],self.buffer[i+1:]
+            self.receive(json.loads(line.decode("utf-8")))
+
+    # Send a message to the server.
+    def send(self, op, **args):
+        args["op"] = op
+        self.transport.write(encode(args))
+
+    def join(self, sid, player=None):
+        self.send("join", match=sid, player=player)
+    def act(self, inputs):
+        self.send("act", inputs=[list(i) if isinstance(i, tuple) else i
+                                 for i in inputs])
+    def undo(self):
+        self.send("undo")
+    def leave(self):
+        self.send("leave")
+
+    # Play a message from the server onto the copy of the match. The marks
+    # are where each action this turn started in the grid's journal, so that
+    # they can be undone.
+    def receive(self, msg):
+        self.received.append(msg)
+        op = msg.get("op")
+        if op == "state":
+            blob = base64.b64decode(msg["map"].encode("ascii"))
+            self.grid = replay.load(mapfile.read(io.BytesIO(blob)))
+            self.marks = []
+            for inputs in msg["turn"]:
+                self.marks.append(self.grid.checkpoint())
+                rules.play(self.grid, replay.decode(inputs))
+        elif op == "act" and self.grid is not None:
+            mark = self.grid.checkpoint()
+            rules.play(self.grid, replay.decode(msg["inputs"]))
+            if msg["result"] == rules.ACT_END:
+                self.grid.end_turn()
+                self.grid.forget()
+                self.marks = []
+            else:
+                self.marks.append(mark)
+        elif op == "undo" and self.grid is not None and self.marks:
+            self.grid.rewind(self.marks.pop())
+        else:
+            return
+        if self.grid.hash() != msg["hash"]:
+            self.desync = True
+
+
+# A loopback connects clients to a server in the same process. Whatever
+# either end writes is queued, and run delivers everything that's queued,
+# including anything written while delivering. Nothing happens until run is
+# called, so tests can see exactly what was sent and when.
+class Loopback(object):
+    def __init__(self, server):
+        self.server = server
+        self.queue = collections.deque()
+
+    # Connect a client (a protocol, like a Client) and return it.
+    def connect(self, client):
+        conn = self.server.protocol()
+        a = LoopbackTransport(self, client)
+        b = LoopbackTransport(self, conn)
+        a.other,b.other = b,a
+        client.connection_made(a)
+        conn.connection_made(b)
+        return client
+
+    # Deliver everything, and return the number of writes delivered.
+    def run(self):
+        n = 0
+        while self.queue:
+            dest,data,src = self.queue.popleft()
+            if data is None:
+                if not dest.lost:
+                    dest.lost = True
+                    dest.protocol.connection_lost(None)
+                continue
+            src.pending -= len(data)
+            if not dest.lost:
+                dest.protocol.data_received(data)
+            n += 1
+        return n
+
+
+# One end of a loopback connection, which acts like an asyncio transport.
+class LoopbackTransport(object):
+    __slots__ = ["wire", "protocol", "other", "pending", "closing", "lost"]
+
+    def __init__(self, wire, protocol):
+        self.wire = wire
+        self.protocol = protocol
+        self.other = None
+        self.pending = 0
+        self.closing = False
+        self.lost = False
+
+    def write(self, data):
+        if self.closing:
+            return
+        self.pending += len(data)
+        self.wire.queue.append((self.other, data, self))
+
+    # Closing either end closes both, once everything written before has
+    # been delivered.
+    def close(self):
+        if self.closing:
+            return
+        self.closing = self.other.closing = True
+        self.wire.queue.append((self, None, self.other))
+        self.wire.queue.append((self.other, None, self))
+
+    def is_closing(self):
+        return self.closing
+
+    def get_write_buffer_size(self):
+        return self.pending
+
+    def get_extra_info(self, name, default=None):
+        return default
+
+
+# Run a server with a match for each map given, until it's interrupted. The
+# options are --host=, --port= and --unix= (to listen on a unix socket
+# instead of a TCP port) and --capacity= (the most matches kept loaded).
+def main(*args):
+    opts = {"host": "127.0.0.1", "port": "7777", "unix": None,
+            "capacity": "100"}
+    maps = []
+    for a in args:
+        if a.startswith("--") and "=" in a:
+            k,v = a[2:].split("=",1)
+            opts[k] = v
+        elif not a.startswith("--"):
+            maps.append(a)
+    server = Server(int(opts["capacity"]))
+    for name in maps:
+        server.open(json.loads(storage.read_data("maps",name)))
+    loop = asyncio.new_event_loop()
+    if opts["unix"]:
+        listener = server.listen_unix(opts["unix"], loop)
+    else:
+        listener = server.listen(opts["host"], int(opts["port"]), loop)
+    listener = loop.run_until_complete(listener)
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+        loop.close()
@@ -3,51 +3,87 @@
 # set of RULES. The RULES and MAP are usually provided in the form of a JSON
 # data file.
 
-from . import grid, rules, widgets
+from . import rules, widgets, replay, ai, storage, mapfile
 
 from graphics import sprites, draw
 
-import copy
+import json
 
 # In theory, the game engine should be able to handle multiple sessions
 # simultaneously. The session should be provided with a Dict generated from the
 # JSON of a map in the following format.
 #   rules: a dict containing the unit and terrain definitions
 #   grid: a dict containing all of the tiles and other map variables (w,h,etc)
-#   players: a list of the players, mapped to the teams in the grid
+#   players: a list of the players, mapped to the teams in the grid. A
+#            player with "control" set to "ai" is played by the computer,
+#            with the options in "ai" (see ai.AI).
 #   history: (optional) list of moves that have been played so far
+#   turn: (optional) the actions committed so far in the current turn
+#
+# A session that has been saved keeps its game up to date on disk. Saving
+# writes the whole game as a map file (see mapfile), and from then on, each
+# turn that ends is added to a journal next to it instead of writing the
+# whole game out again. Loading reads the map file and the journal together.
+# The files are written in the background (see storage.save_later), and the
+# map file is replaced in one step, so a crash can't leave a broken save.
+#
+# A headless session (like the ones a manager runs) has no view of the grid
+# and no sprites. It takes the same input and plays the same match, but it
+# can't be rendered.
 class Session(object):
-    def __init__(self, data):
+    def __init__(self, data, headless=False):
         self.data = data
-        self.grid = grid.Grid(data["grid"], data["rules"])
+        self.headless = headless
+        self.data["history"] = data.get("history",[])
+        self.grid = replay.load(data)
         self.w = 60
         self.h = 23
 
-        # Load the players. If a team does not have a respective player,
-        # destroy that team.
-        for t in self.grid.teams:
-            t.active = False
+        # Players that are played by the computer each get an AI.
+        self.ais = {}
         for p in data["players"]:
             pdata = data["players"][p]
-            pteam = self.grid.teams[pdata["team"]]
-            pteam.active = True
-            pteam.name = p
-        for t in [t for t in self.grid.teams if not t.active]:
-            t.name = "---"
-            self.grid.purge(t,True)
-        
+            if pdata.get("control") == "ai":
+                self.ais[self.grid.teams[pdata["team"]]] = ai.AI(
+                    **pdata.get("ai",{}))
+
         # Create the state machine widgets. These contain the ability to
-        # undo actions and whatnot.
-        self.grid.end_turn()
+        # undo actions and whatnot. The checkpoint is a mark in the grid's
+        # journal. Restarting the turn rewinds the whole journal. The inputs
+        # are the inputs given to the action that is in progress.
         self.action = rules.Begin()
-        self.startover = copy.deepcopy(self.grid)
-        self.checkpoint = copy.deepcopy(self.grid)
+        self.checkpoint = self.grid.checkpoint()
         self.inputs = []
-        replay = data.pop("history",[])
-        self.data["history"] = []
         self.history = []
         self.tab = 0
+        self.save_name = None
+
+        # If the session was put away in the middle of a turn, the actions
+        # that were committed so far this turn are played again, so that they
+        # can still be undone.
+        for inputs in data.pop("turn",[]):
+            inputs = replay.decode(inputs)
+            result = rules.play(self.grid, inputs)
+            if result != rules.ACT_COMMIT:
+                raise Exception("Can't resume turn: %s gave %s"%
+                                (str(inputs), str(result)))
+            self.history.append((self.checkpoint, inputs))
+            self.checkpoint = self.grid.checkpoint()
         
+        # These are other elements, such as the menu, cursor,
+        # animation timer, etc.
+        self.cursor = 0,0
+        self.scroll = 0,0
+        self.animation = 0.0
+        self.menu = None
+        self.notifications = []
+        self.speed = 0.05
+        self.view = None
+        self.canvas = None
+        self.highlight = None
+        if headless:
+            return
+
         # Create the canvases that contain all of the sprites.
         self.canvas = sprites.Sprite(0,0,80,24)
         self.grid_container = sprites.Sprite(0,0,self.w,self.h)
@@ -57,22 +93,14 @@ class Session(object):
         self.canvas.fill(' ')
         self.grid_container.fill(' ')
         self.grid_canvas.fill(' ')
-        self.grid_canvas.add_sprite(self.grid.sprite)
+        self.view = widgets.GridView(self.grid)
+        self.grid_canvas.add_sprite(self.view.sprite)
         self.cursor_sprite = sprites.Sprite(0,0,1,1,100)
         self.grid_canvas.add_sprite(self.cursor_sprite)
         self.highlight = sprites.Sprite(0,0,1,1)
         self.cursor_sprite.putc(None,0,0,None,None,False,True)
         self.highlight.hide()        
 
-        # These are other elements, such as the menu, cursor,
-        # animation timer, etc.
-        self.cursor = 0,0
-        self.scroll = 0,0
-        self.animation = 0.0
-        self.menu = None
-        self.notifications = []
-        self.speed = 0.05
-
 
         
     # This exports our data as a dictionary to be JSONified. If history is
@@ -80,7 +108,56 @@ class Session(object):
     # If griddata is included, it's like using the current snapshot as a new
     # map.
     def export(self, history=True, griddata=False):
-        return {}
+        report = {}
+        report["rules"] = self.data["rules"]
+        report["players"] = self.data["players"]
+        if griddata:
+            report["grid"] = self.grid.export()
+            report["history"] = []
+        else:
+            report["grid"] = self.data["grid"]
+            report["history"] = list(self.data["history"]) if history else []
+            if history and self.history:
+                report["turn"] = self.turn()
+        return report
+
+    # Save the game under the name, in the background. Turns that end after
+    # this are added to the save's journal.
+    def save(self, name):
+        self.save_name = name
+        data = self.export()
+        storage.save_later(lambda: mapfile.encode(data), "saves", name+".row")
+        storage.save_later("", "saves", name+".journal")
+
+    # Add the turn that just ended to the journal of the save. Each record
+    # has the number of the turn, so that loading can tell which turns are
+    # already in the map file.
+    def journal(self):
+        n = len(self.data["history"])-1
+        record = {"turn": n, "actions": self.data["history"][n]}
+        storage.append_later(json.dumps(record,separators=(",",":"))+"\n",
+                             "saves", self.save_name+".journal")
+
+    # The inputs of every action that was committed so far this turn. A
+    # session made with these as the "turn" of its data picks up where this
+    # one is.
+    def turn(self):
+        return [list(acts) for (cp,acts) in self.history]
+
+    # Let go of what the session holds outside of itself: the view stops
+    # following the grid and the AI players shut down their worker
+    # processes. The AIs start them again if they're used after this.
+    def close(self):
+        if self.view:
+            self.view.close()
+        for player in self.ais.values():
+            player.close()
+
+    # True if the session isn't in the middle of an action, so nothing would
+    # be lost if it were saved and loaded again.
+    def idle(self):
+        return (not self.inputs and not self.menu and
+                isinstance(self.action, rules.Begin))
     
     # This function takes the character that was most recently entered by the
     # player and handles it. Even if no player is playing, this function
@@ -89,7 +166,7 @@ class Session(object):
         cx,cy = self.cursor
         sx,sy = self.scroll
 
-        for n,loc in self.grid.info():
+        for n,loc in self.view.info() if self.view else []:
             self.notifications.append(n)
             self.grid_canvas.add_sprite(n.sprite)
             ns = n.sprite
@@ -117,8 +194,8 @@ class Session(object):
                 if c == "down": cy += 1
                 if c == "\t":
                     self.tab += 1
-                    tabbables = [u for u in self.grid.units if u.ready
-                                 and u.team is self.grid.current_team()
+                    tabbables = [u for u in self.grid.units_of(
+                                     self.grid.current_team()) if u.ready
                                  and u.x is not None and u.y is not None]
                     if len(tabbables):
                         self.tab %= len(tabbables)
@@ -137,11 +214,13 @@ class Session(object):
                     while ( cy-sy > self.h): sy += 5
                     if ((sx,sy) != self.scroll):
                         self.scroll = sx,sy
-                        self.grid_canvas.move_to(-sx,-sy)
+                        if self.view:
+                            self.grid_canvas.move_to(-sx,-sy)
                 if c == "enter":
                     result = self.action.perform(self.cursor, self.grid)
                     self.inputs.append(self.cursor)
-                self.cursor_sprite.move_to(cx,cy)
+                if self.view:
+                    self.cursor_sprite.move_to(cx,cy)
             elif self.action.form == rules.FORM_MENU:
                 if c:
                     val = self.menu.handle_input(c)
@@ -152,59 +231,30 @@ class Session(object):
                     else:
                         info = self.action.info(self.menu.info(), self.grid)
 
+        # If the team is played by the computer, the AI makes one move each
+        # time we get input (or a frame passes), through the same actions.
+        elif (self.grid.current_team() in self.ais and not self.grid.winners
+                and isinstance(self.action, rules.Begin)):
+            player = self.ais[self.grid.current_team()]
+            move = player.choose(self.grid, self.data, self.turn())
+            for i in rules.inputs_for(self.grid, move):
+                self.inputs.append(i)
+                result = self.action.perform(i, self.grid)
+                if not isinstance(result, rules.Action):
+                    break
+                self.action = result
+
                     
         # If we got a result from performing an action, we will be given
         # either an order or a new action to perform. The orders tell us that
         # the action was complete and that we either need to commit it or
         # undo our mess.
         if result:
-            if result == rules.ACT_COMMIT:
-                self.history.append((copy.deepcopy(self.checkpoint),
-                                     self.inputs))
-                self.checkpoint = copy.deepcopy(self.grid)
-                self.action = rules.Begin()
-            elif result == rules.ACT_TRASH:
-                self.grid.sprite.kill()
-                self.inputs = []
-                self.grid = copy.deepcopy(self.checkpoint)
-                self.grid_canvas.add_sprite(self.grid.sprite)
-                self.grid.info()
-                self.action = rules.Begin()
-            elif result == rules.ACT_UNDO:
-                self.grid.sprite.kill()
-                cp = None
-                if len(self.history) > 0:
-                    cp, acts = self.history.pop()
-                else:
-                    cp = self.checkpoint
-                self.grid = copy.deepcopy(cp)
-                self.checkpoint = copy.deepcopy(cp)
-                self.grid_canvas.add_sprite(self.grid.sprite)
-                self.grid.info()
-                self.action = rules.Begin()
-            elif result == rules.ACT_RESTART:
-                self.history = []
-                self.inputs = []
-                self.grid.sprite.kill()
-                self.grid = copy.deepcopy(self.startover)
-                self.checkpoint = copy.deepcopy(self.startover)
-                self.grid_canvas.add_sprite(self.grid.sprite)
-                self.action = rules.Begin()
-            elif result == rules.ACT_END:
-                history = []
-                self.data["history"].append(history)
-                for (cp,acts) in self.history:
-                    history.append(acts)
-                self.history = []
-                self.grid.end_turn()
-                self.startover = copy.deepcopy(self.grid)
-                self.checkpoint = copy.deepcopy(self.grid)
-                self.action = rules.Begin()
-            else:
-                self.action = result
+            self.resolve(result)
             
-            # Set up various UI candy.
-            if self.action.form == rules.FORM_COORD:
+            # Set up various UI candy. A headless session still needs the
+            # menu to take input, but it has nowhere to show it.
+            if self.action.form == rules.FORM_COORD and self.view:
                 self.highlight.kill()
                 self.highlight = sprites.Sprite(0,0,self.grid.w,self.grid.h,50)
                 c = None
@@ -219,13 +269,98 @@ class Session(object):
                 self.grid_canvas.add_sprite(self.highlight)
                 self.animation = 0.0
             elif self.action.form == rules.FORM_MENU:
-                self.menu = widgets.Menu(self.action.choices)
-                self.menu.sprite.move_to(cx+1,cy)
-                self.grid_canvas.add_sprite(self.menu.sprite)
+                self.menu = widgets.Menu(self.action.choices, self.headless)
+                if self.view:
+                    self.menu.sprite.move_to(cx+1,cy)
+                    self.grid_canvas.add_sprite(self.menu.sprite)
+
+    # Carry out the result of performing an action. An order finishes the
+    # action that is in progress: it's committed, thrown away, undone, etc.
+    # Anything else is the next action, which needs more input.
+    def resolve(self, result):
+        if result == rules.ACT_COMMIT:
+            self.history.append((self.checkpoint, self.inputs))
+            self.inputs = []
+            self.checkpoint = self.grid.checkpoint()
+            self.action = rules.Begin()
+        elif result == rules.ACT_TRASH:
+            self.inputs = []
+            self.grid.rewind(self.checkpoint)
+            self.drop_alerts()
+            self.action = rules.Begin()
+        elif result == rules.ACT_UNDO:
+            cp = None
+            if len(self.history) > 0:
+                cp, acts = self.history.pop()
+            else:
+                cp = self.checkpoint
+            self.inputs = []
+            self.grid.rewind(cp)
+            self.checkpoint = cp
+            self.drop_alerts()
+            self.action = rules.Begin()
+        elif result == rules.ACT_RESTART:
+            self.history = []
+            self.inputs = []
+            self.grid.rewind()
+            self.checkpoint = self.grid.checkpoint()
+            self.action = rules.Begin()
+        elif result == rules.ACT_END:
+            history = []
+            self.data["history"].append(history)
+            for (cp,acts) in self.history:
+                history.append(acts)
+            if self.save_name:
+                self.journal()
+            self.history = []
+            self.inputs = []
+            self.grid.end_turn()
+            self.grid.forget()
+            self.checkpoint = self.grid.checkpoint()
+            self.action = rules.Begin()
+        else:
+            self.action = result
+
+    # Play a whole action at once, from the inputs that it was committed
+    # with (the same coordinates and menu strings as in the history), instead
+    # of one key at a time. This is how actions come in from over a network.
+    # Returns the order that the action ended with, which is ACT_COMMIT or
+    # ACT_END, or None if the inputs weren't a whole, legal action. In that
+    # case, the grid is left the way it was. The popups that the action
+    # raises are dropped, since nobody saw it being played.
+    def perform(self, inputs):
+        if not self.idle() or self.grid.winners:
+            return None
+        inputs = replay.decode(inputs)
+        try:
+            result = rules.play(self.grid, inputs, True)
+        except Exception:
+            result = None
+        if result not in (rules.ACT_COMMIT, rules.ACT_END):
+            self.grid.rewind(self.checkpoint)
+            self.drop_alerts()
+            return None
+        self.inputs = inputs
+        self.resolve(result)
+        self.drop_alerts()
+        return result
+
+    # Throw away the popups that the view is waiting to show.
+    def drop_alerts(self):
+        if self.view:
+            self.view.info()
 
     # The session has multiple sprites that need to be rendered, from the
     # view of the grid to the mutliple popups that need to appear.
     def render(self, x, y):
+        self.tick()
+        if self.canvas:
+            self.canvas.render(0,0)
+
+    # This moves the animations and notifications along by one frame without
+    # drawing anything. Sessions that are never rendered (like the ones that
+    # a manager runs) still need this, or the notifications pile up.
+    def tick(self):
         self.animation += self.speed
         if self.animation >= 1.0:
             self.animation = 0.0
@@ -233,17 +368,35 @@ class Session(object):
                 self.highlight.hide()
             elif self.highlight and not self.highlight.visible:
                 self.highlight.show()
-                for u in self.grid.units:
-                    u.cycle_anim()
+                self.view.cycle_anim()
         notifications = self.notifications
         self.notifications = []
         for n in notifications:
             n.update()
             if n.alive:
                 self.notifications.append(n)
-        self.canvas.render(0,0)
-
 
 
-    
-
+# Load the game that was saved under the name, or return None if there isn't
+# one. The turns in the journal that come after the map file's history are
+# played on top of it. A record that was cut short (by a crash while it was
+# being written) ends the journal.
+def load(name):
+    f = storage.open_file("saves", name+".row")
+    if f is None:
+        return None
+    try:
+        data = mapfile.read(f)
+    finally:
+        f.close()
+    for line in (storage.read("saves", name+".journal") or "").splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            break
+        if record["turn"] == len(data["history"]):
+            data["history"].append(record["actions"])
+            data.pop("turn", None)
+    s = Session(data)
+    s.save_name = name
+    return s
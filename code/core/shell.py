@@ -6,7 +6,7 @@
 
 from graphics import gfx, draw, sprites
 
-from . import storage, session
+from . import storage, session, mapfile, stats
 
 import sys
 import os
@@ -14,6 +14,9 @@ import traceback
 import random
 import unittest
 import json
+import time
+import marshal
+import cProfile
 
 # A Shell represents a single instance of a game session with the human player.
 # The shell can also initiate the game's unit tests.
@@ -24,11 +27,36 @@ class Shell(object):
         
         if "--test" in args:
             self.mode = "test"
+        if "--convert" in args:
+            self.mode = "convert"
+        if "--bench" in args:
+            self.mode = "bench"
+        if "--serve" in args:
+            self.mode = "serve"
+
+        # With --stats, the time each frame spends in each phase is shown in
+        # an overlay and saved on exit. --profile also runs the profiler.
+        self.stats = None
+        self.profile = None
+        if "--stats" in args or "--profile" in args:
+            self.stats = stats.Stats()
+        if "--profile" in args:
+            self.profile = cProfile.Profile()
         if "--sdl" in args:
             self.graphics = "sdl"
 
+        self.args = args
         self.menu = None
-        self.game = session.Session(json.loads(storage.read_data("maps","Intro.json")))
+        self.stats_parent = None
+
+        # With --save=NAME, the game is picked up from the save with that
+        # name (if there is one) and kept saved under it as it's played.
+        saves = [a[len("--save="):] for a in args if a.startswith("--save=")]
+        self.game = session.load(saves[-1]) if saves else None
+        if self.game is None:
+            self.game = session.Session(json.loads(storage.read_data("maps","Intro.json")))
+            if saves:
+                self.game.save(saves[-1])
     
     # Runs an interactive session of our game with the player until either
     # the player stops playing or an error occurs. If a game or the main
@@ -42,6 +70,33 @@ class Shell(object):
             unittest.TextTestRunner().run(suite)
             return
 
+        # Benchmark drawing the maps given on the command line.
+        if self.mode == "bench":
+            from benchmarks import render
+            render.main(*[a for a in self.args[1:] if a != "--bench"])
+            return
+
+        # Run a match server for the maps given on the command line.
+        if self.mode == "serve":
+            from . import server
+            server.main(*[a for a in self.args[1:] if a != "--serve"])
+            return
+
+        # Convert all of the JSON maps that come with the game into the
+        # compact map format and save them in the home directory.
+        if self.mode == "convert":
+            for name in storage.list_datafiles("maps"):
+                if name.endswith(".json"):
+                    try:
+                        data = mapfile.convert(storage.read_data("maps",name))
+                    except:
+                        print("Can't convert %s."%name)
+                        continue
+                    target = name[:-len(".json")]+".row"
+                    storage.save(data,"maps",target)
+                    print("Converted %s to %s."%(name,target))
+            return
+
         # First, we try to start the graphics. If FOR ANY REASON the graphics
         # don't start, try the fallback mode. If FOR ANY REASON that fails,
         # we give up.
@@ -68,24 +123,34 @@ class Shell(object):
             self.a = sprites.Sprite(1,1,1,1)
             self.a.putc("a",0,0)
             self.menu.add_sprite(self.a)
+            self.show_stats()
+            if self.profile:
+                self.profile.enable()
             gfx.refresh()
             while self.menu or self.game:
+                self.lap(None)
                 c = gfx.get_input()
                 res = None
                 if c == "o": self.a.move(1,0)
                 if c == "i": self.a.move(-1,0)
+                self.lap("input")
 
                 # If the game is running, pass input to the game. Otherwise,
                 # pass input to the menu.
                 if self.game:
                     res = self.game.handle_input(c)
+                    self.lap("logic")
                     self.game.render(0,0)
+                    self.lap("render")
                     
                     if res == "quit":
-                        self.game = None
+                        self.end_game()
+                        self.show_stats()
                 elif self.menu:
                     res = self.menu.handle_input(c)
+                    self.lap("logic")
                     self.menu.render(0,0)
+                    self.lap("render")
                     
                     if res == "quit":
                         self.menu = None
@@ -93,10 +158,62 @@ class Shell(object):
                         pass # TODO start a game yo
 
                 gfx.refresh()
+                self.lap("present")
+                if self.stats:
+                    self.stats.frame()
+            self.end_game()
             gfx.stop()
+            self.save_stats()
         except:
+            self.end_game()
             gfx.stop()  
+            self.save_stats()
             print(traceback.format_exc())
             sys.exit(-1)
+
+    # Close the game that is running, if there is one.
+    def end_game(self):
+        if self.game:
+            self.game.close()
+            self.game = None
+
+    # Put the frame stats overlay on the screen that's showing: the game's
+    # canvas while a game runs, and the menu otherwise. A sprite can only
+    # have one parent, so it's taken off the screen it was on before.
+    def show_stats(self):
+        if not self.stats:
+            return
+        parent = self.game.canvas if self.game else self.menu
+        if parent is self.stats_parent:
+            return
+        if self.stats_parent:
+            self.stats_parent.remove_sprite(self.stats.sprite)
+        if parent:
+            parent.add_sprite(self.stats.sprite)
+            self.stats.sprite.redraw()
+        self.stats_parent = parent
+
+    # Record the time since the last lap as the time spent in the phase. With
+    # no phase, this just starts the frame.
+    def lap(self, phase):
+        if self.stats:
+            if phase:
+                self.stats.lap(phase)
+            else:
+                self.stats.mark = stats.clock()
+
+    # Save the frame stats and the profile (if there are any) in the stats
+    # folder of the home directory.
+    def save_stats(self):
+        if self.stats:
+            name = self.stats.dump()
+            if name:
+                print("Saved frame stats to %s."%name)
+        if self.profile:
+            self.profile.disable()
+            self.profile.create_stats()
+            name = "profile-%s.prof"%time.strftime("%Y%m%d-%H%M%S")
+            if storage.save(marshal.dumps(self.profile.stats),"stats",name):
+                print("Saved profile to %s."%name)
         
 
@@ -0,0 +1,86 @@
+# The stats module keeps track of where the time goes in each frame. The
+# shell times every phase of its main loop (reading input, running the game
+# logic, rendering the sprites and presenting them on the screen) and records
+# them here. Only the most recent frames are kept, in a ring buffer, so it
+# can run for a whole match. The stats can be shown in an overlay on top of
+# the game and are saved in the home directory when the game exits.
+
+from graphics import draw, sprites
+
+from . import storage
+
+import json
+import time
+import timeit
+
+PHASES = ["input", "logic", "render", "present"]
+
+clock = timeit.default_timer
+
+
+# Frame stats for the last few frames. Each phase has a list of times in
+# seconds, and i is where the next frame goes. Once the lists are full, the
+# oldest frames are overwritten.
+class Stats(object):
+    def __init__(self, size=600, every=25):
+        self.size = size
+        self.every = every
+        self.times = dict((p,[0.0]*size) for p in PHASES)
+        self.i = 0
+        self.count = 0
+        self.sprite = sprites.Sprite(60,17,20,len(PHASES)+2,300)
+        self.sprite.blit(draw.border(0,0,20,len(PHASES)+2),0,0)
+        self.mark = clock()
+
+    # Record the time since the last mark (or the start of the frame) as the
+    # time spent in the phase.
+    def lap(self, phase):
+        now = clock()
+        self.times[phase][self.i] = now-self.mark
+        self.mark = now
+
+    # Finish the frame. Every few frames, the overlay is redrawn.
+    def frame(self):
+        self.i = (self.i+1)%self.size
+        self.count += 1
+        if self.count%self.every == 0:
+            self.draw()
+        self.mark = clock()
+
+    # The times of a phase for every frame that is kept, oldest first.
+    def history(self, phase):
+        t = self.times[phase]
+        if self.count < self.size:
+            return t[:self.count]
+        return t[self.i:]+t[:self.i]
+
+    # The pth percentile (0-100) of a phase, in milliseconds.
+    def percentile(self, phase, p):
+        t = sorted(self.history(phase))
+        if not t:
+            return 0.0
+        return 1000.0*t[min(len(t)-1,int(len(t)*p/100.0))]
+
+    # Draw the median and 95th percentile of each phase in the overlay.
+    def draw(self):
+        for j,p in enumerate(PHASES):
+            line = "%-7s%5.1f %5.1f"%(p,self.percentile(p,50),
+                                     self.percentile(p,95))
+            self.sprite.blit(draw.string(0,0,line[:18]),1,j+1)
+
+    # The stats as a dictionary, ready to be saved as JSON.
+    def export(self):
+        report = {"frames": self.count, "phases": PHASES, "percentiles": {}}
+        for p in PHASES:
+            report["percentiles"][p] = dict(("p%d"%n,self.percentile(p,n))
+                                            for n in (50,90,95,99,100))
+        report["history"] = list(zip(*[self.history(p) for p in PHASES]))
+        return report
+
+    # Save the stats in the stats folder of the home directory. Returns the
+    # name of the file, or None if it couldn't be saved.
+    def dump(self):
+        name = "frames-%s.json"%time.strftime("%Y%m%d-%H%M%S")
+        if storage.save(json.dumps(self.export()),"stats",name):
+            return name
+        return None
@@ -1,16 +1,33 @@
 # The storage module is a platform-independent way of saving and loading
 # files to certain locations. This module is global and functional. It contains
-# NO state information.
+# NO state information, apart from the queue of writes waiting to be done in
+# the background.
 #
 # There are two data stores. The local data stored in the user's home directory
 # and the global data stored in /data/ in the game's runtime location. The data
 # directory must be two sublevels above this file. Information should never
 # be saved in data... only in home.
 
+from . import log
+
 import os
+import errno
+import binascii
+import stat
+import atexit
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 GAME_DIR = ".rules-of-war"
 
+# The writes waiting to be done by the background thread, in order.
+_queue = queue.Queue()
+_thread = None
+_lock = threading.Lock()
+
 # This reads the text from a file in the home directory. Each arg is a
 # folder in the filename, and will be joined as appropriate. Returns None if
 # the file does not exist.
@@ -27,6 +44,19 @@ def read(*args):
     except:
         return None
 
+# This opens a file in the home directory for reading in binary mode, so
+# that the caller can read as little of it as it needs. The caller must close
+# the file. Returns None if the file does not exist.
+def open_file(*args):
+    home = os.path.join(os.path.expanduser("~"),GAME_DIR)
+    target = os.path.join(home, *args)
+    if not os.path.exists(target):
+        return None
+    try:
+        return open(target,"rb")
+    except:
+        return None
+
 # This returns a list of filenames under the provided directory.
 def list_files(*args):
     home = os.path.join(os.path.expanduser("~"),GAME_DIR)
@@ -36,22 +66,147 @@ def list_files(*args):
     return [ f for f in os.listdir(target)
              if os.path.isfile(os.path.join(target,f)) ]
 
-# This saves a file to the home directory, overwriting if appropriate.
-# Returns False if something goes wrong.
+# This saves a file to the home directory, overwriting if appropriate. If
+# the data is bytes, it is written in binary mode. The data is written to a
+# temporary file next to the target, which then replaces the target in one
+# step, so a crash part way through leaves the old file as it was. The new
+# file keeps the old one's permissions. Returns False if something goes
+# wrong.
 def save(data, *args):
-    home = os.path.join(os.path.expanduser("~"),GAME_DIR)
-    targetdir = os.path.join(home, *(args[:-1]))
-    target = os.path.join(home, *args)
-    if not os.path.exists(targetdir):
-        os.makedirs(targetdir)
+    target = _target(*args)
+    temp = None
     try:
-        f = open(target,"w")
+        fd,temp = _temp(target)
+        f = os.fdopen(fd,"wb" if isinstance(data, bytes) else "w")
         f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
         f.close()
+        if os.path.exists(target):
+            os.chmod(temp, stat.S_IMODE(os.stat(target).st_mode))
+        _replace(temp, target)
+        _sync_dir(os.path.dirname(target))
         return True
     except:
+        if temp and os.path.exists(temp):
+            os.remove(temp)
         return False
 
+# This adds to the end of a file in the home directory, making it if it isn't
+# there yet. This is for journals, where each write is a new record. Only the
+# last record can be cut short by a crash, so whoever reads the journal
+# should ignore a last record that isn't whole. Returns False if something
+# goes wrong.
+def append(data, *args):
+    target = _target(*args)
+    try:
+        new = not os.path.exists(target)
+        f = open(target,"ab" if isinstance(data, bytes) else "a")
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        if new:
+            _sync_dir(os.path.dirname(target))
+        return True
+    except:
+        return False
+
+# These are like save and append, but the writing is done on a background
+# thread so the caller doesn't have to wait for the disk. The data can also
+# be a function that returns the data, in which case it is called on the
+# background thread too, so expensive encoding doesn't hold up the game (the
+# function mustn't use anything that the game might change in the meantime).
+# Writes are done in the order they're asked for.
+def save_later(data, *args):
+    _put(save, data, args)
+def append_later(data, *args):
+    _put(append, data, args)
+
+# This waits until every write asked for so far has been done.
+def flush():
+    if _thread is not None:
+        _queue.join()
+
+# The path of a file in the home directory. The folders are made if they
+# don't exist yet.
+def _target(*args):
+    home = os.path.join(os.path.expanduser("~"),GAME_DIR)
+    targetdir = os.path.join(home, *(args[:-1]))
+    if not os.path.exists(targetdir):
+        os.makedirs(targetdir)
+    return os.path.join(home, *args)
+
+# Move the file at src over dst in one step. Old versions of Python don't
+# have os.replace, and rename won't replace a file on Windows.
+def _replace(src, dst):
+    if hasattr(os, "replace"):
+        os.replace(src, dst)
+    else:
+        if os.name == "nt" and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+# Make a new temporary file next to the target and open it for writing.
+# Unlike mkstemp (which only lets the owner read the file), it gets the
+# permissions the umask allows, like any other new file.
+def _temp(target):
+    while True:
+        temp = "%s.%s.tmp"%(target, binascii.hexlify(os.urandom(4)).decode())
+        try:
+            fd = os.open(temp, os.O_CREAT|os.O_EXCL|os.O_WRONLY|
+                               getattr(os, "O_BINARY", 0), 0o666)
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                continue
+            raise
+        return fd,temp
+
+# Make sure a file that was just made or replaced in the folder is still
+# there after a crash. Not every system can open a folder (Windows can't),
+# and there's nothing to do about it where it fails.
+def _sync_dir(path):
+    if os.name == "nt":
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+# Queue a write for the background thread, starting it if needed.
+def _put(fn, data, args):
+    global _thread
+    if _thread is None:
+        with _lock:
+            if _thread is None:
+                t = threading.Thread(target=_run)
+                t.daemon = True
+                t.start()
+                _thread = t
+    _queue.put((fn, data, args))
+
+# The background thread does each write in turn.
+def _run():
+    while True:
+        fn,data,args = _queue.get()
+        try:
+            if callable(data):
+                data = data()
+            if not fn(data, *args):
+                log.error("storage", "Couldn't write %s", os.path.join(*args))
+        except Exception as e:
+            log.error("storage", "Couldn't write %s: %s", os.path.join(*args),
+                      e)
+        _queue.task_done()
+
+atexit.register(flush)
+
 # This reads a file from the provided data directory.
 def read_data(*args):
     data = os.path.join(os.path.dirname(os.path.realpath(__file__)),
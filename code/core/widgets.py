@@ -8,9 +8,14 @@ from graphics import draw, sprites
 # an arrow key moves the highlighted line of text, and pressing enter
 # will cause the interaction to return the string of the menu. Keyboard
 # shortcuts will automatically be assigned based on the first letter of
-# an option.
+# an option. A headless menu takes the same input but has no sprite.
 class Menu(object):
-    def __init__(self, items):
+    def __init__(self, items, headless=False):
+        self.index = 0
+        self.items = items
+        self.sprite = None
+        if headless:
+            return
         h = len(items)
         w = 0
         for s in items:
@@ -26,8 +31,6 @@ class Menu(object):
             i += 1
         self.cursor = draw.fill(1,1,w,1,None,None,None,True,True)
         self.sprite.add_sprite(self.cursor)
-        self.index = 0
-        self.items = items
 
     # This method takes the return value of gfx.get_input and handles
     # it. If a menu item is selected via Enter or keyboard shortcut,
@@ -38,11 +41,13 @@ class Menu(object):
         if c == "down": i += 1
         if i != self.index:
             i = i%len(self.items)
-            self.cursor.move_to(1,i+1)
+            if self.sprite:
+                self.cursor.move_to(1,i+1)
             self.index = i
         if c == "enter":
             report = self.items[self.index]
-            self.sprite.kill()
+            if self.sprite:
+                self.sprite.kill()
             return report
         return None
 
@@ -111,3 +116,114 @@ class Counter(object):
             self.sprite.kill()
             self.alive = False
         
+
+# The GridView draws a grid. It owns the sprite for the terrain and a sprite
+# for each unit, and subscribes to the grid's events to keep them up to date.
+# Alerts raised by the grid are turned into widgets and kept until the
+# session asks for them. The grid never needs to know that it's being drawn.
+class GridView(object):
+    def __init__(self, grid):
+        self.grid = grid
+        self.sprite = sprites.Sprite(0,0,grid.w,grid.h)
+        self.units = {}
+        self.alerts = []
+        self.reset()
+        grid.subscribe(self.notify)
+
+    # Draw everything on the grid from scratch.
+    def reset(self):
+        for u in list(self.units):
+            self.remove_unit(u)
+        for (x,y) in self.grid.all_tiles_xy():
+            self.draw_tile(x,y)
+        for u in self.grid.units:
+            self.add_unit(u)
+
+    # Stop watching the grid and take the sprites off the screen.
+    def close(self):
+        self.grid.unsubscribe(self.notify)
+        self.sprite.kill()
+
+    # Handle an event from the grid.
+    def notify(self, event, *args):
+        if event == "tile":
+            self.draw_tile(*args)
+        elif event == "unit":
+            self.color_unit(args[0])
+        elif event == "place":
+            self.place_unit(args[0])
+        elif event == "add":
+            self.add_unit(args[0])
+        elif event == "remove":
+            self.remove_unit(args[0])
+        elif event == "reset":
+            self.reset()
+        elif event == "alert":
+            loc, kind, wargs = args
+            if kind == "notify":
+                self.alerts.append((Notification(*wargs),loc))
+            elif kind == "counter":
+                self.alerts.append((Counter(*wargs),loc))
+
+    # Pump the alerts from the view.
+    def info(self):
+        oldalerts = self.alerts
+        self.alerts = []
+        return oldalerts
+
+    # Draw the tile at x,y.
+    def draw_tile(self, x, y):
+        t = self.grid.tile_at(x,y)
+        if t is None:
+            return
+        if t.team:
+            self.sprite.putc(t.icon,x,y,t.team.color,"X",True,False)
+        else:
+            self.sprite.putc(t.icon,x,y,t.color,"X",False,False)
+
+    # Make a sprite for a unit that was put on the grid.
+    def add_unit(self, unit):
+        if unit in self.units:
+            return
+        s = sprites.Sprite(0,0,1,1)
+        s.putc(unit.icon,0,0,unit.team.color,"X",True,False)
+        self.units[unit] = s
+        self.sprite.add_sprite(s)
+        self.place_unit(unit)
+        self.color_unit(unit)
+
+    # Get rid of the sprite of a unit that was taken off the grid.
+    def remove_unit(self, unit):
+        s = self.units.pop(unit, None)
+        if s:
+            s.kill()
+
+    # Move the unit's sprite to where the unit is, or hide it if the unit is
+    # being carried.
+    def place_unit(self, unit):
+        s = self.units.get(unit)
+        if s is None:
+            return
+        if unit.x is None:
+            s.hide()
+        else:
+            if not s.visible:
+                s.show()
+            s.move_to(unit.x,unit.y)
+
+    # Color the unit by its team, or gray it out if it's done for the turn.
+    def color_unit(self, unit):
+        s = self.units.get(unit)
+        if s is None:
+            return
+        if unit.ready:
+            s.colorize(unit.team.color,"X",True,False)
+        else:
+            s.colorize(fg="x")
+
+    # Move every unit on to its next frame of animation.
+    def cycle_anim(self):
+        for u,s in self.units.items():
+            # This isn't ideal, but it seems to be the only way to mix a char
+            # without recoloring.
+            s.mixc(u.cycle_anim(),0,0,None,None,None,None)
@@ -4,6 +4,9 @@
 # think about primitive drawing functions.
 
 
+from core import log
+
+
 # Try to import ASCII
 ascii_available = False
 try:
@@ -36,6 +39,8 @@ except: pass
 #   refresh()
 #   clear()
 #   draw(x,y,c,col)
+# and optionally
+#   draw_many(cells)
 gfx = None
 old_mode = "None"
 
@@ -62,8 +67,11 @@ def start(mode=None):
         raise Exception("Graphics mode %s not available."%mode)
 
 # Stop graphics. This turns off the display associated with the graphics mode.
+# Anything waiting to be logged is written first, since a crash usually
+# follows.
 def stop():
     global gfx
+    log.flush()
     if gfx:
         report = gfx.stop()
         gfx = None
@@ -76,10 +84,15 @@ def mode():
     else: return "None"
 
 # Retrieves a single unit of input as a python string. If no input, returns
-# None.
+# None. After the window is resized, what was on the screen can't be trusted,
+# so it is cleared and drawn again from scratch on the next render.
 def get_input():
     global gfx
-    if gfx: return gfx.get_input()
+    if gfx:
+        c = gfx.get_input()
+        if c == "resize":
+            clear()
+        return c
 
 # Draws the screen and controls the framerate. Should be called exactly once
 # per frame.
@@ -87,10 +100,14 @@ def refresh():
     global gfx
     if gfx: return gfx.refresh()
 
-# Clears the screen.
+# Clears the screen. The sprites don't know what's on the screen anymore, so
+# they draw everything on the next render.
 def clear():
     global gfx
-    if gfx: return gfx.clear()
+    if gfx:
+        from . import sprites
+        sprites.compositor.invalidate()
+        return gfx.clear()
 
 # Draws the character 'c' at x,y with the color code provided.
 #   Capital: Background
@@ -109,3 +126,12 @@ def draw(x,y,c,col=""):
     global gfx
     if gfx: return gfx.draw(x,y,c,col)
 
+# Draws many cells at once, where each cell is (x,y,c,col). Modes that can
+# draw in bulk do so, the others get one draw per cell.
+def draw_many(cells):
+    global gfx
+    if gfx:
+        if hasattr(gfx, "draw_many"):
+            return gfx.draw_many(cells)
+        for x,y,c,col in cells:
+            gfx.draw(x,y,c,col)
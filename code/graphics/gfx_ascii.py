@@ -12,12 +12,17 @@ import curses
 # non-interactive mode.
 _screen = None
 
+# The size of the screen as (h,w), which only changes when the terminal is
+# resized, and the curses attribute for each color string that was drawn.
+_size = (0,0)
+_attrs = {}
+
 
 # This function turns on everything required by Curses. It puts the terminal in
 # raw mode, turns of echoing, scrolling, etc. It also initializes the colors.
 # This can safely be called more than once.
 def start():
-    global _screen
+    global _screen, _size, _attrs
     if not _screen:
         _screen = curses.initscr()
         curses.noecho()
@@ -34,6 +39,8 @@ def start():
             for b in range(8):
                 curses.init_pair(i, b, a)
                 i += 1
+        _size = _screen.getmaxyx()
+        _attrs = {}
 
 # This turns off curses and makes it safe to kill the program. You can call
 # stop more than once safely. You should also be able to call start again after
@@ -87,10 +94,11 @@ _keymap ={curses.KEY_BACKSPACE: "backspace",
           curses.KEY_NPAGE:     "page_down",
           -1:                   None}
 def get_input():
-    global _screen, _keymap
+    global _screen, _keymap, _size
     if _screen:
         c = _screen.getch()
         curses.flushinp()
+        if c == curses.KEY_RESIZE: _size = _screen.getmaxyx()
         if c == 27: return "escape"
         elif c == "\b": return "backspace" #for mac
         elif c == 10 or c == 13: return "enter"
@@ -135,27 +143,54 @@ def _color(fg="w", bg="b"):
         return curses.color_pair(0)
     return curses.color_pair(1 + j*8 + i)
 
+# This returns the curses attribute for a color string. The attributes are
+# worked out once for each string and then cached. This is a private function.
+def _attr(col):
+    mod = _attrs.get(col)
+    if mod is None:
+        mod = 0
+        fg = "w"
+        bg = "X"
+        if curses.has_colors():
+            for e in col:
+                if e in "xrgybmcw": fg = e
+                if e in "XRGYBMCW": bg = e
+                if e == "!": mod |= curses.A_BOLD
+                if e == "?": mod |= curses.A_REVERSE
+            mod |= _color(fg,bg)
+        _attrs[col] = mod
+    return mod
+
 # Draw a character at X,Y. Includes boundary checking. You can also
 # include color codes. Lowercase letters are foreground, uppercase are
 # background. Use an ! for bold and ? for reverse
 def draw(x,y,c,col=""):
     global _screen
     if _screen:
-        h,w = _screen.getmaxyx()
+        h,w = _size
         if x >= 0 and x < w and y >= 0 and y < h and (x,y)!=(w-1,h-1):
-            mod = 0
-            fg = "w"
-            bg = "X"
-            if curses.has_colors():
-                for e in col:
-                    if e in "xrgybmcw": fg = e
-                    if e in "XRGYBMCW": bg = e
-                    if e == "!": mod |= curses.A_BOLD
-                    if e == "?": mod |= curses.A_REVERSE
-                mod |= _color(fg,bg)
-
+            mod = _attrs.get(col)
+            if mod is None:
+                mod = _attr(col)
             if c is not None:
                 _screen.addch(y,x,str(c),mod)
             else:
                 _screen.chgat(y,x,1,mod)
 
+# Draw a lot of cells at once. Each cell is (x,y,c,col), the same as the
+# arguments to draw.
+def draw_many(cells):
+    global _screen
+    if _screen:
+        h,w = _size
+        attrs = _attrs
+        addch = _screen.addch
+        for x,y,c,col in cells:
+            if x >= 0 and x < w and y >= 0 and y < h and (x,y)!=(w-1,h-1):
+                mod = attrs.get(col)
+                if mod is None:
+                    mod = _attr(col)
+                if c is not None:
+                    addch(y,x,str(c),mod)
+                else:
+                    _screen.chgat(y,x,1,mod)
@@ -7,6 +7,11 @@ import pygame
 if pygame.font is None:
     raise Exception("Missing pygame.font module")
 
+from core import storage
+
+import os
+import json
+
 
 # The "screen" used by Pygame. These private variables serve to do some of the
 # optimization of Curses. The 'fakescreen' keeps track of cells that have been
@@ -18,9 +23,16 @@ _sw, _sh, _tw, _th = 0,0,0,0
 _clock = None
 
 
-# The Start function creates a 24x80 tile surface attached to the window and
-# programmatically generates a font tile for each color and boldness.
-_tiles = None
+# The Start function creates a 24x80 tile surface attached to the window.
+# Font tiles are made for each character, color and boldness the first time
+# they are drawn (see _tile), so starting doesn't have to render thousands of
+# tiles that are never used. The tiles that were made are kept in an atlas on
+# disk, so the next start with the same tile size and font loads them all
+# from one image.
+_tiles = {}
+_font = None
+_fontname = None
+_made = False
 _colors = { "x": (0,0,0),
             "r": (200,0,0),
             "g": (0,200,0),
@@ -30,9 +42,9 @@ _colors = { "x": (0,0,0),
             "c": (0,200,200),
             "w": (200,200,200),
     }
-def start( screen_w=80, screen_h=24, tile_w=15, tile_h=30):
+def start( screen_w=80, screen_h=24, tile_w=15, tile_h=30, font=None):
     global _screen, _tiles, _colors, _fakescreen, _dirty, _clock
-    global _sw, _sh, _tw, _th
+    global _sw, _sh, _tw, _th, _font, _fontname, _made
     if not _screen:
         pygame.init()
         pygame.key.set_repeat(500,100)
@@ -42,36 +54,82 @@ def start( screen_w=80, screen_h=24, tile_w=15, tile_h=30):
         _changes = {}
         _clock = pygame.time.Clock()
         
-        if _tiles is None:
-            f = pygame.font.Font(None,_th-2)
-            _tiles = {}
-            for c in (" abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"+
-                      "1234567890-=\\[];',./`~!@#$%^&*()_+|{}:\"<>?"):
-             for fg in "xrgybmcw":
-              for bg in "xrgybmcw":
-               for bold in [False,True]:
-                f.set_bold(bold)
-                fg_col = _colors[fg]
-                bg_col = _colors[bg]
-                if bold:
-                    fg_col = fg_col[0]+50,fg_col[1]+50,fg_col[2]+50
-                
-                # Here we render the character and align it to our grid.
-                s1 = f.render(c,True,fg_col,bg_col).convert()
-                w,h = s1.get_size()
-                w = min(w,_tw-2)
-                s1 = pygame.transform.smoothscale(s1.convert(),(w,_th-2))
-                s2 = pygame.Surface((_tw,_th))
-                s2.fill(bg_col)
-                s2.blit(s1, (_tw//2-(w//2),1) )
-                
-                # Store the surface in the tiles dictionary.
-                _tiles[(c,fg,bg,bold)] = s2.convert()
+        _font = pygame.font.Font(font,_th-2)
+        _fontname = font or "default-%s"%pygame.version.ver
+        _tiles = _load_atlas()
+        _made = False
+
+# This renders the tile for a character in the colors and stores it in the
+# tiles dictionary.
+def _tile(c, fg, bg, bold):
+    global _tiles, _font, _made
+    key = (c,fg,bg,bold)
+    if key not in _tiles:
+        _font.set_bold(bold)
+        fg_col = _colors[fg]
+        bg_col = _colors[bg]
+        if bold:
+            fg_col = fg_col[0]+50,fg_col[1]+50,fg_col[2]+50
+        
+        # Here we render the character and align it to our grid.
+        s1 = _font.render(c,True,fg_col,bg_col).convert()
+        w,h = s1.get_size()
+        w = min(w,_tw-2)
+        s1 = pygame.transform.smoothscale(s1.convert(),(w,_th-2))
+        s2 = pygame.Surface((_tw,_th))
+        s2.fill(bg_col)
+        s2.blit(s1, (_tw//2-(w//2),1) )
+        _tiles[key] = s2.convert()
+        _made = True
+    return _tiles[key]
+
+# The atlas is saved in the cache folder of the home directory, one file for
+# each tile size and font. The file is a line of JSON with the key of every
+# tile, followed by the tiles as raw RGB, stacked on top of each other.
+def _atlas_name():
+    font = "".join(ch if ch.isalnum() else "_"
+                   for ch in os.path.basename(_fontname))
+    return "atlas-%dx%d-%s.bin"%(_tw,_th,font)
+
+# This loads the atlas of tiles that were made before. If there is no atlas
+# or it can't be read, there are no tiles yet.
+def _load_atlas():
+    f = storage.open_file("cache",_atlas_name())
+    if f is None:
+        return {}
+    try:
+        keys = json.loads(f.readline().decode("utf-8"))
+        raw = f.read()
+        atlas = pygame.image.fromstring(raw,(_tw,_th*len(keys)),"RGB")
+        tiles = {}
+        for n,(c,fg,bg,bold) in enumerate(keys):
+            rect = pygame.Rect(0,n*_th,_tw,_th)
+            tiles[(c,fg,bg,bold)] = atlas.subsurface(rect).convert()
+        return tiles
+    except:
+        return {}
+    finally:
+        f.close()
+
+# This saves every tile that has been made into the atlas.
+def _save_atlas():
+    keys = sorted(_tiles)
+    atlas = pygame.Surface((_tw,_th*len(keys)))
+    for n,key in enumerate(keys):
+        atlas.blit(_tiles[key],(0,n*_th))
+    head = json.dumps([list(k) for k in keys]).encode("utf-8")+b"\n"
+    storage.save(head+pygame.image.tostring(atlas,"RGB"),"cache",_atlas_name())
 
 # This turns off Pygame.
 def stop():
-    global _screen
+    global _screen, _made
     if _screen:
+        if _made:
+            try:
+                _save_atlas()
+            except:
+                pass
+            _made = False
         pygame.quit()
         _screen = None
 
@@ -156,7 +214,7 @@ def refresh():
             if invert:
                 fg,bg=bg,fg
             if _fakescreen.get((x,y),None) != _changes[(x,y)]:
-                _screen.blit(_tiles[(c,fg,bg,bold)],target)
+                _screen.blit(_tile(c,fg,bg,bold),target)
                 _fakescreen[(x,y)] = _changes[(x,y)]
                 dirty.append(target)
         if cleared:
@@ -44,9 +44,24 @@ def refresh():
 def clear():
     pass
 
-# Dummy method.
+# Nothing is drawn, but the cells are counted so that benchmarks can tell
+# how much drawing a frame did.
+_draws = 0
 def draw(x,y,c,col=""):
-    pass
+    global _draws
+    _draws += 1
+
+# Count a whole batch of cells.
+def draw_many(cells):
+    global _draws
+    _draws += len(cells)
+
+# Returns the number of cells drawn since the last reset, and resets it.
+def reset_draws():
+    global _draws
+    report = _draws
+    _draws = 0
+    return report
 
 
 # This clears the buffer of input. This should be done in setup(). You need
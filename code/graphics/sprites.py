@@ -7,8 +7,12 @@ from . import gfx
 from core import log
 
 # This is a glyph that is stored in the system. A glyph is a character with
-# color information, etc.
+# color information, etc. Glyphs are immutable and shared: there is only one
+# glyph for each combination of icon and colors, and it should always be
+# made with the glyph() function. Surfaces just hold references to them.
 class Glyph(object):
+    __slots__ = ["icon", "fg", "bg", "bold", "invert", "col", "partial"]
+
     def __init__(self, icon=None, fg=None, bg=None, bold=False, invert=False):
         self.icon = icon
         self.fg = fg
@@ -16,25 +20,101 @@ class Glyph(object):
         self.bold = bold
         self.invert = invert
 
-    # This mixes in another glyph into this one.
-    def mix(self, other=None):
-        newglyph = Glyph(self.icon, self.fg, self.bg, self.bold, self.invert)
-        if other:
-            if other.icon is not None: newglyph.icon = other.icon
-            if other.fg is not None: newglyph.fg = other.fg
-            if other.bg is not None: newglyph.bg = other.bg
-            if other.bold is not None: newglyph.bold = other.bold
-            if other.invert is not None: newglyph.invert = other.bold
-        return newglyph
-    
-    # Returns the color string needed for gfx.draw()
-    def color(self):
+        # The color string needed for gfx.draw()
         s = ""
         if self.fg: s += self.fg.lower()
         if self.bg: s += self.bg.upper()
         if self.bold: s += "!"
         if self.invert: s += "?"
-        return s
+        self.col = s
+
+        # A glyph with no icon or colors (like the cursor) only changes part
+        # of the cell, so it has to be mixed with whatever is under it.
+        self.partial = icon is None or fg is None or bg is None
+
+    # Glyphs are shared, so copies are the same glyph.
+    def __copy__(self):
+        return self
+    def __deepcopy__(self, memo):
+        return self
+
+    # This mixes in another glyph into this one, returning the result.
+    def mix(self, other=None):
+        if not other:
+            return self
+        icon, fg, bg = self.icon, self.fg, self.bg
+        bold, invert = self.bold, self.invert
+        if other.icon is not None: icon = other.icon
+        if other.fg is not None: fg = other.fg
+        if other.bg is not None: bg = other.bg
+        if other.bold is not None: bold = other.bold
+        if other.invert is not None: invert = other.invert
+        return glyph(icon, fg, bg, bold, invert)
+
+    # This returns the glyph with some of its colors changed. Colors that are
+    # None are left alone.
+    def recolor(self, fg=None, bg=None, bold=None, invert=None):
+        if fg is None: fg = self.fg
+        if bg is None: bg = self.bg
+        if bold is None: bold = self.bold
+        if invert is None: invert = self.invert
+        return glyph(self.icon, fg, bg, bold, invert)
+    
+    # Returns the color string needed for gfx.draw()
+    def color(self):
+        return self.col
+
+# The pool of glyphs, keyed by (icon, fg, bg, bold, invert).
+_glyphs = {}
+
+# Get the glyph for the icon and colors, making it if it doesn't exist yet.
+def glyph(icon=None, fg=None, bg=None, bold=False, invert=False):
+    key = icon, fg, bg, bold, invert
+    g = _glyphs.get(key)
+    if g is None:
+        g = Glyph(icon, fg, bg, bold, invert)
+        _glyphs[key] = g
+    return g
+
+# The compositor sits between the sprites and the graphics mode. Sprites
+# write the glyphs they would draw into the back buffer, where a sprite on a
+# higher layer overwrites the cells under it (or, for a glyph that leaves its
+# icon or some colors out, is mixed into them). Flushing compares the
+# back buffer to the front buffer (what is on the screen) and only draws the
+# cells that actually changed, each one exactly once. Since glyphs are
+# pooled, comparing two cells is just comparing two references.
+class Compositor(object):
+    def __init__(self):
+        self.back = {}
+        self.front = {}
+        self.backend = None
+        self.stale = False
+
+    # Draw the changed cells and empty the back buffer. If the graphics mode
+    # changed since the last flush, the screen is unknown, so everything is
+    # drawn.
+    def flush(self):
+        if gfx.gfx is not self.backend:
+            self.backend = gfx.gfx
+            self.front = {}
+        front = self.front
+        changed = []
+        for c,g in self.back.items():
+            if front.get(c) is not g:
+                front[c] = g
+                changed.append((c[0],c[1],g.icon,g.col))
+        self.back = {}
+        if changed:
+            gfx.draw_many(changed)
+
+    # Forget what is on the screen, such as after it was cleared. The next
+    # top sprite to be rendered draws all of itself.
+    def invalidate(self):
+        self.front = {}
+        self.stale = True
+
+# There is only one screen, so there is only one compositor.
+compositor = Compositor()
 
 # Sprites are drawables that are smart enough to know when to spend time
 # drawing and when to not. Sprites can contain subsprites in layers allowing
@@ -59,13 +139,9 @@ class Sprite(object):
         if layer is not None:
             self.layer = layer
         self.sprites = []
-        self.surface = []
-        for i in range(h):
-            newarray = []
-            for j in range(w):
-                newarray.append(None)
-            self.surface.append(newarray)
-        self.dirty = []
+        self.surface = [[None]*w for i in range(h)]
+        self.dirty = set()
+        self.rects = []
         self.moved = True
         self.alive = True
         self.visible = True
@@ -75,13 +151,17 @@ class Sprite(object):
         report = []
         for row in self.surface:
             report += row
-        return row
+        return report
 
     # This renders a sprite on the actual terminal screen starting at x,y.
-    # This will pass back up a dictionary of transparent cells to the parent
-    # to be drawn over.
+    # The update is a list of rectangles (x1,y1,x2,y2) in this sprite's
+    # coordinates that the parent redrew and so need to be drawn over. The
+    # cells go into the compositor's back buffer, and once the whole tree has
+    # been rendered, the top sprite flushes it to the screen.
     def render(self, x, y, bounds=None, update=None):
-        newbounds = ( x+self.x, y+self.y, x+self.x+self.w, y+self.y+self.h )
+        top = bounds is None
+        ox,oy = x+self.x, y+self.y
+        newbounds = ( ox, oy, ox+self.w, oy+self.h )
         if not bounds:
             bounds = newbounds
         else:
@@ -95,67 +175,90 @@ class Sprite(object):
             if self.timer == 0:
                 self.kill()
         
-        # If any of the sprites have moved, figure out which cells need to be
-        # redrawn.
-        if not update:
-            update = []
-        update += self.dirty
-        for s in [s for s in self.sprites if s.moved or not s.alive]:
-            for i in range(s.oldx,s.oldx+s.w):
-                for j in range(s.oldy,s.oldy+s.h):
-                    update.append((i,j))
+        # Gather the rectangles that need to be redrawn: the ones the parent
+        # passed down, the ones this sprite marked, its dirty cells and the
+        # old places of any sprites that moved. They're clipped to the part
+        # of this sprite that's on the screen.
+        rects = list(update) if update else []
+        rects += self.rects
+        if top and compositor.stale:
+            rects.append((0,0,self.w,self.h))
+            compositor.stale = False
+        if self.dirty:
+            rects += _coalesce(self.dirty)
+        for s in self.sprites:
+            if s.moved or not s.alive:
+                rects.append((s.oldx,s.oldy,s.oldx+s.w,s.oldy+s.h))
+        clip = bounds[0]-ox, bounds[1]-oy, bounds[2]-ox, bounds[3]-oy
+        rects = _clip(rects, clip)
         
-        # Now redraw the cells. This is usually a NOP since update is usually
-        # empty.
-        for (i,j) in update:
-            dx = i+x+self.x
-            dy = j+y+self.y
-            if (dx >= bounds[0] and dy >= bounds[1] and i<self.w and i >= 0 and
-                     j < self.h and dx<bounds[2] and dy<bounds[3] and j >= 0):
-                glyph = self.surface[j][i]
-                if glyph:
-                    gfx.draw(dx,dy,glyph.icon,glyph.color())
+        # Now redraw the cells. This is usually a NOP since there are usually
+        # no rectangles.
+        if len(rects) == 1:
+            x1,y1,x2,y2 = rects[0]
+            cells = [(i,j) for j in range(y1,y2) for i in range(x1,x2)]
+        else:
+            cells = set()
+            for (x1,y1,x2,y2) in rects:
+                for j in range(y1,y2):
+                    for i in range(x1,x2):
+                        cells.add((i,j))
+        surface = self.surface
+        back = compositor.back
+        front = compositor.front
+        for (i,j) in cells:
+            g = surface[j][i]
+            if g:
+                c = (i+ox,j+oy)
+                if g.partial:
+                    under = back.get(c) or front.get(c)
+                    if under:
+                        g = under.mix(g)
+                back[c] = g
         
-        # Set all the sprites as no longer having been moved.
+        # Set all the sprites as no longer having been moved. Each one only
+        # gets the rectangles moved into its own coordinates.
         for s in self.sprites:
             if s.visible:
-                s.render(x+self.x,y+self.y, bounds, [(i-s.x,j-s.y)
-                                                     for (i,j) in update])
+                s.render(ox, oy, bounds, [(a-s.x,b-s.y,c-s.x,d-s.y)
+                                          for (a,b,c,d) in rects])
             s.moved = False
+            s.oldx,s.oldy = s.x,s.y
         
         # Set this sprite as no longer dirty. If any children died due to the
-        # timer clock running out, store their information in self.dirty so
-        # that the next pass overwrites them.
-        self.dirty = []
+        # timer clock running out, store their rectangle so that the next
+        # pass overwrites them.
+        self.dirty = set()
+        self.rects = []
         oldsprites = self.sprites
         self.sprites = []
         for s in oldsprites:
             if s.alive:
                 self.sprites.append(s)
             else:
-                for i in range(s.x,s.x+s.w):
-                    for j in range(s.y,s.y+s.h):
-                        self.dirty.append((i,j))
+                self.rects.append((s.x,s.y,s.x+s.w,s.y+s.h))
+        if top:
+            compositor.flush()
 
     # This puts a character at x,y on the sprite. Returns True if it works,
     # False if the x,y was out of bounds.
     def putc(self, c, x, y, fg=None, bg=None, bold=False, invert=False):
-        g = Glyph(c,fg,bg,bold,invert)
+        g = glyph(c,fg,bg,bold,invert)
         if x >= 0 and x < self.w and y >= 0 and y < self.h:
             self.surface[y][x] = g
-            self.dirty.append((x,y))
+            self.dirty.add((x,y))
             return True
         return False
 
     # This allows you to recolor a cell or change the letter without changing
     # the color.
     def mixc(self, c, x, y, fg=None, bg=None, bold=False, invert=False):
-        g = Glyph(c,fg,bg,bold,invert)
-        if self.surface[y][x]:
-            g = self.surface[y][x].mix(g)
         if x >= 0 and x < self.w and y >= 0 and y < self.h:
+            g = glyph(c,fg,bg,bold,invert)
+            if self.surface[y][x]:
+                g = self.surface[y][x].mix(g)
             self.surface[y][x] = g
-            self.dirty.append((x,y))
+            self.dirty.add((x,y))
             return True
         return False
 
@@ -167,15 +270,10 @@ class Sprite(object):
 
     # This recolors a sprite.
     def colorize(self, fg=None, bg=None, bold=None, invert=None):
-        for g in self.all_glyphs():
-            if fg is not None:
-                g.fg = fg
-            if bg is not None:
-                g.bg = bg
-            if bold is not None:
-                g.bold = bold
-            if invert is not None:  
-                g.invert = invert
+        for row in self.surface:
+            for i,g in enumerate(row):
+                if g:
+                    row[i] = g.recolor(fg, bg, bold, invert)
         self.redraw()
 
     # This moves the sprite.
@@ -199,6 +297,15 @@ class Sprite(object):
     def add_sprite(self, sprite):
         self.sprites.append(sprite)
         self.sprites.sort(key=lambda s:s.layer)
+
+    # This takes a sprite away from the sprite manager without killing it,
+    # so that it can be added to another one. The place it covered is drawn
+    # over on the next render.
+    def remove_sprite(self, sprite):
+        if sprite in self.sprites:
+            self.sprites.remove(sprite)
+            self.rects.append((sprite.x,sprite.y,sprite.x+sprite.w,
+                               sprite.y+sprite.h))
     
     # This sets a sprite and all of its subsprites as dead. They will be
     # removed from their managers in the next update.
@@ -222,10 +329,8 @@ class Sprite(object):
     
     # Set the whole sprite as dirty.
     def redraw(self):
-        self.dirty = []
-        for x in range(self.w):
-            for y in range(self.h):
-                self.dirty.append((x,y))
+        self.dirty = set()
+        self.rects = [(0,0,self.w,self.h)]
 
     # Blit the other sprite onto this one.
     def blit(self, other, x, y, mix=True):
@@ -238,7 +343,34 @@ class Sprite(object):
                     if mix and g:
                         self.surface[b][a] = g.mix(other.surface[j][i])
                     else:
-                        self.surface[b][a] = other.surface[j][i].mix()
-                    self.dirty.append((a,b))
+                        self.surface[b][a] = other.surface[j][i]
+                    self.dirty.add((a,b))
 
+# This turns a set of dirty cells into rectangles, one for each run of cells
+# next to each other on a row.
+def _coalesce(cells):
+    report = []
+    run = None
+    for (y,x) in sorted((y,x) for (x,y) in cells):
+        if run and run[1] == y and run[2] == x:
+            run[2] = x+1
+        else:
+            if run:
+                report.append((run[0],run[1],run[2],run[1]+1))
+            run = [x,y,x+1]
+    if run:
+        report.append((run[0],run[1],run[2],run[1]+1))
+    return report
 
+# This clips rectangles to the area, dropping the empty ones. If one of them
+# covers the whole area, that's the only one returned.
+def _clip(rects, area):
+    x1,y1,x2,y2 = area
+    report = []
+    for (a,b,c,d) in rects:
+        a,b,c,d = max(a,x1),max(b,y1),min(c,x2),min(d,y2)
+        if a < c and b < d:
+            if (a,b,c,d) == area:
+                return [area]
+            report.append((a,b,c,d))
+    return report
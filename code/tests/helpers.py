@@ -0,0 +1,10 @@
+# This file has what more than one of the tests needs. It isn't a test itself.
+
+
+# Everything about a grid that matters to the match.
+def state(g):
+    units = sorted((u.unit, g.teams.index(u.team), u.x, u.y, u.hp, u.ammo,
+                    u.ready, len(u.carrying)) for u in g.units
+                   if u.x is not None)
+    teams = [(t.cash, t.active) for t in g.teams]
+    return (g.turn, g.day, units, teams, list(g.owner), list(g.tile_hp))
@@ -0,0 +1,69 @@
+# This file tests the AI. The searches are kept to a few iterations so that
+# they're quick and always pick the same moves.
+
+import unittest
+import random
+import json
+
+from core import ai, rules, session, storage
+
+
+# Test the AI.
+class TestAI(unittest.TestCase):
+    def setUp(self):
+        self.data = json.loads(storage.read_data("maps","Intro.json"))
+
+    # A session where both players are played by the AI.
+    def game(self, **options):
+        data = json.loads(json.dumps(self.data))
+        for p in data["players"].values():
+            p["control"] = "ai"
+            p["ai"] = options
+        return session.Session(data)
+
+    # Searching leaves the grid and its journal the way they were, and every
+    # move it tries is legal.
+    def test_search(self):
+        S = session.Session(self.data)
+        g = S.grid
+        before = (len(g.journal), [(u.x,u.y,u.hp) for u in g.units],
+                  [t.cash for t in g.teams], g.turn, g.day)
+        stats,n = ai.search(g, random.Random(1), 10, 40)
+        self.assertEqual(n, 40)
+        self.assertEqual(before, (len(g.journal),
+                                  [(u.x,u.y,u.hp) for u in g.units],
+                                  [t.cash for t in g.teams], g.turn, g.day))
+        legal = list(rules.legal_actions(g))
+        for move,(visits,value) in stats.items():
+            self.assertTrue(move in legal)
+            self.assertTrue(0 <= value <= visits)
+        self.assertEqual(sum(v for v,t in stats.values()), n)
+
+    # The same seed plays the same game, through the session like a player.
+    def test_play(self):
+        S1 = self.game(iterations=8, seed=2)
+        S2 = self.game(iterations=8, seed=2)
+        for i in range(12):
+            S1.handle_input(None)
+            S2.handle_input(None)
+        self.assertTrue(len(S1.data["history"]) >= 2)
+        self.assertEqual(S1.data["history"], S2.data["history"])
+
+    # Searching in other processes gives a legal move too.
+    def test_workers(self):
+        S = session.Session(self.data)
+        A = ai.AI(workers=2, iterations=5)
+        try:
+            move = A.choose(S.grid, S.data, S.turn())
+        finally:
+            A.close()
+        self.assertTrue(move in list(rules.legal_actions(S.grid)))
+
+    # Closing a session shuts down the worker processes of its AIs.
+    def test_close(self):
+        S = self.game(workers=2, iterations=2)
+        S.handle_input(None)
+        players = list(S.ais.values())
+        self.assertTrue(any(p.pool is not None for p in players))
+        S.close()
+        self.assertTrue(all(p.pool is None for p in players))
@@ -0,0 +1,29 @@
+# This file makes sure the benchmarks still run. They aren't timed here, they
+# just run on small maps so that changes to the engine don't break them.
+
+import unittest
+
+from graphics import gfx
+from core import grid
+from benchmarks import engine, render
+
+
+# Test the benchmarks.
+class TestBenchmarks(unittest.TestCase):
+    # Made up maps have the right size, and every operation gets a result.
+    def test_engine(self):
+        data = engine.make_map(20, 12, 0.2)
+        g = grid.Grid(data["grid"], data["rules"])
+        self.assertEqual((g.w,g.h), (20,12))
+        self.assertEqual(g.tile_at(1,1).terrain, "HQ")
+        self.assertTrue(len(g.units) > 0)
+        ops = [r["op"] for r in engine.bench(16, 0.2, 1)]
+        self.assertEqual(ops[:2], ["load","move"])
+        self.assertTrue("deepcopy" in ops)
+
+    # Every render script draws something on the Intro map.
+    def test_render(self):
+        gfx.start("testing")
+        for r in render.run("Intro.json", 1):
+            self.assertTrue(r["frames"] > 0)
+            self.assertTrue(r["draws"] > 0)
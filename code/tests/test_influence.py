@@ -0,0 +1,73 @@
+# This file tests the threat and influence layers. However the grid gets to
+# where it is, the layers should match ones worked out from scratch.
+
+import unittest
+import random
+import json
+
+from core import grid, rules, entities, storage, ai, influence
+
+
+# Test the layers.
+class TestInfluence(unittest.TestCase):
+    def setUp(self):
+        data = json.loads(storage.read_data("maps","Intro.json"))
+        self.G = grid.Grid(data["grid"], data["rules"])
+        self.G.end_turn()
+        for (name,team,x,y) in (("Infantry",1,13,9),("APC",1,14,10),
+                                ("Infantry",0,12,12),("Infantry",1,18,13)):
+            u = entities.Unit(name, self.G.rules["units"][name])
+            self.G.add_unit(u, self.G.teams[team], x, y)
+        self.G.forget()
+
+    # The layers of the grid, and layers made from scratch for it.
+    def check(self):
+        L = self.G.layers()
+        fresh = influence.Influence(self.G)
+        fresh.close()
+        for t in self.G.teams:
+            self.assertEqual(L.threats(t), fresh.threats(t))
+            self.assertEqual(L.influences(t), fresh.influences(t))
+
+    # An infantry threatens the tiles next to everywhere it can stop, so both
+    # red infantry can hit 13,8. The APC has no weapon and threatens nothing.
+    def test_threat(self):
+        red, blue = self.G.teams
+        L = self.G.layers()
+        self.assertEqual(L.danger(red, 13, 8), 1)
+        self.assertEqual(L.danger(blue, 13, 8), 2)
+        self.assertEqual(L.danger(red, 0, 0), 0)
+        self.assertTrue(L.influences(blue)[10*self.G.w+14] > 0)
+        apc = self.G.unit_at(14,10)
+        self.G.remove_unit(self.G.unit_at(13,9))
+        self.G.remove_unit(self.G.unit_at(18,13))
+        self.assertEqual(sum(L.threats(blue)), 0)
+        self.assertTrue(apc in L.cover)
+
+    # Playing random moves and rewinding keeps the layers right.
+    def test_incremental(self):
+        self.G.layers()
+        rng = random.Random(5)
+        for turn in range(6):
+            mark = self.G.checkpoint()
+            for i in range(4):
+                moves = list(rules.legal_actions(self.G))
+                ai.apply(self.G, rng.choice(moves))
+                self.check()
+            if turn%2:
+                self.G.rewind(mark)
+                self.check()
+            self.G.end_turn()
+            self.G.forget()
+        self.G.restore(self.G.snapshot())
+        self.check()
+
+    # The AI's score counts a unit for less while the team about to move
+    # could attack it. Searching keeps the layers right too.
+    def test_evaluate(self):
+        mover, other = self.G.teams
+        self.assertTrue(self.G.current_team() is mover)
+        self.assertTrue(self.G.layers().danger(other, 13, 9) > 0)
+        self.assertTrue(ai.evaluate(self.G)[1] < ai.evaluate(self.G, 0)[1])
+        ai.search(self.G, random.Random(3), 10, 20)
+        self.check()
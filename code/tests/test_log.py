@@ -0,0 +1,41 @@
+# This file tests the logger. The log file is replaced with one in memory so
+# nothing is written to disk.
+
+import unittest
+import io
+
+from core import log
+
+
+# Test the logger.
+class TestLog(unittest.TestCase):
+    def setUp(self):
+        self.old = log.logfile
+        log.logfile = io.StringIO()
+
+    def tearDown(self):
+        log.toggle(False, log.INFO, None)
+        log.logfile = self.old
+
+    # Messages are filtered by level and category, and formatted when they
+    # are written.
+    def test_filter(self):
+        log.log("off")
+        log.toggle(True, log.INFO, ["ai"])
+        self.assertFalse(log.enabled(log.DEBUG, "ai"))
+        self.assertTrue(log.enabled(log.INFO, "ai"))
+        log.log("plain %d", 1)
+        log.debug("ai", "hidden")
+        log.info("ai", "shown %s", "here")
+        log.error("render", "other category")
+        log.flush()
+        lines = log.logfile.getvalue().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertTrue(lines[0].endswith("INFO ai: shown here"))
+        log.toggle(True, log.DEBUG, None)
+        log.log("plain %d", 2)
+        log.debug("ai", "%d%%", 50)
+        log.flush()
+        lines = log.logfile.getvalue().splitlines()
+        self.assertEqual(lines[1], "plain 2")
+        self.assertTrue(lines[2].endswith("DEBUG ai: 50%"))
@@ -0,0 +1,76 @@
+# This file tests running many sessions in one manager. There's only room for
+# one loaded session, so the others keep being put away and loaded again, and
+# they should all end up the same as a session that was never put away.
+
+import unittest
+import json
+
+from core import manager, session, storage
+from tests.helpers import state
+
+
+# Test the manager.
+class TestManager(unittest.TestCase):
+    def setUp(self):
+        self.data = storage.read_data("maps","Intro.json")
+        self.S = session.Session(json.loads(self.data))
+
+    # Give the inputs to the reference session, scrolling any menu down to
+    # the item, and return the keys that were pressed.
+    def drive(self, inputs):
+        keys = []
+        for i in inputs:
+            if isinstance(i, tuple):
+                self.S.cursor = i
+                self.S.handle_input("enter")
+                keys.append(i)
+            else:
+                n = self.S.menu.items.index(i)
+                for k in ["down"]*n+["enter"]:
+                    self.S.handle_input(k)
+                    keys.append(k)
+        return keys
+
+    def test_sessions(self):
+        M = manager.Manager(1)
+        ids = [M.open(json.loads(self.data)) for i in range(3)]
+        keys = self.drive([(13,13),(13,11),"Wait",(7,13),"Infantry $1000"])
+        for k in keys:
+            for sid in ids:
+                M.send(sid, k)
+        M.run()
+        self.assertEqual(len(M.live), 1)
+        self.assertEqual(sorted(M.ids()), ids)
+        for sid in ids:
+            s = M.get(sid)
+            self.assertEqual(state(s.grid), state(self.S.grid))
+            self.assertEqual(len(s.history), 2)
+
+        # Ending the turn in a session that was put away in the middle of it
+        # saves the whole turn in its history.
+        for k in self.drive([(0,0),"End Turn"]):
+            M.send(ids[0], k)
+        M.run()
+        M.get(ids[1])
+        s = M.get(ids[0])
+        self.assertEqual(s.data["history"],
+                         json.loads(json.dumps(self.S.data["history"])))
+        self.assertEqual(state(s.grid), state(self.S.grid))
+
+    # The sessions are headless, and the name they save under and their AI
+    # players are still there after they're put away and loaded again.
+    def test_headless(self):
+        M = manager.Manager(1)
+        data = json.loads(self.data)
+        data["players"]["Ishara"]["control"] = "ai"
+        a = M.open(data)
+        s = M.get(a)
+        self.assertEqual(s.view, None)
+        self.assertEqual(s.grid.observers, [])
+        s.save_name = "game"
+        player = s.ais[s.grid.teams[1]]
+        M.open(json.loads(self.data))
+        self.assertTrue(a in M.frozen)
+        s = M.get(a)
+        self.assertEqual(s.save_name, "game")
+        self.assertTrue(s.ais[s.grid.teams[1]] is player)
@@ -0,0 +1,47 @@
+# This file tests the compact map format. The Intro map is converted from
+# JSON and loaded back, and the grid it makes should match the JSON one.
+
+import unittest
+import json
+import io
+
+from core import mapfile, storage, grid
+
+
+# Test the map files.
+class TestMapfile(unittest.TestCase):
+    def setUp(self):
+        self.text = storage.read_data("maps","Intro.json")
+        self.data = json.loads(self.text)
+        self.packed = mapfile.convert(self.text)
+
+    # The packed map is a lot smaller, and the header can be read without
+    # reading anything else.
+    def test_header(self):
+        self.assertTrue(len(self.packed)*10 < len(self.text))
+        f = io.BytesIO(self.packed)
+        header = mapfile.read_header(f)
+        self.assertEqual(header["name"], "Intro")
+        self.assertEqual((header["w"],header["h"]), (50,50))
+        self.assertEqual(header["players"], self.data["players"])
+        self.assertEqual(f.tell(), len(self.packed)-sum(n for k,n in
+                                                        header["sections"]))
+
+    # Loading the packed map gives the same grid as the JSON map.
+    def test_roundtrip(self):
+        data = mapfile.read(io.BytesIO(self.packed))
+        self.assertEqual(data["rules"], self.data["rules"])
+        self.assertEqual(data["history"], self.data["history"])
+        G1 = grid.Grid(self.data["grid"], self.data["rules"])
+        G2 = grid.Grid(data["grid"], data["rules"])
+        self.assertEqual(G1.terrain, G2.terrain)
+        self.assertEqual(G1.owner, G2.owner)
+        self.assertEqual(G1.hq, G2.hq)
+        self.assertEqual([(u.unit,u.x,u.y) for u in G1.units],
+                         [(u.unit,u.x,u.y) for u in G2.units])
+
+    # Runs survive counts that need more than one byte.
+    def test_runs(self):
+        layer = [0]*300+[2]*5+[1]+[0]*20000
+        self.assertEqual(mapfile.runs(mapfile._runs(layer)),
+                         [(300,0),(5,2),(1,1),(20000,0)])
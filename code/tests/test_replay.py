@@ -0,0 +1,60 @@
+# This file tests replaying saved histories. A few turns are played through a
+# session with random (but seeded) legal moves, and then the history that
+# the session recorded is replayed onto a fresh grid.
+
+import unittest
+import random
+import json
+
+from core import session, storage, rules, replay
+from tests.helpers import state
+
+
+# Give the session the inputs for a move, like a player would.
+def give(s, move):
+    for i in rules.inputs_for(s.grid, move):
+        if isinstance(i, tuple):
+            s.cursor = i
+            s.handle_input("enter")
+        else:
+            while s.menu.info() != i:
+                s.handle_input("down")
+            s.handle_input("enter")
+
+
+# Test replays.
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.data = storage.read_data("maps","Intro.json")
+        self.S = session.Session(json.loads(self.data))
+        self.states = [state(self.S.grid)]
+        rng = random.Random(4)
+        for turn in range(8):
+            for i in range(3):
+                moves = [m for m in rules.legal_actions(self.S.grid)
+                         if m[0] != rules.MOVE_END]
+                if moves:
+                    give(self.S, rng.choice(moves))
+            give(self.S, (rules.MOVE_END,))
+            self.states.append(state(self.S.grid))
+
+    # Loading the saved game replays it to where it was left off.
+    def test_load(self):
+        history = self.S.data["history"]
+        self.assertEqual(len(history), 8)
+        self.assertTrue(sum(len(t) for t in history) > 8)
+        data = json.loads(self.data)
+        data["history"] = json.loads(json.dumps(history))
+        S2 = session.Session(data)
+        self.assertEqual(state(S2.grid), self.states[-1])
+
+    # Seeking goes backwards and forwards through keyframes.
+    def test_seek(self):
+        data = json.loads(self.data)
+        S2 = session.Session(data)
+        R = replay.Replay(S2.grid, self.S.data["history"], 3)
+        for n in (5, 2, 8, 0, 7, 3, 3):
+            R.seek(n)
+            self.assertEqual(R.turn, n)
+            self.assertEqual(state(S2.grid), self.states[n])
+        self.assertEqual(sorted(R.keyframes), [0,3,6])
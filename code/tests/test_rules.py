@@ -0,0 +1,170 @@
+# This file tests the actions in the rules. The grid is loaded from the Intro
+# map, since it has all of the terrain and units that the rules care about.
+
+import unittest
+import json
+
+from core import grid, rules, entities, storage
+
+
+# Test the rules.
+class TestRules(unittest.TestCase):
+    def setUp(self):
+        data = json.loads(storage.read_data("maps","Intro.json"))
+        self.G = grid.Grid(data["grid"], data["rules"])
+        self.G.end_turn()
+
+    # Put a new unit of the given team on the grid.
+    def add(self, name, team, x, y):
+        u = entities.Unit(name, self.G.rules["units"][name])
+        self.G.add_unit(u, self.G.teams[team], x, y)
+        return u
+
+    # The movement range never costs more than the unit's movement, and
+    # following the path back from any tile adds up to its cost.
+    def test_move_costs(self):
+        m = rules.Move(13,13,self.G)
+        u = self.G.unit_at(13,13)
+        self.assertTrue((13,13) in m.choices)
+        self.assertEqual(m.costs[(13,13)], 0)
+        for dest in m.choices:
+            p = m.path(dest)
+            self.assertEqual(p[0], (13,13))
+            self.assertEqual(p[-1], dest)
+            total = 0
+            for (a,b),(c,d) in zip(p, p[1:]):
+                self.assertEqual(self.G.dist((a,b),(c,d)), 1)
+                total += u.terrain[self.G.tile_at(c,d).terrain]
+            self.assertEqual(total, m.costs[dest])
+            self.assertTrue(total <= u.move)
+
+    # Mountains cost two, so a unit with one point left can't climb them.
+    def test_move_terrain(self):
+        u = self.add("Infantry", 0, 14, 4)
+        u.move = 1
+        m = rules.Move(14,4,self.G)
+        self.assertTrue((13,4) in m.choices)
+        self.assertTrue((15,4) not in m.choices)
+        u.move = 2
+        m = rules.Move(14,4,self.G)
+        self.assertTrue((15,4) in m.choices)
+        self.assertTrue((16,4) not in m.choices)
+
+    # Enemy units block movement, allied units don't.
+    def test_move_blocked(self):
+        u = self.G.unit_at(13,13)
+        u.move = 2
+        mark = self.G.checkpoint()
+        self.add("Infantry", 1, 13, 12)
+        m = rules.Move(13,13,self.G)
+        self.assertTrue((13,12) not in m.choices)
+        self.assertTrue((13,11) not in m.choices)
+        self.G.rewind(mark)
+        self.add("APC", 0, 13, 12)
+        m = rules.Move(13,13,self.G)
+        self.assertTrue((13,11) in m.choices)
+        self.assertEqual(m.path((13,11)), [(13,13),(13,12),(13,11)])
+
+    # Tiles are views of the grid's arrays, so writing to one shows up in
+    # every other view of the same tile, and the journal can undo it.
+    def test_tiles(self):
+        self.assertEqual(self.G.tile_at(-1,-1), None)
+        self.assertEqual(self.G.tile_at(40,40), None)
+        self.assertEqual(self.G.get_at(40,40), (None,None))
+        t = self.G.tile_at(6,13)
+        self.assertEqual(t.terrain, "HQ")
+        self.assertTrue(t.is_hq)
+        self.assertEqual(t.team, self.G.teams[0])
+        self.assertEqual(t, self.G.tile_at(6,13))
+        mark = self.G.checkpoint()
+        self.G.set(t, "team", self.G.teams[1])
+        self.G.set(t, "hp", 40)
+        self.assertEqual(self.G.tile_at(6,13).team, self.G.teams[1])
+        self.assertEqual(self.G.tile_at(6,13).hp, 40)
+        self.G.rewind(mark)
+        self.assertEqual(self.G.tile_at(6,13).team, self.G.teams[0])
+        self.assertEqual(self.G.tile_at(6,13).hp, 100)
+        self.assertEqual(self.G.unit_at(13,13), self.G.tile_at(13,13).unit)
+
+    # The ring tables match the old way of building ranges, and finding units
+    # in range gives the same answer whether it walks tiles or units.
+    def test_range(self):
+        r1 = set(self.G.get_range(5,5,2))
+        r2 = set(self.G.get_range(5,5,2,3))
+        a1 = set([(5,7),(5,3),(7,5),(3,5),(6,6),(4,4),(6,4),(4,6)])
+        self.assertEqual(a1,r1)
+        a2 = set([(5,8),(6,7),(7,6),(8,5),(7,4),(6,3),(5,2),(4,3),(3,4),(2,5),
+                  (3,6),(4,7)]).union(a1)
+        self.assertEqual(a2,r2)
+        self.assertEqual(self.G.units_in_range(13,11,3,4), [])
+        self.assertEqual(self.G.units_in_range(13,11,2,2),
+                         [self.G.unit_at(13,13)])
+        for (x,y) in ((12,12),(13,12),(14,12),(12,13),(14,13),(13,14)):
+            self.add("Infantry", 1, x, y)
+        near = self.G.units_in_range(13,13,1,1)
+        self.assertEqual(len(near), 4)
+        self.assertEqual(len(self.G.units_in_range(13,13,0,5)), 6)
+        self.assertEqual(len(self.G.units_in_range(13,13,1,5,
+                             lambda u: u.team is self.G.teams[0])), 0)
+
+    # The per-team indexes follow units and tiles around, even on rewind.
+    def test_team_index(self):
+        red, blue = self.G.teams
+        tiles = self.G.tiles_of(red)
+        self.assertEqual(len(tiles), len([t for t in self.G.all_tiles()
+                                          if t.team is red]))
+        self.assertEqual(self.G.units_of(red), [self.G.unit_at(13,13)])
+        mark = self.G.checkpoint()
+        u = self.add("Infantry", 1, 13, 12)
+        self.assertEqual(self.G.count_units(blue), 1)
+        self.G.remove_unit(self.G.unit_at(13,13))
+        self.assertEqual(self.G.count_units(red), 0)
+        self.G.purge(red, True)
+        self.assertEqual(self.G.tiles_of(red), [])
+        self.G.rewind(mark)
+        self.assertEqual(self.G.tiles_of(red), tiles)
+        self.assertEqual(self.G.count_units(red), 1)
+        self.assertEqual(self.G.count_units(blue), 0)
+
+    # Every move that legal_actions generates can be played through the
+    # actions, and each kind of move shows up when it should.
+    def test_legal_actions(self):
+        red = self.G.teams[0]
+        self.G.set(red, "cash", 5000)
+        self.add("Infantry", 1, 13, 10)
+        apc = self.add("APC", 0, 11, 13)
+        self.add("Infantry", 0, 10, 13)
+        self.G.load_unit(self.G.unit_at(10,13), apc)
+        self.add("Infantry", 0, 12, 12)
+        kinds = set()
+        for move in rules.legal_actions(self.G):
+            kinds.add(move[0])
+            mark = self.G.checkpoint()
+            result = rules.play(self.G, rules.inputs_for(self.G, move))
+            if move[0] == rules.MOVE_END:
+                self.assertEqual(result, rules.ACT_END)
+            else:
+                self.assertEqual(result, rules.ACT_COMMIT)
+            self.G.rewind(mark)
+        self.assertEqual(kinds, set([rules.MOVE_BUILD, rules.MOVE_WAIT,
+                                     rules.MOVE_ATTACK, rules.MOVE_CAPTURE,
+                                     rules.MOVE_JOIN, rules.MOVE_LOAD,
+                                     rules.MOVE_UNLOAD, rules.MOVE_END]))
+        self.assertEqual(list(rules.legal_actions(self.G, self.G.teams[1])),
+                         [])
+
+    # The compiled damage tables agree with the unit's own rules.
+    def test_damage(self):
+        inf = self.G.unit_at(13,13)
+        apc = self.add("APC", 1, 13, 12)
+        foe = self.add("Infantry", 1, 14, 13)
+        for (a,b) in ((inf,apc),(inf,foe),(apc,inf),(foe,inf)):
+            for cover in (0,1,3):
+                self.assertEqual(self.G.damage(a,b,cover),
+                                 a.simulate(b,cover))
+        self.assertTrue(self.G.can_target(inf,apc))
+        self.assertFalse(self.G.can_target(apc,inf))
+        self.assertFalse(self.G.can_target(foe,apc))
+        inf.ammo = 0
+        self.assertEqual(self.G.damage(inf,foe,0), (None,None))
+        self.assertFalse(self.G.can_target(inf,foe))
@@ -0,0 +1,107 @@
+# This file tests saving games. A saved game, with the turns added to its
+# journal since, should load back into the same match. The home directory is
+# pointed at a temporary folder while the tests run.
+
+import unittest
+import tempfile
+import shutil
+import random
+import json
+import os
+
+from core import session, storage, rules, grid, replay
+
+
+# Test saving and loading sessions.
+class TestSave(unittest.TestCase):
+    def setUp(self):
+        self.home = os.environ.get("HOME")
+        self.temp = tempfile.mkdtemp()
+        os.environ["HOME"] = self.temp
+        self.data = storage.read_data("maps","Intro.json")
+        self.S = session.Session(json.loads(self.data))
+        self.rng = random.Random(6)
+
+    def tearDown(self):
+        storage.flush()
+        if self.home is None:
+            del os.environ["HOME"]
+        else:
+            os.environ["HOME"] = self.home
+        shutil.rmtree(self.temp)
+
+    # Play a few random actions for the current team, and end the turn if
+    # asked to.
+    def play(self, end=True):
+        for i in range(3):
+            moves = [m for m in rules.legal_actions(self.S.grid)
+                     if m[0] != rules.MOVE_END]
+            if moves:
+                move = self.rng.choice(moves)
+                inputs = rules.inputs_for(self.S.grid, move)
+                self.assertEqual(self.S.perform(inputs), rules.ACT_COMMIT)
+        if end:
+            inputs = rules.inputs_for(self.S.grid, (rules.MOVE_END,))
+            self.assertEqual(self.S.perform(inputs), rules.ACT_END)
+
+    # Turns after saving go to the journal, not the map file, and loading
+    # puts them back together, along with the actions of the turn that was
+    # in progress when the game was saved.
+    def test_journal(self):
+        self.play()
+        self.play(False)
+        self.S.save("game")
+        storage.flush()
+        size = len(storage.open_file("saves","game.row").read())
+        self.play()
+        self.play()
+        self.play(False)
+        storage.flush()
+        self.assertEqual(len(storage.open_file("saves","game.row").read()),
+                         size)
+        journal = storage.read("saves","game.journal").splitlines()
+        self.assertEqual(len(journal), 2)
+
+        L = session.load("game")
+        self.assertEqual(L.grid.hash(), self.grid_without_turn().hash())
+        self.assertEqual(len(L.data["history"]), 3)
+        self.assertEqual(L.save_name, "game")
+
+        # A record that was cut short is ignored.
+        storage.save("\n".join(journal)[:-5], "saves","game.journal")
+        L = session.load("game")
+        self.assertEqual(len(L.data["history"]), 2)
+        self.assertEqual(session.load("nothing"), None)
+
+    # The session's grid as it was at the start of the current turn.
+    def grid_without_turn(self):
+        return replay.load(self.S.export(history=True))
+
+    # Saving again starts the journal over, and a load picks up the turn in
+    # progress.
+    def test_resave(self):
+        self.S.save("game")
+        self.play()
+        self.play(False)
+        self.S.save("game")
+        storage.flush()
+        self.assertEqual(storage.read("saves","game.journal"), "")
+        L = session.load("game")
+        self.assertEqual(L.grid.hash(), self.S.grid.hash())
+        self.assertEqual(json.dumps(L.turn()), json.dumps(self.S.turn()))
+
+    # A grid exported as a new map loads into the same tiles and units.
+    def test_export(self):
+        for i in range(4):
+            self.play()
+        g = self.S.grid
+        data = self.S.export(griddata=True)
+        G = grid.Grid(data["grid"], data["rules"])
+        self.assertEqual(G.terrain, g.terrain)
+        self.assertEqual(G.owner, g.owner)
+        self.assertEqual(G.tile_hp, g.tile_hp)
+        units = lambda g: sorted((u.unit, g.teams.index(u.team), u.x, u.y,
+                                  u.hp, u.ammo, u.fuel, len(u.carrying))
+                                 for u in g.units)
+        self.assertEqual(units(G), units(g))
+        self.assertEqual([t.cash for t in G.teams], [t.cash for t in g.teams])
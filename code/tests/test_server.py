@@ -0,0 +1,144 @@
+# This file tests the match server through the loopback, so there's no
+# network involved. The players pick random legal moves from their own copies
+# of the match, and every copy should stay in step with the server's.
+
+import unittest
+import random
+import json
+
+from core import server, rules, storage
+
+
+# A spectator that only keeps the messages it's sent, without a copy of the
+# match.
+class Spectator(object):
+    def connection_made(self, transport):
+        self.transport = transport
+        self.received = []
+    def connection_lost(self, exc):
+        self.transport = None
+    def data_received(self, data):
+        self.received.extend(json.loads(l) for l in data.splitlines())
+
+
+# Test the server.
+class TestServer(unittest.TestCase):
+    def setUp(self):
+        self.S = server.Server()
+        self.sid = self.S.open(json.loads(storage.read_data("maps",
+                                                            "Intro.json")))
+        self.wire = server.Loopback(self.S)
+        self.red = self.client("Ramen")
+        self.blue = self.client("Ishara")
+        self.watcher = self.client()
+
+    # Connect a client and join the match.
+    def client(self, player=None):
+        c = self.wire.connect(server.Client())
+        c.join(self.sid, player)
+        self.wire.run()
+        return c
+
+    # The errors the client has been sent.
+    def errors(self, c):
+        return [m["msg"] for m in c.received if m["op"] == "error"]
+
+    # The server's session.
+    def session(self):
+        return self.S.manager.get(self.sid)
+
+    # Play some random moves for whoever's turn it is, then end the turn.
+    # Every copy of the match stays the same as the server's.
+    def test_play(self):
+        rng = random.Random(4)
+        players = [self.red, self.blue]
+        for turn in range(6):
+            c = players[turn%2]
+            for i in range(3):
+                moves = [m for m in rules.legal_actions(c.grid)
+                         if m[0] != rules.MOVE_END]
+                if moves:
+                    c.act(rules.inputs_for(c.grid, rng.choice(moves)))
+                    self.wire.run()
+            c.act(rules.inputs_for(c.grid, (rules.MOVE_END,)))
+            self.wire.run()
+            h = self.session().grid.hash()
+            for other in players+[self.watcher]:
+                self.assertFalse(other.desync)
+                self.assertEqual(other.grid.hash(), h)
+        self.assertEqual(self.errors(self.red), [])
+        self.assertEqual(len(self.session().data["history"]), 6)
+
+        # A client that joins late catches up from the state it's sent.
+        late = self.client()
+        self.assertEqual(late.grid.hash(), self.session().grid.hash())
+
+    # Actions out of turn, illegal actions and junk are turned down without
+    # changing anything, and only the client that sent them hears about it.
+    def test_reject(self):
+        h = self.session().grid.hash()
+        self.blue.act([(-1,-1), "End Turn"])
+        self.red.act([(-1,-1), "Nonsense"])
+        self.red.act([(0,0)])
+        self.red.act([(-1,-1), "End Turn", (3,3), "Wait"])
+        self.red.send("act", inputs=[[0,0,0]])
+        self.blue.send("join", match=[self.sid])
+        self.blue.send("join", match=self.sid, player={"Ishara": 1})
+        self.watcher.act([(-1,-1), "End Turn"])
+        self.red.transport.write(b"{not json\n")
+        self.wire.run()
+        self.assertEqual(self.errors(self.blue), ["Not your turn.",
+                                                  "Bad message.",
+                                                  "Bad message."])
+        self.assertEqual(self.errors(self.red), ["Illegal action.",
+                                                 "Illegal action.",
+                                                 "Illegal action.",
+                                                 "Bad inputs.",
+                                                 "Bad message."])
+        self.assertEqual(self.errors(self.watcher),
+                         ["Not playing in a match."])
+        self.assertEqual(self.session().grid.hash(), h)
+        self.assertEqual([m["op"] for m in self.watcher.received
+                          if m["op"] != "error"], ["state"])
+
+        # Nobody else can take a seat that's in use, until it's given up.
+        other = self.client("Ramen")
+        self.assertEqual(self.errors(other),
+                         ["Ramen is already being played."])
+        self.red.transport.close()
+        self.wire.run()
+        other.join(self.sid, "Ramen")
+        self.wire.run()
+        self.assertEqual(len(self.errors(other)), 1)
+
+    # Undoing an action takes it back everywhere.
+    def test_undo(self):
+        h = self.session().grid.hash()
+        moves = [m for m in rules.legal_actions(self.red.grid)
+                 if m[0] != rules.MOVE_END]
+        self.red.act(rules.inputs_for(self.red.grid, moves[0]))
+        self.wire.run()
+        self.assertNotEqual(self.watcher.grid.hash(), h)
+        self.red.undo()
+        self.red.undo()
+        self.wire.run()
+        self.assertEqual(self.errors(self.red), ["Nothing to undo."])
+        self.assertEqual(self.session().grid.hash(), h)
+        self.assertEqual(self.watcher.grid.hash(), h)
+        self.assertFalse(self.watcher.desync)
+
+    # Lots of idle spectators cost nothing until something happens, and then
+    # they all hear about it. Spectators that go away are forgotten.
+    def test_spectators(self):
+        crowd = [self.wire.connect(Spectator()) for i in range(2000)]
+        for c in crowd:
+            c.transport.write(server.encode({"op": "join",
+                                             "match": self.sid}))
+        self.wire.run()
+        self.red.act([(-1,-1), "End Turn"])
+        self.assertEqual(self.wire.run(), 2000+3+1)
+        self.assertTrue(all(c.received[-1]["op"] == "act" for c in crowd))
+        for c in crowd:
+            c.transport.close()
+        self.wire.run()
+        self.assertEqual(len(self.S.watchers[self.sid]), 3)
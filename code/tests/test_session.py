@@ -0,0 +1,96 @@
+# This file tests the session's state machine and the grid journal that it
+# uses to undo actions. The session is driven the same way a player would
+# drive it, by putting the cursor somewhere and pressing enter, and the grid
+# is checked to make sure that undoing leaves it the way it was found.
+
+import unittest
+import json
+
+from core import session, storage, rules
+
+
+# Put the cursor on x,y and press enter.
+def click(s, x, y):
+    s.cursor = x,y
+    s.handle_input("enter")
+
+# Scroll the open menu down to the item and select it.
+def choose(s, item):
+    while s.menu.info() != item:
+        s.handle_input("down")
+    s.handle_input("enter")
+
+# Test the session.
+class TestSession(unittest.TestCase):
+    def setUp(self):
+        data = json.loads(storage.read_data("maps","Intro.json"))
+        self.S = session.Session(data)
+        self.G = self.S.grid
+
+    # Moving a unit and then cancelling puts it back where it was.
+    def test_trash(self):
+        u = self.G.unit_at(13,13)
+        click(self.S, 13, 13)
+        click(self.S, 13, 11)
+        self.assertEqual(self.G.unit_at(13,11), u)
+        choose(self.S, "Cancel")
+        self.assertEqual(self.G.unit_at(13,13), u)
+        self.assertEqual(self.G.unit_at(13,11), None)
+        self.assertEqual((u.x,u.y), (13,13))
+        self.assertEqual(self.G.journal, [])
+        self.assertTrue(u.ready)
+
+    # Committed actions are kept, and undoing pops them one at a time.
+    def test_undo(self):
+        team = self.G.current_team()
+        cash = team.cash
+        u = self.G.unit_at(13,13)
+        click(self.S, 13, 13)
+        click(self.S, 12, 13)
+        choose(self.S, "Wait")
+        self.assertFalse(u.ready)
+        click(self.S, 7, 13)
+        choose(self.S, "Infantry $1000")
+        built = self.G.unit_at(7,13)
+        self.assertEqual(team.cash, cash-1000)
+        self.assertTrue(built in self.G.units)
+
+        # Nothing in the rules undoes yet, so we fake the order.
+        self.S.action.perform = lambda act, grid: rules.ACT_UNDO
+        click(self.S, 0, 0)
+        self.assertEqual(team.cash, cash)
+        self.assertEqual(self.G.unit_at(7,13), None)
+        self.assertTrue(built not in self.G.units)
+        self.assertEqual(self.G.unit_at(12,13), u)
+
+        self.S.action.perform = lambda act, grid: rules.ACT_RESTART
+        click(self.S, 0, 0)
+        self.assertEqual(self.G.unit_at(13,13), u)
+        self.assertTrue(u.ready)
+
+    # Removing a unit and rewinding puts it back on its tile, in the same
+    # place in the unit list, along with the units it carries.
+    def test_rewind_remove(self):
+        u = self.G.unit_at(13,13)
+        self.assertEqual(self.G.units[0], u)
+        mark = self.G.checkpoint()
+        self.G.remove_unit(u)
+        self.assertEqual(self.G.unit_at(13,13), None)
+        self.assertTrue(u not in self.G.units)
+        self.G.rewind(mark)
+        self.assertEqual(self.G.unit_at(13,13), u)
+        self.assertEqual(self.G.units[0], u)
+        s = self.S.view.units[u]
+        self.assertTrue(s.alive and s.visible)
+        self.assertEqual((s.x,s.y), (13,13))
+
+    # Ending a turn can be rewound too, even though the session forgets it.
+    def test_rewind_end_turn(self):
+        turn, day = self.G.turn, self.G.day
+        cash = [t.cash for t in self.G.teams]
+        self.G.end_turn()
+        self.G.end_turn()
+        self.assertNotEqual(cash, [t.cash for t in self.G.teams])
+        self.G.rewind()
+        self.assertEqual((self.G.turn,self.G.day), (turn,day))
+        self.assertEqual(cash, [t.cash for t in self.G.teams])
@@ -0,0 +1,145 @@
+# This file tests the sprite engine. Glyphs are shared between every sprite
+# that uses them, so changing one sprite must never change another.
+
+import unittest
+import copy
+
+from graphics import sprites, gfx
+
+
+# Stands in for a graphics mode and remembers every cell that was drawn.
+class Recorder(object):
+    def __init__(self):
+        self.drawn = []
+        self.cells = []
+        self.keys = []
+    def draw(self, x, y, c, col=""):
+        self.drawn.append((x,y))
+        self.cells.append((x,y,c,col))
+    def get_input(self):
+        return self.keys.pop(0) if self.keys else None
+    def clear(self):
+        pass
+
+
+# Test the sprites.
+class TestSprites(unittest.TestCase):
+    def setUp(self):
+        self.old = gfx.gfx
+        self.rec = gfx.gfx = Recorder()
+        self.a = sprites.Sprite(0,0,3,2)
+        self.b = sprites.Sprite(0,0,3,2)
+        self.a.fill("#","r","X",True)
+        self.b.fill("#","r","X",True)
+
+    def tearDown(self):
+        gfx.gfx = self.old
+
+    # The same icon and colors always give the same glyph.
+    def test_pool(self):
+        g = sprites.glyph("#","r","X",True)
+        self.assertTrue(self.a.surface[0][0] is g)
+        self.assertTrue(self.b.surface[1][2] is g)
+        self.assertEqual(g.color(), "rX!")
+        self.assertTrue(copy.deepcopy(self.a).surface[0][0] is g)
+
+    # Recoloring or mixing one sprite leaves the others alone.
+    def test_colorize(self):
+        self.a.colorize(fg="x")
+        self.assertEqual(self.a.surface[0][0].color(), "xX!")
+        self.assertEqual(self.b.surface[0][0].color(), "rX!")
+        self.a.mixc("5",1,1,None,None,None,None)
+        self.assertEqual(self.a.surface[1][1].icon, "5")
+        self.assertEqual(self.a.surface[1][1].color(), "xX!")
+        self.assertEqual(self.b.surface[1][1].icon, "#")
+        self.assertFalse(self.a.mixc("5",3,3))
+
+    # Mixing takes every color that isn't None from the other glyph.
+    def test_mix(self):
+        g = sprites.glyph("a","w","X",False,False)
+        h = g.mix(sprites.glyph(None,None,None,True,True))
+        self.assertEqual((h.icon,h.fg,h.bold,h.invert), ("a","w",True,True))
+        self.assertTrue(g.mix() is g)
+
+    # Dirty cells are coalesced into runs, and moving a small sprite only
+    # redraws the cells it left and the cells it moved onto. Cells under the
+    # sprite are drawn once, and cells that didn't change aren't drawn.
+    def test_dirty(self):
+        self.assertEqual(sprites._coalesce(set([(2,1),(0,0),(1,1),(1,0)])),
+                         [(0,0,2,1),(1,1,3,2)])
+        screen = sprites.Sprite(0,0,40,20)
+        screen.fill(".")
+        cursor = sprites.Sprite(5,5,1,1)
+        cursor.putc("X",0,0)
+        screen.add_sprite(cursor)
+        screen.render(0,0)
+        self.assertEqual(len(self.rec.drawn), 40*20)
+        self.rec.drawn = []
+        screen.render(0,0)
+        screen.redraw()
+        screen.render(0,0)
+        self.assertEqual(self.rec.drawn, [])
+        cursor.move(1,0)
+        screen.render(0,0)
+        self.assertEqual(sorted(self.rec.drawn), [(5,5),(6,5)])
+        self.rec.drawn = []
+        cursor.hide()
+        screen.render(0,0)
+        self.assertEqual(self.rec.drawn, [(6,5)])
+
+    # A glyph with no icon (like the cursor) over a tile that's drawn in the
+    # same frame keeps the tile's icon and colors, and only changes the rest.
+    def test_overlay(self):
+        sprites.compositor.invalidate()
+        top = sprites.Sprite(0,0,3,2)
+        cursor = sprites.Sprite(1,1,1,1,100)
+        cursor.putc(None,0,0,None,None,False,True)
+        top.add_sprite(self.a)
+        top.add_sprite(cursor)
+        top.render(0,0)
+        self.assertTrue((1,1,"#","rX?") in self.rec.cells)
+        self.assertTrue((0,0,"#","rX!") in self.rec.cells)
+
+        # Moving the cursor puts the tile back the way it was.
+        self.rec.cells = []
+        cursor.move(1,0)
+        top.render(0,0)
+        self.assertEqual(sorted(self.rec.cells),
+                         [(1,1,"#","rX!"),(2,1,"#","rX?")])
+
+    # A sprite taken off one screen and put on another is only drawn by the
+    # new one, and the old one draws over where it was.
+    def test_reparent(self):
+        sprites.compositor.invalidate()
+        old = sprites.Sprite(0,0,3,2)
+        old.fill(".")
+        new = sprites.Sprite(0,0,3,2)
+        new.fill(",")
+        overlay = sprites.Sprite(0,0,1,1)
+        overlay.putc("S",0,0)
+        old.add_sprite(overlay)
+        old.render(0,0)
+        old.remove_sprite(overlay)
+        new.add_sprite(overlay)
+        self.assertEqual(old.sprites, [])
+        self.rec.cells = []
+        old.render(0,0)
+        self.assertEqual([c[:3] for c in self.rec.cells], [(0,0,".")])
+        self.rec.cells = []
+        new.redraw()
+        new.render(0,0)
+        self.assertTrue((0,0,"S") in [c[:3] for c in self.rec.cells])
+
+    # After the window is resized, the whole screen is drawn again even
+    # though nothing in it changed.
+    def test_resize(self):
+        screen = sprites.Sprite(0,0,40,20)
+        screen.fill(".")
+        screen.render(0,0)
+        self.rec.drawn = []
+        screen.render(0,0)
+        self.assertEqual(self.rec.drawn, [])
+        self.rec.keys.append("resize")
+        self.assertEqual(gfx.get_input(), "resize")
+        screen.render(0,0)
+        self.assertEqual(len(self.rec.drawn), 40*20)
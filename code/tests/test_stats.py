@@ -0,0 +1,24 @@
+# This file tests the frame stats. The times are written straight into the
+# ring buffer so that the percentiles are known.
+
+import unittest
+
+from core import stats
+
+
+# Test the stats.
+class TestStats(unittest.TestCase):
+    # Only the last frames are kept, oldest first, once the buffer wraps.
+    def test_ring(self):
+        s = stats.Stats(4, 3)
+        for n in range(6):
+            s.times["render"][s.i] = n/1000.0
+            s.frame()
+        self.assertEqual(s.count, 6)
+        self.assertEqual([round(t*1000) for t in s.history("render")],
+                         [2,3,4,5])
+        self.assertEqual(round(s.percentile("render",50)), 4)
+        self.assertEqual(round(s.percentile("render",100)), 5)
+        data = s.export()
+        self.assertEqual(len(data["history"]), 4)
+        self.assertEqual(round(data["percentiles"]["render"]["p100"]), 5)
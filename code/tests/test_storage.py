@@ -0,0 +1,68 @@
+# This file tests saving files in the home directory, which is pointed at a
+# temporary folder while the tests run.
+
+import unittest
+import tempfile
+import shutil
+import os
+
+from core import storage
+
+
+# Test the storage.
+class TestStorage(unittest.TestCase):
+    def setUp(self):
+        self.home = os.environ.get("HOME")
+        self.temp = tempfile.mkdtemp()
+        os.environ["HOME"] = self.temp
+
+    def tearDown(self):
+        storage.flush()
+        if self.home is None:
+            del os.environ["HOME"]
+        else:
+            os.environ["HOME"] = self.home
+        shutil.rmtree(self.temp)
+
+    # The files in a folder of the home directory.
+    def files(self, *args):
+        return sorted(storage.list_files(*args))
+
+    # A save that fails part way leaves the old file alone, and nothing else
+    # behind.
+    def test_save(self):
+        self.assertTrue(storage.save("old", "saves", "a"))
+        self.assertEqual(storage.read("saves", "a"), "old")
+        self.assertFalse(storage.save(["not", "text"], "saves", "a"))
+        self.assertEqual(storage.read("saves", "a"), "old")
+        self.assertEqual(self.files("saves"), ["a"])
+        self.assertTrue(storage.save(b"new", "saves", "a"))
+        self.assertEqual(storage.read("saves", "a"), "new")
+
+    # Writes in the background happen in order, and functions are called
+    # to get the data.
+    def test_later(self):
+        storage.save_later(lambda: "x"*100000, "saves", "b")
+        storage.append_later("1\n", "saves", "b.journal")
+        storage.save_later("", "saves", "b.journal")
+        storage.append_later("2\n", "saves", "b.journal")
+        storage.append_later(b"3\n", "saves", "b.journal")
+        storage.flush()
+        self.assertEqual(len(storage.read("saves", "b")), 100000)
+        self.assertEqual(storage.read("saves", "b.journal"), "2\n3\n")
+        self.assertEqual(self.files("saves"), ["b", "b.journal"])
+
+    # Replacing a file keeps its permissions, and a new file gets the ones
+    # the umask allows rather than the temporary file's.
+    @unittest.skipIf(os.name == "nt", "no permission bits")
+    def test_mode(self):
+        umask = os.umask(0o022)
+        try:
+            self.assertTrue(storage.save("x", "saves", "c"))
+            path = os.path.join(self.temp, storage.GAME_DIR, "saves", "c")
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o644)
+            os.chmod(path, 0o640)
+            self.assertTrue(storage.save("y", "saves", "c"))
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o640)
+        finally:
+            os.umask(umask)
@@ -0,0 +1,85 @@
+# This file tests the Zobrist hash of the grid. However the grid gets to
+# where it is, the hash should match one worked out from scratch, and two
+# grids in the same state should hash the same.
+
+import unittest
+import random
+import json
+
+from core import grid, rules, entities, storage, ai
+
+
+# Test the hash.
+class TestZobrist(unittest.TestCase):
+    def make(self):
+        data = json.loads(storage.read_data("maps","Intro.json"))
+        G = grid.Grid(data["grid"], data["rules"])
+        G.end_turn()
+        for (name,team,x,y) in (("Infantry",1,13,9),("APC",1,14,10),
+                                ("Infantry",0,12,12),("Infantry",1,18,13)):
+            u = entities.Unit(name, G.rules["units"][name])
+            G.add_unit(u, G.teams[team], x, y)
+        G.forget()
+        return G
+
+    # The hash of the grid worked out from scratch.
+    def fresh(self, G):
+        G.zhash = None
+        return G.hash()
+
+    # Playing random moves, rewinding and restoring keeps the hash right, and
+    # going back to a state gives back its hash.
+    def test_incremental(self):
+        G = self.make()
+        start = G.hash()
+        snap = G.snapshot()
+        rng = random.Random(3)
+        for turn in range(8):
+            mark = G.checkpoint()
+            before = G.hash()
+            for i in range(4):
+                moves = list(rules.legal_actions(G))
+                ai.apply(G, rng.choice(moves))
+                h = G.hash()
+                self.assertEqual(h, self.fresh(G))
+            if turn%2:
+                G.rewind(mark)
+                self.assertEqual(G.hash(), before)
+                self.assertEqual(G.hash(), self.fresh(G))
+            G.end_turn()
+        self.assertNotEqual(G.hash(), start)
+        G.restore(snap)
+        self.assertEqual(G.hash(), start)
+
+    # Two copies of a match that play the same moves hash the same, and stop
+    # hashing the same as soon as one of them plays something else.
+    def test_replicas(self):
+        A,B = self.make(),self.make()
+        self.assertEqual(A.hash(), B.hash())
+        rng = random.Random(8)
+        for i in range(10):
+            moves = list(rules.legal_actions(A))
+            move = rng.choice(moves)
+            self.assertTrue(move in rules.legal_actions(B))
+            ai.apply(A, move)
+            ai.apply(B, move)
+            self.assertEqual(A.hash(), B.hash())
+        A.end_turn()
+        self.assertNotEqual(A.hash(), B.hash())
+        B.end_turn()
+        self.assertEqual(A.hash(), B.hash())
+        B.set(B.teams[0], "cash", B.teams[0].cash+1)
+        self.assertNotEqual(A.hash(), B.hash())
+
+    # Loading a unit into a carrier changes the carrier, and unloading it
+    # changes it back.
+    def test_carry(self):
+        G = self.make()
+        apc,inf = G.unit_at(14,10),G.unit_at(13,9)
+        h = G.hash()
+        mark = G.checkpoint()
+        G.load_unit(inf, apc)
+        self.assertNotEqual(G.hash(), h)
+        self.assertEqual(G.hash(), self.fresh(G))
+        G.rewind(mark)
+        self.assertEqual(G.hash(), h)